@@ -0,0 +1,182 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class AugmentationCache:
+    """
+    Persistent on-disk cache of augmentation outputs stored in SQLite.
+    Entries are content-addressed by method, parameters (including model names), input text and seed.
+    The least recently used entries are evicted when the cache grows larger than max_size_mb.
+    The cache can be shared by several threads
+
+    Args:
+        path: Path of the SQLite database
+        max_size_mb: Maximum size of the cached outputs in MB. No eviction happens if it is None
+
+    """
+
+    def __init__(
+        self, path: str = "augmentation_cache.sqlite", max_size_mb: float = None
+    ):
+        self.path = path
+        self.max_size_mb = max_size_mb
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)"
+        )
+        self.connection.commit()
+        self.size = self.stored_size()
+
+    @staticmethod
+    def file_hash(path: str):
+        """
+        Content address of a file an output depends on, like a WordNet index, to add to its parameters
+
+        Returns:
+            SHA-256 hex digest of the file
+
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(method: str, params: dict, text, seed: int = None):
+        """
+        Build the content address of an augmentation output
+
+        Args:
+            method: Name of the NLPAugmenters method
+            params: Parameters of the call, including the model names
+            text: Input text
+            seed: Seed of the random draws of the call
+
+        Returns:
+            SHA-256 hex digest
+
+        """
+        content = json.dumps(
+            [method, params, text, seed], sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Get a cached output
+
+        Args:
+            key: Key built by AugmentationCache.key
+
+        Returns:
+            The cached output or None on a cache miss
+
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self.connection.commit()
+            return json.loads(row[0])
+
+    def put(self, key: str, value):
+        """
+        Store an output in the cache
+
+        Args:
+            key: Key built by AugmentationCache.key
+            value: JSON serializable output
+
+        """
+        serialized_value = json.dumps(value, ensure_ascii=False)
+        size = len(serialized_value.encode("utf-8"))
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, serialized_value, size, time.time()),
+            )
+            self.connection.commit()
+            self.size += size
+            if (
+                self.max_size_mb is not None
+                and self.size > self.max_size_mb * 1024 * 1024
+            ):
+                self.evict()
+
+    def evict(self):
+        """
+        Evict least recently used entries until the cache fits in max_size_mb
+
+        """
+        with self.lock:
+            # Other processes may share the database, so the size is read back before evicting
+            self.size = self.stored_size()
+            max_size = self.max_size_mb * 1024 * 1024
+            rows = self.connection.execute(
+                "SELECT key, size FROM entries ORDER BY last_access"
+            )
+            evicted_keys = []
+            for key, size in rows:
+                if self.size <= max_size:
+                    break
+                evicted_keys.append((key,))
+                self.size -= size
+            self.connection.executemany(
+                "DELETE FROM entries WHERE key = ?", evicted_keys
+            )
+            self.connection.commit()
+            self.evictions += len(evicted_keys)
+
+    def stored_size(self):
+        """
+        Size of the cached outputs in bytes
+
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()[0]
+
+    def stats(self):
+        """
+        Counters of the cache since it was opened
+
+        Returns:
+            Dict with hits, misses, evictions, entries and size in bytes
+
+        """
+        with self.lock:
+            entries = self.connection.execute(
+                "SELECT COUNT(*) FROM entries"
+            ).fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size": self.stored_size(),
+            }
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,291 @@
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+
+from augmenter_registry import current_rss_mb, peak_rss_mb
+from corpus_io import open_text
+
+
+# Summed fields of the records, exported as Prometheus counters
+COUNTER_FIELDS = [
+    "wall_seconds",
+    "cpu_seconds",
+    "inputs",
+    "outputs",
+    "unique_outputs",
+    "input_tokens",
+    "output_tokens",
+    "cache_hits",
+    "cache_misses",
+]
+
+
+def as_texts(data):
+    """
+    Flatten the input or output of a call into a list of texts
+
+    """
+    if data is None:
+        return []
+    if isinstance(data, str):
+        return [data]
+    if isinstance(data, dict):
+        data = data.values()
+    return [text for item in data for text in as_texts(item)]
+
+
+def count_tokens(texts: list):
+    # Whitespace tokens, the unit the augmenters work on
+    return sum(len(text.split()) for text in texts)
+
+
+class MetricsRecorder:
+    """
+    Instrumentation of the NLPAugmenters calls and the pipeline stages.
+    Each measured call or stage gives one record with its wall time, CPU time, input and output
+    texts and tokens, cache hits, RSS and yield (unique outputs per input). Records are appended to a
+    JSON lines file and summed per kind and name for the Prometheus text format export
+
+    Args:
+        path: Path of the JSON lines file of the records. Records are only summed if it is None
+        profile: Name of a call or stage to run under cProfile, e.g. "contextualWordEmbsAug - insert".
+            It matches the full name or its part after the "/" of the part prefix
+        profile_dir: Directory of the cProfile dumps, one .prof file per profiled run
+
+    """
+
+    def __init__(
+        self, path: str = None, profile: str = None, profile_dir: str = "profiles"
+    ) -> None:
+        self.path = path
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.totals = {}
+        self.lock = threading.Lock()
+        # Stack of the measurements of the current thread, to link a call to the stage running it
+        self.local = threading.local()
+
+    def should_profile(self, name: str):
+        return self.profile is not None and self.profile in (
+            name,
+            name.split("/")[-1],
+        )
+
+    @contextlib.contextmanager
+    def measure(self, kind: str, name: str, inputs=None, **labels):
+        """
+        Measure a call or a stage
+
+        Args:
+            kind: "call" for an NLPAugmenters call, "stage" for a pipeline stage
+            name: Name of the call or stage
+            inputs: Input text or texts
+            labels: Other fields of the record, e.g. the paragraph index
+
+        Returns:
+            Context manager yielding the record. The measured code sets its "outputs" field and
+            optionally its "cache_hits" and "cache_misses" fields. Outputs too large to materialise
+            are given as an "output_summary" dict of their outputs, unique_outputs and output_tokens
+            counts instead
+
+        """
+        stack = self.local.__dict__.setdefault("stack", [])
+        record = {"kind": kind, "name": name, "pid": os.getpid()}
+        if stack:
+            record["parent"] = stack[-1]["name"]
+        record.update(labels)
+        stack.append(record)
+        profiler = cProfile.Profile() if self.should_profile(name) else None
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record["wall_seconds"] = time.perf_counter() - wall_start
+            # Process CPU time: it includes the torch threads, and the other stages running meanwhile
+            record["cpu_seconds"] = time.process_time() - cpu_start
+            stack.pop()
+            if profiler is not None:
+                record["profile"] = self.dump_profile(profiler, name)
+            self.finish(record, inputs)
+
+    def dump_profile(self, profiler: cProfile.Profile, name: str):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(
+            self.profile_dir,
+            "{}-{}-{}.prof".format(
+                name.replace("/", "_").replace(" ", ""),
+                os.getpid(),
+                time.time_ns(),
+            ),
+        )
+        profiler.dump_stats(path)
+        return path
+
+    def finish(self, record: dict, inputs):
+        input_texts = as_texts(inputs)
+        output_summary = record.pop("output_summary", None)
+        if output_summary is None:
+            output_texts = as_texts(record.pop("outputs", None))
+            output_summary = {
+                "outputs": len(output_texts),
+                "unique_outputs": len(set(output_texts) - set(input_texts)),
+                "output_tokens": count_tokens(output_texts),
+            }
+        record.update(output_summary)
+        record["inputs"] = len(input_texts)
+        record["yield"] = record["unique_outputs"] / max(1, len(input_texts))
+        record["input_tokens"] = count_tokens(input_texts)
+        record.setdefault("cache_hits", 0)
+        record.setdefault("cache_misses", 0)
+        record["rss_mb"] = current_rss_mb()
+        record["peak_rss_mb"] = max(peak_rss_mb(), record["rss_mb"])
+        record["time"] = time.time()
+        with self.lock:
+            self.add(record)
+            if self.path:
+                # One write per record: records of concurrent workers appending to the file do not interleave
+                with open(self.path, "a", encoding="utf-8") as records:
+                    records.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def add(self, record: dict):
+        key = (record["kind"], record["name"].split("/")[-1])
+        totals = self.totals.setdefault(
+            key, dict({field: 0 for field in COUNTER_FIELDS}, count=0, peak_rss_mb=0)
+        )
+        totals["count"] += 1
+        for field in COUNTER_FIELDS:
+            totals[field] += record[field]
+        totals["peak_rss_mb"] = max(totals["peak_rss_mb"], record["peak_rss_mb"])
+
+    def reset(self):
+        """
+        Forget the summed records and truncate the JSON lines file, to start a new run
+
+        """
+        with self.lock:
+            self.totals = {}
+            if self.path:
+                open(self.path, "w").close()
+
+    def load(self, path: str = None):
+        """
+        Sum the records of a JSON lines file, e.g. the records written by the worker processes
+
+        Args:
+            path: Path of the JSON lines file. Defaults to the file of this recorder
+
+        """
+        with self.lock:
+            self.totals = {}
+            with open_text(path or self.path) as records:
+                for line in records:
+                    if line.strip():
+                        self.add(json.loads(line))
+
+    def prometheus(self):
+        """
+        Export the summed records in the Prometheus text format
+
+        Returns:
+            Text of the metrics
+
+        """
+        lines = []
+        metrics = [
+            (
+                "augmentation_records_total",
+                "counter",
+                "count",
+                "Number of measured calls or stages",
+            )
+        ]
+        metrics += [
+            (
+                "augmentation_{}_total".format(field),
+                "counter",
+                field,
+                "Sum of the {} of the records".format(field.replace("_", " ")),
+            )
+            for field in COUNTER_FIELDS
+        ]
+        metrics.append(
+            (
+                "augmentation_peak_rss_bytes",
+                "gauge",
+                "peak_rss_mb",
+                "Peak RSS of the process after the calls",
+            )
+        )
+        with self.lock:
+            totals = sorted(self.totals.items())
+        for metric, metric_type, field, description in metrics:
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} {}".format(metric, metric_type))
+            for (kind, name), values in totals:
+                value = values[field]
+                if field == "peak_rss_mb":
+                    value = int(value * 1024 * 1024)
+                lines.append(
+                    '{}{{kind="{}",name="{}"}} {}'.format(
+                        metric, kind, name.replace('"', '\\"'), value
+                    )
+                )
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """
+        Write the Prometheus text format export, e.g. for the textfile collector of node_exporter
+
+        """
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as metrics:
+            metrics.write(self.prometheus())
+        os.replace(temporary_path, path)
+
+    def report(self):
+        """
+        Table of the summed records, slowest first
+
+        """
+        with self.lock:
+            totals = sorted(
+                self.totals.items(),
+                key=lambda item: item[1]["wall_seconds"],
+                reverse=True,
+            )
+        lines = [
+            "{:<6} {:<48} {:>6} {:>10} {:>10} {:>10} {:>10} {:>7} {:>9}".format(
+                "kind",
+                "name",
+                "count",
+                "wall s",
+                "cpu s",
+                "tokens in",
+                "tokens out",
+                "hits",
+                "yield",
+            )
+        ]
+        for (kind, name), values in totals:
+            lines.append(
+                "{:<6} {:<48} {:>6} {:>10.1f} {:>10.1f} {:>10} {:>10} {:>7} {:>9.2f}".format(
+                    kind,
+                    name,
+                    values["count"],
+                    values["wall_seconds"],
+                    values["cpu_seconds"],
+                    values["input_tokens"],
+                    values["output_tokens"],
+                    values["cache_hits"],
+                    values["unique_outputs"] / max(1, values["inputs"]),
+                )
+            )
+        return "\n".join(lines)
@@ -0,0 +1,725 @@
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from augmentation_cache import AugmentationCache
+from augmentation_metrics import MetricsRecorder
+from corpus_io import record_errors
+from inference_backend import BACKENDS
+from nlp_augmenters import (
+    AFTER_LABEL_TEXT_LIMIT,
+    BEFORE_LABEL_TEXT_LIMIT,
+    NLPAugmenters,
+)
+
+
+# NLPAugmenters methods served by POST /augment/<method>, each taking a text and keyword parameters
+SERVICE_METHODS = [
+    "synonymAugmenter",
+    "antonymAugmenter",
+    "contextualWordEmbsAugmenter",
+    "BackTranslationAugmenter",
+    "ContextualWordEmbsForSentenceAugmenter",
+    "generate_text_before_label_with_autoregressive_model",
+    "generate_text_after_label_with_autoregressive_model",
+]
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class Overloaded(Exception):
+    """
+    Raised when a queue of the service is full. The request is rejected with a 503 response
+
+    """
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent requests into batches. A batch starts when it holds max_batch_size texts or
+    when its first request has waited max_latency seconds, and runs in the model executor
+
+    Args:
+        name: Name of the batcher in the metrics
+        run_batch: Function taking a list of texts and returning one output per text
+        executor: Executor running the batches
+        max_batch_size: Maximum number of texts per batch
+        max_latency: Maximum time in seconds the first request of a batch waits for other requests
+        max_queue: Maximum number of requests waiting. Requests are rejected beyond it
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run_batch,
+        executor,
+        max_batch_size: int = 32,
+        max_latency: float = 0.02,
+        max_queue: int = 256,
+    ) -> None:
+        self.name = name
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.batches = 0
+        self.batch_texts = 0
+        self.requests = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.task = asyncio.get_running_loop().create_task(self.serve())
+
+    async def submit(self, texts: list, wait: bool = False):
+        """
+        Queue texts for the next batches
+
+        Args:
+            texts: Texts of the request
+            wait: Wait for room in a full queue instead of rejecting the request
+
+        Returns:
+            One output per text
+
+        """
+        future = asyncio.get_running_loop().create_future()
+        if wait:
+            await self.queue.put((texts, future, time.perf_counter()))
+        else:
+            try:
+                self.queue.put_nowait((texts, future, time.perf_counter()))
+            except asyncio.QueueFull:
+                self.rejected += 1
+                raise Overloaded("Queue of {} is full".format(self.name))
+        self.requests += 1
+        return await future
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self.queue.get()]
+            size = len(requests[0][0])
+            deadline = requests[0][2] + self.max_latency
+            while size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0 and self.queue.empty():
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    break
+                requests.append(request)
+                size += len(request[0])
+            texts = [text for request_texts, _, _ in requests for text in request_texts]
+            started = time.perf_counter()
+            self.batches += 1
+            self.batch_texts += len(texts)
+            self.wait_seconds += sum(started - queued for _, _, queued in requests)
+            try:
+                outputs = await loop.run_in_executor(
+                    self.executor, self.run_batch, texts
+                )
+            except Exception as error:
+                for _, future, _ in requests:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            start = 0
+            for request_texts, future, _ in requests:
+                if not future.done():
+                    future.set_result(outputs[start : start + len(request_texts)])
+                start += len(request_texts)
+
+    def depth(self):
+        return self.queue.qsize()
+
+
+class ServiceAugmenters(NLPAugmenters):
+    """
+    NLPAugmenters of the service. The batched methods called by the paragraph pipeline threads go
+    through the micro-batchers of the service, so the paragraphs augmented at the same time and the
+    single requests share their model batches
+
+    """
+
+    service = None
+
+    def batchContextualWordEmbsAugmenter(
+        self,
+        texts: list,
+        model_path: str = "nlpaueb/legal-bert-base-uncased",
+        actions: list = ("insert", "substitute"),
+        number_generated_examples: int = 5,
+        batch_size: int = 32,
+    ):
+        if self.service is None:
+            return super().batchContextualWordEmbsAugmenter(
+                texts, model_path, actions, number_generated_examples, batch_size
+            )
+        outputs = self.service.submit_from_thread(
+            "contextualWordEmbsAugmenter",
+            {
+                "model_path": model_path,
+                "actions": tuple(actions),
+                "number_generated_examples": number_generated_examples,
+            },
+            texts,
+        )
+        return {action: [output[action] for output in outputs] for action in actions}
+
+    def batchBackTranslationAugmenter(
+        self,
+        texts: list,
+        from_model_name: str = "facebook/wmt19-en-de",
+        to_model_name: str = "facebook/wmt19-de-en",
+        batch_size: int = 32,
+    ):
+        if self.service is None:
+            return super().batchBackTranslationAugmenter(
+                texts, from_model_name, to_model_name, batch_size
+            )
+        outputs = self.service.submit_from_thread(
+            "BackTranslationAugmenter",
+            {"from_model_name": from_model_name, "to_model_name": to_model_name},
+            texts,
+        )
+        return [output[0] for output in outputs]
+
+    def batchContextualWordEmbsForSentenceAugmenter(
+        self,
+        texts: list,
+        model_path: str = "xlnet-base-cased",
+        number_generated_examples: int = 5,
+        batch_size: int = 64,
+    ):
+        if self.service is None:
+            return super().batchContextualWordEmbsForSentenceAugmenter(
+                texts, model_path, number_generated_examples, batch_size
+            )
+        completions = getattr(self.service.model_thread, "completions", None)
+        if completions is not None:
+            # Called by a batch running on the model thread, e.g. by the XLNet methods: resubmitting to a
+            # micro-batcher would wait for the model thread itself. The prefixes completed by the batch
+            # are looked up first
+            key = (model_path, number_generated_examples)
+            missing_texts = [
+                text for text in dict.fromkeys(texts) if (key, text) not in completions
+            ]
+            if missing_texts:
+                generated = super().batchContextualWordEmbsForSentenceAugmenter(
+                    missing_texts, model_path, number_generated_examples, batch_size
+                )
+                completions.update(
+                    ((key, text), output)
+                    for text, output in zip(missing_texts, generated)
+                )
+            return [completions[key, text] for text in texts]
+        return self.service.submit_from_thread(
+            "ContextualWordEmbsForSentenceAugmenter",
+            {
+                "model_path": model_path,
+                "number_generated_examples": number_generated_examples,
+            },
+            texts,
+        )
+
+
+class AugmentationService:
+    """
+    asyncio HTTP service wrapping one warm NLPAugmenters instance.
+
+    Endpoints:
+        POST /augment/<method>: {"text": ..., other parameters of the method} -> {"outputs": [...]}
+        POST /augment_paragraph: {"paragraph": ..., "date_index_start": ..., "date_index_end": ...} -> {"paragraphs": [...]}
+        GET /metrics: queue depths, batch sizes and request counters, and the call and stage metrics, in the Prometheus text format
+        GET /health: {"status": "ok"}
+
+    Args:
+        nlpAugmenter: ServiceAugmenters instance serving every request
+        max_batch_size: Maximum number of texts per model batch
+        max_latency: Maximum time in seconds a request waits for other requests to share its batch
+        max_queue: Maximum number of requests waiting per batcher
+        max_paragraphs: Maximum number of paragraphs augmented at the same time
+        max_pending_paragraphs: Maximum number of paragraphs waiting. Paragraph requests are rejected beyond it
+        max_body_bytes: Maximum size of a request body
+
+    """
+
+    def __init__(
+        self,
+        nlpAugmenter: ServiceAugmenters,
+        max_batch_size: int = 32,
+        max_latency: float = 0.02,
+        max_queue: int = 256,
+        max_paragraphs: int = 2,
+        max_pending_paragraphs: int = 16,
+        max_body_bytes: int = 1024 * 1024,
+    ) -> None:
+        self.nlpAugmenter = nlpAugmenter
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.max_queue = max_queue
+        self.max_paragraphs = max_paragraphs
+        self.max_pending_paragraphs = max_pending_paragraphs
+        self.max_body_bytes = max_body_bytes
+        # Model batches run one at a time, each using the torch threads of the process
+        self.model_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="model"
+        )
+        self.paragraph_executor = ThreadPoolExecutor(
+            max_workers=max_paragraphs, thread_name_prefix="paragraph"
+        )
+        # State of the model thread: the XLNet completions of the running batch
+        self.model_thread = threading.local()
+        self.batchers = {}
+        self.pending_paragraphs = 0
+        self.paragraphs = 0
+        self.requests = {}
+        self.rejected = {}
+        self.request_seconds = {}
+        self.loop = None
+
+    def batcher(self, method: str, params: dict):
+        """
+        Get the micro-batcher of a method and its parameters, creating it on first use
+
+        """
+        key = (method, json.dumps(params, sort_keys=True))
+        if key not in self.batchers:
+            name = "{}({})".format(
+                method,
+                ", ".join(
+                    "{}={}".format(name, value)
+                    for name, value in sorted(params.items())
+                ),
+            )
+            self.batchers[key] = MicroBatcher(
+                name,
+                functools.partial(self.run_batch, method, params),
+                self.model_executor,
+                max_batch_size=self.max_batch_size,
+                max_latency=self.max_latency,
+                max_queue=self.max_queue,
+            )
+        return self.batchers[key]
+
+    def run_batch(self, method: str, params: dict, texts: list):
+        """
+        Run a method on a batch of texts, with the batched NLPAugmenters method when there is one
+
+        Returns:
+            One output per text
+
+        """
+        self.model_thread.completions = {}
+        if method in [
+            "generate_text_before_label_with_autoregressive_model",
+            "generate_text_after_label_with_autoregressive_model",
+        ]:
+            # The prefixes of every request of the batch are completed in one XLNet call, the call of
+            # each request then finds its completions
+            after_label = (
+                method == "generate_text_after_label_with_autoregressive_model"
+            )
+            text_limit = params.get(
+                "text_limit",
+                AFTER_LABEL_TEXT_LIMIT if after_label else BEFORE_LABEL_TEXT_LIMIT,
+            )
+            self.nlpAugmenter.batchContextualWordEmbsForSentenceAugmenter(
+                [
+                    NLPAugmenters.autoregressive_prefix(text, text_limit, after_label)
+                    for text in texts
+                ],
+                model_path=params.get("model_path", "xlnet-base-cased"),
+                number_generated_examples=params.get("number_generated_examples", 5),
+                batch_size=self.max_batch_size,
+            )
+        if method == "contextualWordEmbsAugmenter":
+            actions = params.get("actions") or (params.get("action", "insert"),)
+            outputs = NLPAugmenters.batchContextualWordEmbsAugmenter(
+                self.nlpAugmenter,
+                texts,
+                model_path=params.get("model_path", "nlpaueb/legal-bert-base-uncased"),
+                actions=actions,
+                number_generated_examples=params.get("number_generated_examples", 5),
+                batch_size=self.max_batch_size,
+            )
+            if "actions" in params:
+                return [
+                    {action: outputs[action][index] for action in actions}
+                    for index in range(len(texts))
+                ]
+            return outputs[actions[0]]
+        if method == "BackTranslationAugmenter":
+            outputs = NLPAugmenters.batchBackTranslationAugmenter(
+                self.nlpAugmenter,
+                texts,
+                batch_size=self.max_batch_size,
+                **params,
+            )
+            return [[output] for output in outputs]
+        if method == "ContextualWordEmbsForSentenceAugmenter":
+            return NLPAugmenters.batchContextualWordEmbsForSentenceAugmenter(
+                self.nlpAugmenter,
+                texts,
+                batch_size=self.max_batch_size,
+                **params,
+            )
+        # The other augmenters have no batched form, their requests still share one executor job
+        return [getattr(self.nlpAugmenter, method)(text, **params) for text in texts]
+
+    def submit_from_thread(self, method: str, params: dict, texts: list):
+        """
+        Submit texts to a micro-batcher from a paragraph pipeline thread and wait for their outputs.
+        The paragraph was admitted already, its texts wait for room in a full queue
+
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.submit(method, params, texts, wait=True), self.loop
+        ).result()
+
+    async def submit(self, method: str, params: dict, texts: list, wait: bool = False):
+        return await self.batcher(method, params).submit(texts, wait)
+
+    async def augment(self, method: str, body: dict):
+        if method not in SERVICE_METHODS:
+            return 404, {"error": "Unknown augmenter {}".format(method)}
+        params = dict(body)
+        text = params.pop("text", None)
+        if not isinstance(text, str):
+            return 400, {"error": "The body needs a text field"}
+        # A request with wrong parameters is rejected here, it would fail the whole batch it joins
+        try:
+            inspect.signature(getattr(NLPAugmenters, method)).bind(
+                self.nlpAugmenter, text, **params
+            )
+        except TypeError as error:
+            return 400, {"error": str(error)}
+        outputs = await self.submit(method, params, [text])
+        return 200, {"outputs": outputs[0]}
+
+    async def augment_paragraph(self, body: dict):
+        from data_augmentation import augment_paragraph
+
+        # The date labels are checked like the records of a corpus, a paragraph with several labels has
+        # their date_spans
+        errors = record_errors(body)
+        if errors:
+            return 400, {
+                "error": "The paragraph is not valid: {}".format(", ".join(errors))
+            }
+        if self.pending_paragraphs >= self.max_pending_paragraphs:
+            self.rejected["augment_paragraph"] = (
+                self.rejected.get("augment_paragraph", 0) + 1
+            )
+            raise Overloaded("Too many paragraphs waiting")
+        self.pending_paragraphs += 1
+        index_element = self.paragraphs
+        self.paragraphs += 1
+        try:
+            paragraphs = await self.loop.run_in_executor(
+                self.paragraph_executor,
+                augment_paragraph,
+                self.nlpAugmenter,
+                body,
+                index_element,
+            )
+        finally:
+            self.pending_paragraphs -= 1
+        return 200, {"paragraphs": list(paragraphs)}
+
+    async def route(self, method: str, path: str, body: bytes):
+        """
+        Answer a request
+
+        Returns:
+            HTTP status, response body (dict, or str for the metrics) and endpoint name
+
+        """
+        path = urlsplit(path).path.rstrip("/")
+        if path == "/health":
+            return 200, {"status": "ok"}, "health"
+        if path == "/metrics":
+            return 200, self.prometheus(), "metrics"
+        if path == "/augment_paragraph" or path.startswith("/augment/"):
+            endpoint = path.split("/")[-1]
+            if method != "POST":
+                return 405, {"error": "Use POST"}, endpoint
+            try:
+                body = json.loads(body or b"{}")
+            except ValueError:
+                return 400, {"error": "The body is not valid JSON"}, endpoint
+            if not isinstance(body, dict):
+                return 400, {"error": "The body must be a JSON object"}, endpoint
+            if endpoint == "augment_paragraph":
+                status, response = await self.augment_paragraph(body)
+            else:
+                status, response = await self.augment(endpoint, body)
+            return status, response, endpoint
+        return 404, {"error": "Unknown path {}".format(path)}, "unknown"
+
+    async def handle(self, reader, writer):
+        """
+        Serve the HTTP/1.1 requests of a connection, kept alive until the client closes it
+
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > self.max_body_bytes:
+                    await self.respond(writer, 413, {"error": "Body too large"})
+                    break
+                body = await reader.readexactly(length) if length else b""
+                started = time.perf_counter()
+                endpoint = "unknown"
+                try:
+                    status, response, endpoint = await self.route(method, path, body)
+                except Overloaded as error:
+                    status, response = 503, {"error": str(error)}
+                except Exception as error:
+                    status, response = 500, {
+                        "error": "{}: {}".format(type(error).__name__, error)
+                    }
+                self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+                self.request_seconds[endpoint] = (
+                    self.request_seconds.get(endpoint, 0.0)
+                    + time.perf_counter()
+                    - started
+                )
+                await self.respond(writer, status, response)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status: int, response):
+        if isinstance(response, str):
+            content_type = "text/plain; version=0.0.4"
+            payload = response.encode("utf-8")
+        else:
+            content_type = "application/json"
+            payload = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        headers = [
+            "HTTP/1.1 {} {}".format(status, HTTP_REASONS[status]),
+            "Content-Type: {}".format(content_type),
+            "Content-Length: {}".format(len(payload)),
+        ]
+        if status == 503:
+            # Backpressure: clients retry after a delay instead of queueing more work
+            headers.append("Retry-After: 1")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + payload)
+        await writer.drain()
+
+    def prometheus(self):
+        """
+        Export the service metrics and the call and stage metrics in the Prometheus text format
+
+        """
+        lines = []
+
+        def add(metric: str, metric_type: str, description: str, values: list):
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} {}".format(metric, metric_type))
+            for labels, value in values:
+                lines.append(
+                    "{}{{{}}} {}".format(
+                        metric,
+                        ",".join(
+                            '{}="{}"'.format(name, str(label).replace('"', '\\"'))
+                            for name, label in labels.items()
+                        ),
+                        value,
+                    )
+                )
+
+        batchers = list(self.batchers.values())
+        add(
+            "augmentation_service_queue_depth",
+            "gauge",
+            "Number of requests waiting for a batch",
+            [({"batcher": batcher.name}, batcher.depth()) for batcher in batchers],
+        )
+        add(
+            "augmentation_service_batches_total",
+            "counter",
+            "Number of model batches",
+            [({"batcher": batcher.name}, batcher.batches) for batcher in batchers],
+        )
+        add(
+            "augmentation_service_batch_texts_total",
+            "counter",
+            "Number of texts of the model batches",
+            [({"batcher": batcher.name}, batcher.batch_texts) for batcher in batchers],
+        )
+        add(
+            "augmentation_service_batch_wait_seconds_total",
+            "counter",
+            "Time the requests waited for their batch",
+            [({"batcher": batcher.name}, batcher.wait_seconds) for batcher in batchers],
+        )
+        add(
+            "augmentation_service_rejected_total",
+            "counter",
+            "Number of requests rejected because a queue was full",
+            [({"batcher": batcher.name}, batcher.rejected) for batcher in batchers]
+            + [
+                ({"batcher": endpoint}, rejected)
+                for endpoint, rejected in self.rejected.items()
+            ],
+        )
+        add(
+            "augmentation_service_pending_paragraphs",
+            "gauge",
+            "Number of paragraphs being augmented or waiting",
+            [({}, self.pending_paragraphs)],
+        )
+        add(
+            "augmentation_service_requests_total",
+            "counter",
+            "Number of answered requests",
+            [
+                ({"endpoint": endpoint}, count)
+                for endpoint, count in self.requests.items()
+            ],
+        )
+        add(
+            "augmentation_service_request_seconds_total",
+            "counter",
+            "Time spent answering the requests",
+            [
+                ({"endpoint": endpoint}, seconds)
+                for endpoint, seconds in self.request_seconds.items()
+            ],
+        )
+        return "\n".join(lines) + "\n" + self.nlpAugmenter.metrics.prometheus()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080):
+        """
+        Serve requests until the task is cancelled
+
+        """
+        self.loop = asyncio.get_running_loop()
+        self.nlpAugmenter.service = self
+        server = await asyncio.start_server(self.handle, host, port)
+        print("Augmentation service listening on http://{}:{}".format(host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.nlpAugmenter.service = None
+            self.model_executor.shutdown(wait=False)
+            self.paragraph_executor.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="HTTP service augmenting texts and paragraphs with one warm NLPAugmenters instance"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=32,
+        help="Maximum number of texts per model batch",
+    )
+    parser.add_argument(
+        "--max-latency-ms",
+        type=float,
+        default=20,
+        help="Maximum time a request waits for other requests to share its batch",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=256,
+        help="Maximum number of requests waiting per batcher, requests beyond it get a 503 response",
+    )
+    parser.add_argument(
+        "--max-paragraphs",
+        type=int,
+        default=2,
+        help="Number of paragraphs augmented at the same time",
+    )
+    parser.add_argument(
+        "--max-pending-paragraphs",
+        type=int,
+        default=16,
+        help="Maximum number of paragraphs waiting, paragraph requests beyond it get a 503 response",
+    )
+    parser.add_argument(
+        "--preload",
+        nargs="*",
+        help="Augmenters loaded before serving, every augmenter if the flag has no value",
+    )
+    parser.add_argument(
+        "--cache",
+        default="augmentation_cache.sqlite",
+        help="Path of the persistent augmentation cache",
+    )
+    parser.add_argument(
+        "--metrics",
+        default=None,
+        help="Path of the JSON lines file of the per-call and per-stage metrics",
+    )
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32")
+    parser.add_argument("--artifacts-dir", default="inference_artifacts")
+    parser.add_argument("--wordnet-index", default=None)
+    args = parser.parse_args()
+
+    nlpAugmenter = ServiceAugmenters(
+        cache=AugmentationCache(args.cache) if args.cache else None,
+        metrics=MetricsRecorder(args.metrics),
+        backend=args.backend,
+        artifacts_dir=args.artifacts_dir,
+        wordnet_index=args.wordnet_index,
+    )
+    # The model and paragraph threads would otherwise import the models at the same time
+    nlpAugmenter.import_models()
+    if args.preload is not None:
+        nlpAugmenter.preload(*args.preload)
+    service = AugmentationService(
+        nlpAugmenter,
+        max_batch_size=args.max_batch_size,
+        max_latency=args.max_latency_ms / 1000,
+        max_queue=args.max_queue,
+        max_paragraphs=args.max_paragraphs,
+        max_pending_paragraphs=args.max_pending_paragraphs,
+    )
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
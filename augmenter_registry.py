@@ -0,0 +1,240 @@
+import ctypes
+import ctypes.util
+import gc
+import os
+import resource
+import sys
+import threading
+from collections import OrderedDict
+
+
+# nlpaug keeps its own module level caches of loaded models, an evicted augmenter
+# only frees memory once its model is dropped from those caches as well
+NLPAUG_MODEL_CACHES = [
+    ("nlpaug.augmenter.word.back_translation", "BACK_TRANSLATION_MODELS"),
+    ("nlpaug.augmenter.word.context_word_embs", "CONTEXT_WORD_EMBS_MODELS"),
+    (
+        "nlpaug.augmenter.sentence.context_word_embs_sentence",
+        "CONTEXT_WORD_EMBS_SENTENCE_MODELS",
+    ),
+]
+
+
+def current_rss_mb():
+    """
+    Get the resident set size of the current process
+
+    Returns:
+        RSS in MB. Falls back to the peak RSS when /proc is not available
+
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """
+    Get the peak resident set size of the current process
+
+    Returns:
+        Peak RSS in MB
+
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    if sys.platform == "darwin":
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+
+def trim_heap():
+    """
+    Return the memory freed by released models to the operating system. glibc keeps freed memory in
+    its heap for later allocations, the RSS would not go down otherwise. Does nothing on other C libraries
+
+    """
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+        libc.malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def forget_nlpaug_model(augmenter):
+    """
+    Remove the model of an augmenter from the nlpaug module level caches
+
+    Args:
+        augmenter: nlpaug augmenter whose model should be released
+
+    """
+    model = getattr(augmenter, "model", None)
+    if model is None:
+        return
+    for module_name, cache_name in NLPAUG_MODEL_CACHES:
+        module = sys.modules.get(module_name)
+        cache = getattr(module, cache_name, None)
+        if not cache:
+            continue
+        for key in [key for key, value in cache.items() if value is model]:
+            del cache[key]
+
+
+class AugmenterRegistry:
+    """
+    Registry of built augmenters keyed by their class and constructor parameters.
+    Augmenters are reused across calls and the least recently used ones are evicted
+    when the process RSS exceeds max_rss_mb. The registry can be shared by several threads
+
+    Args:
+        max_rss_mb: RSS budget in MB. No eviction happens if it is None
+        prepare: Function called on each newly built augmenter and returning it, e.g. to convert its models
+        torch_threads: Torch intra-op threads, set with one inter-op thread once torch is imported by the
+            first augmenter with a model. The torch defaults are kept if it is None
+
+    """
+
+    def __init__(
+        self, max_rss_mb: float = None, prepare=None, torch_threads: int = None
+    ) -> None:
+        self.max_rss_mb = max_rss_mb
+        self.prepare = prepare
+        self.torch_threads = torch_threads
+        self.torch_configured = False
+        self.augmenters = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def key(factory, params: dict):
+        """
+        Build the registry key of an augmenter
+
+        Args:
+            factory: Augmenter class or function building the augmenter
+            params: Constructor parameters
+
+        Returns:
+            Hashable key
+
+        """
+        name = "{}.{}".format(factory.__module__, factory.__qualname__)
+        return name, tuple(sorted(params.items()))
+
+    def get(self, factory, **params):
+        """
+        Get the augmenter built by factory(**params), building it on first use
+
+        Args:
+            factory: Augmenter class or function building the augmenter
+            params: Constructor parameters
+
+        Returns:
+            The augmenter
+
+        """
+        key = self.key(factory, params)
+        with self.lock:
+            if key in self.augmenters:
+                self.augmenters.move_to_end(key)
+                return self.augmenters[key]
+            # torch is imported by the module of the factory, see NLPAugmenters.import_models
+            self.configure_torch()
+            augmenter = factory(**params)
+            self.configure_torch()
+            if self.prepare is not None:
+                augmenter = self.prepare(augmenter)
+            self.augmenters[key] = augmenter
+            self.loads += 1
+            self.evict()
+            return augmenter
+
+    def configure_torch(self):
+        """
+        Limit the torch threads of the process the first time torch is found imported. torch is imported
+        lazily, by the first augmenter with a model, so the processes that never load one do not pay for it
+
+        """
+        if self.torch_threads is None or self.torch_configured:
+            return
+        torch = sys.modules.get("torch")
+        if torch is None:
+            return
+        self.torch_configured = True
+        torch.set_num_threads(self.torch_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # The inter-op threads can only be set before torch runs inter-op parallel work
+            pass
+
+    def preload(self, factory, **params):
+        """
+        Build an augmenter ahead of its first use
+
+        Args:
+            factory: Augmenter class or function building the augmenter
+            params: Constructor parameters
+
+        """
+        self.get(factory, **params)
+
+    def release(self, factory=None, **params):
+        """
+        Release augmenters and their models
+
+        Args:
+            factory: Augmenter class or function building the augmenter. If it is None, every augmenter is released
+            params: Constructor parameters. If they are not given, every augmenter built by factory is released
+
+        Returns:
+            Number of released augmenters
+
+        """
+        with self.lock:
+            if factory is None:
+                keys = list(self.augmenters)
+            elif params:
+                keys = [self.key(factory, params)]
+            else:
+                name = self.key(factory, {})[0]
+                keys = [key for key in self.augmenters if key[0] == name]
+            released = 0
+            for key in keys:
+                augmenter = self.augmenters.pop(key, None)
+                if augmenter is not None:
+                    forget_nlpaug_model(augmenter)
+                    released += 1
+        if released:
+            gc.collect()
+            trim_heap()
+        return released
+
+    def evict(self):
+        """
+        Evict least recently used augmenters until the RSS is below max_rss_mb.
+        The most recently used augmenter is always kept
+
+        """
+        if self.max_rss_mb is None:
+            return
+        while len(self.augmenters) > 1 and current_rss_mb() > self.max_rss_mb:
+            _, augmenter = self.augmenters.popitem(last=False)
+            forget_nlpaug_model(augmenter)
+            del augmenter
+            gc.collect()
+            trim_heap()
+            self.evictions += 1
+
+    def __contains__(self, key) -> bool:
+        return key in self.augmenters
+
+    def __len__(self) -> int:
+        return len(self.augmenters)
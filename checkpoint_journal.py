@@ -0,0 +1,150 @@
+import hashlib
+import json
+import sqlite3
+
+
+def paragraph_hash(element: dict):
+    """
+    Hash of a paragraph and its label indexes, used to check that a journal matches the corpus
+
+    """
+    fields = [
+        element["paragraph"],
+        element["date_index_start"],
+        element["date_index_end"],
+    ]
+    # Records with a single label are hashed from their date_index_start and date_index_end only
+    if "date_spans" in element:
+        fields.append(element["date_spans"])
+    content = json.dumps(fields, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class CheckpointJournal:
+    """
+    Write-ahead journal of an augmentation run stored in SQLite.
+    It records the output of each completed (paragraph, part, stage) and the last paragraph whose
+    output is committed, so an interrupted run can resume from the first incomplete stage.
+    Stage outputs of a paragraph are dropped once its output is committed
+
+    Args:
+        path: Path of the SQLite database
+
+    """
+
+    def __init__(self, path: str = "augmentation_journal.sqlite") -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS stages ("
+            "paragraph_index INTEGER NOT NULL, paragraph_hash TEXT NOT NULL, "
+            "stage TEXT NOT NULL, output TEXT NOT NULL, "
+            "PRIMARY KEY (paragraph_index, stage))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self.connection.commit()
+
+    def reset(self):
+        """
+        Forget every recorded stage and commit, to start a new run
+
+        """
+        self.connection.execute("DELETE FROM stages")
+        self.connection.execute("DELETE FROM state")
+        self.connection.commit()
+
+    def record_stage(
+        self, paragraph_index: int, paragraph_hash: str, stage: str, output
+    ):
+        """
+        Record the output of a completed stage
+
+        Args:
+            paragraph_index: Index of the paragraph in the corpus
+            paragraph_hash: Hash of the paragraph returned by paragraph_hash
+            stage: Name of the stage, including the part of the paragraph
+            output: JSON serializable output of the stage
+
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO stages (paragraph_index, paragraph_hash, stage, output) VALUES (?, ?, ?, ?)",
+            (paragraph_index, paragraph_hash, stage, json.dumps(output)),
+        )
+        self.connection.commit()
+
+    def completed_stages(self, paragraph_index: int, paragraph_hash: str):
+        """
+        Get the recorded stage outputs of a paragraph
+
+        Args:
+            paragraph_index: Index of the paragraph in the corpus
+            paragraph_hash: Hash of the paragraph. Stages recorded for another paragraph are ignored
+
+        Returns:
+            Dict of stage name: stage output
+
+        """
+        rows = self.connection.execute(
+            "SELECT stage, output FROM stages WHERE paragraph_index = ? AND paragraph_hash = ?",
+            (paragraph_index, paragraph_hash),
+        )
+        return {stage: json.loads(output) for stage, output in rows}
+
+    def commit_paragraph(self, paragraph_index: int, writer_state: dict = None):
+        """
+        Mark the output of every paragraph up to paragraph_index as committed and compact the journal
+
+        Args:
+            paragraph_index: Index of the last paragraph whose output is written
+            writer_state: State of the output writer after writing it, used to resume the output
+
+        """
+        self.connection.execute(
+            "DELETE FROM stages WHERE paragraph_index <= ?", (paragraph_index,)
+        )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO state (name, value) VALUES ('committed_through', ?)",
+            (json.dumps(paragraph_index),),
+        )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO state (name, value) VALUES ('writer_state', ?)",
+            (json.dumps(writer_state),),
+        )
+        self.connection.commit()
+        # Move the committed pages back into the database file so the WAL does not grow with the run
+        self.connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def state(self, name: str, default=None):
+        row = self.connection.execute(
+            "SELECT value FROM state WHERE name = ?", (name,)
+        ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_state(self, name: str, value):
+        """
+        Record a JSON serializable value of the run, like its settings
+
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO state (name, value) VALUES (?, ?)",
+            (name, json.dumps(value)),
+        )
+        self.connection.commit()
+
+    @property
+    def committed_through(self):
+        """
+        Index of the last paragraph whose output is committed, -1 if there is none
+
+        """
+        return self.state("committed_through", -1)
+
+    @property
+    def writer_state(self):
+        return self.state("writer_state")
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,460 @@
+import gzip
+import json
+import os
+import re
+
+from paragraph_combination import intern_parts
+
+
+CORPUS_FIELDS = ["paragraph", "date_index_start", "date_index_end"]
+
+# Dictionary-encoded columns of the Parquet shards, joined with spaces into the paragraph
+PARQUET_PART_COLUMNS = ["first_part", "date", "second_part"]
+
+
+def open_text(path: str, mode: str = "rt"):
+    """
+    Open a text file, gzip-compressed if its name ends with .gz
+
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def label_spans(record: dict):
+    """
+    Character offsets of the date labels of a corpus record: its date_spans if it has several labels,
+    else its date_index_start and date_index_end
+
+    Returns:
+        List of (start, end) pairs, end excluded, in the order of the paragraph
+
+    """
+    if "date_spans" in record:
+        return [(start, end) for start, end in record["date_spans"]]
+    return [(record["date_index_start"], record["date_index_end"])]
+
+
+def split_parts(paragraph: str, spans: list):
+    """
+    Split a paragraph around its date labels. The whitespace following a label is dropped with it,
+    a punctuation mark is kept in the next part
+
+    Args:
+        paragraph: Text of the paragraph
+        spans: (start, end) character offsets of its labels, returned by label_spans
+
+    Returns:
+        List of the text before the first label, the texts between consecutive labels and the text
+        after the last label
+
+    """
+    texts = []
+    position = 0
+    for start, end in spans:
+        texts.append(paragraph[position:start])
+        position = end + 1 if paragraph[end : end + 1].isspace() else end
+    return texts + [paragraph[position:]]
+
+
+def has_words(text: str):
+    """
+    Check that a part of a paragraph has a word to augment, a part made only of punctuation has none
+
+    """
+    return re.search(r"\w", text) is not None
+
+
+def record_errors(record: dict):
+    """
+    Check a corpus record: its fields, labels within the paragraph, in order and apart from each
+    other, and text after each label. A record with several labels has their [start, end] offsets in date_spans, the first
+    one being date_index_start and date_index_end, and optionally their normalized_dates. Every part
+    after a label needs a word: a label followed by punctuation only, like the date ending a sentence,
+    leaves nothing to augment
+
+    Returns:
+        List of error messages, empty for a valid record
+
+    """
+    missing_fields = [field for field in CORPUS_FIELDS if field not in record]
+    if missing_fields:
+        return ["missing {}".format(", ".join(missing_fields))]
+    spans = label_spans(record)
+    if not spans:
+        return ["date_spans is empty"]
+    errors = []
+    if spans[0] != (record["date_index_start"], record["date_index_end"]):
+        errors.append(
+            "date_index_start and date_index_end are not the first of date_spans"
+        )
+    previous_end = None
+    for start, end in spans:
+        if not 0 <= start < end <= len(record["paragraph"]):
+            errors.append("label {}:{} is out of the paragraph".format(start, end))
+        elif previous_end is not None and start < previous_end:
+            errors.append("label {}:{} overlaps the previous label".format(start, end))
+        previous_end = end
+    if not errors:
+        # The parts after the labels are augmented and combined like the others
+        parts = split_parts(record["paragraph"], spans)[1:]
+        for (start, end), part in zip(spans, parts):
+            if not has_words(part):
+                errors.append("no text after label {}:{}".format(start, end))
+    if "normalized_dates" in record and len(record["normalized_dates"]) != len(spans):
+        errors.append("normalized_dates does not have one date per label")
+    return errors
+
+
+def read_corpus(path: str):
+    """
+    Stream the paragraphs of a JSONL corpus, one record per line
+
+    Args:
+        path: Path of the JSONL file (optionally gzip-compressed) with paragraph, date_index_start and date_index_end records,
+            and the date_spans of the records with several date labels
+
+    Returns:
+        Generator of dicts
+
+    """
+    with open_text(path) as corpus:
+        for line_number, line in enumerate(corpus, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            errors = record_errors(record)
+            if errors:
+                raise ValueError(
+                    "Line {} of {}: {}".format(line_number, path, ", ".join(errors))
+                )
+            yield record
+
+
+class ShardedJsonlWriter:
+    """
+    Incremental writer of JSONL records split into shards of at most shard_size records.
+    Records are written as soon as they are received, so memory does not grow with the corpus
+
+    Args:
+        output_dir: Directory of the shards
+        prefix: Prefix of the shard file names
+        shard_size: Maximum number of records per shard
+        compress: Compress the shards with gzip
+        state: State returned by ShardedJsonlWriter.state, to resume writing after it.
+            Records written to the last shard after that state are dropped
+
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        prefix: str = "augmented",
+        shard_size: int = 100000,
+        compress: bool = False,
+        state: dict = None,
+    ) -> None:
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.compress = compress
+        self.shard_index = 0
+        self.shard_records = 0
+        self.records = 0
+        self.paths = []
+        self.file = None
+        self.last_paragraph_index = None
+        os.makedirs(output_dir, exist_ok=True)
+        if state is not None:
+            self.resume(state)
+
+    def state(self):
+        """
+        Position of the writer, to resume writing after it
+
+        """
+        return {
+            "shard_index": self.shard_index,
+            "shard_records": self.shard_records,
+            "records": self.records,
+            "paths": list(self.paths),
+        }
+
+    def resume(self, state: dict):
+        """
+        Continue the shards of a previous run from its state. The last shard is rewritten with
+        only its first shard_records records and reopened for appending
+
+        """
+        self.shard_index = state["shard_index"]
+        self.shard_records = state["shard_records"]
+        self.records = state["records"]
+        self.paths = list(state["paths"])
+        if not self.paths:
+            return
+        path = self.paths[-1]
+        records = []
+        try:
+            with open_text(path) as shard:
+                for line in shard:
+                    if len(records) >= self.shard_records:
+                        break
+                    records.append(line)
+        except EOFError:
+            # A gzip shard of an interrupted run has no end of stream marker
+            pass
+        if len(records) < self.shard_records:
+            raise ValueError(
+                "{} has {} records, expected {}".format(
+                    path, len(records), self.shard_records
+                )
+            )
+        with open_text(path, "wt") as shard:
+            shard.writelines(records)
+        self.file = open_text(path, "at")
+
+    def open_shard(self):
+        name = "{}-{:05d}.jsonl".format(self.prefix, self.shard_index)
+        if self.compress:
+            name += ".gz"
+        path = os.path.join(self.output_dir, name)
+        self.file = open_text(path, "wt")
+        self.paths.append(path)
+        self.shard_index += 1
+        self.shard_records = 0
+
+    def write(self, record: dict):
+        """
+        Write one record, starting a new shard when the current one is full
+
+        """
+        if self.file is None or self.shard_records >= self.shard_size:
+            self.close()
+            self.open_shard()
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.shard_records += 1
+        self.records += 1
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def write_combined(self, paragraph_index: int, paragraphs):
+        """
+        Write the augmented paragraphs of one corpus paragraph, materialising them one at a time
+
+        Args:
+            paragraph_index: Index of the corpus paragraph
+            paragraphs: CombinedParagraphs or list of dicts with the new paragraphs and their dates
+
+        """
+        self.write_all(
+            dict(paragraph_index=paragraph_index, **record) for record in paragraphs
+        )
+        self.last_paragraph_index = paragraph_index
+
+    def flush(self):
+        """
+        Flush the written records to disk
+
+        Returns:
+            Index of the last corpus paragraph written with write_combined, every record is on disk
+
+        """
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        return self.last_paragraph_index
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ShardedParquetWriter:
+    """
+    Writer of augmented paragraphs to Parquet shards of about shard_size rows. A row holds the
+    paragraph index, the first part, date and second part as dictionary-encoded columns (each unique
+    part is stored once per shard) and the date character offsets, the paragraph text is not stored.
+    The second part of a paragraph with several date labels is the text after its first date, and
+    the offsets of all its dates are in the date_spans column, as flat start, end pairs.
+    Paragraphs are kept as index triples until their shard is full, then the shard is written at once,
+    so a shard file is always complete. The rows of a corpus paragraph are never split between two
+    shards, so a shard is closed at the first paragraph reaching shard_size rows. Needs pyarrow
+
+    Args:
+        output_dir: Directory of the shards
+        prefix: Prefix of the shard file names
+        shard_size: Number of rows from which a shard is written
+        compress: Compress the shards with zstd instead of snappy
+        state: State returned by ShardedParquetWriter.state, to resume writing after it
+
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        prefix: str = "augmented",
+        shard_size: int = 100000,
+        compress: bool = False,
+        state: dict = None,
+    ) -> None:
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError(
+                "pyarrow is needed to write Parquet shards: pip install pyarrow"
+            )
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.compression = "zstd" if compress else "snappy"
+        self.shard_index = 0
+        self.records = 0
+        self.paths = []
+        # (paragraph index, CombinedParagraphs) of the shard being filled
+        self.pending = []
+        self.pending_records = 0
+        self.last_paragraph_index = None
+        os.makedirs(output_dir, exist_ok=True)
+        if state is not None:
+            self.shard_index = state["shard_index"]
+            self.records = state["records"]
+            self.paths = list(state["paths"])
+
+    def state(self):
+        """
+        Position of the writer, to resume writing after it. Rows of the shard being filled are not on disk yet
+
+        """
+        return {
+            "shard_index": self.shard_index,
+            "shard_records": 0,
+            "records": self.records - self.pending_records,
+            "paths": list(self.paths),
+        }
+
+    def write_combined(self, paragraph_index: int, paragraphs):
+        """
+        Add the augmented paragraphs of one corpus paragraph, writing the shard if it gets full
+
+        Args:
+            paragraph_index: Index of the corpus paragraph
+            paragraphs: CombinedParagraphs of the new paragraphs
+
+        """
+        self.last_paragraph_index = paragraph_index
+        if len(paragraphs):
+            self.pending.append((paragraph_index, paragraphs))
+            self.pending_records += len(paragraphs)
+            self.records += len(paragraphs)
+        if self.pending_records >= self.shard_size:
+            self.write_shard()
+
+    def write_shard(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.pending:
+            return
+        tables = []
+        for paragraph_index, paragraphs in self.pending:
+            date_spans = paragraphs.date_spans()
+            columns = {
+                "paragraph_index": pa.array(
+                    [paragraph_index] * len(paragraphs), pa.int64()
+                )
+            }
+            parts = [paragraphs.first_parts, paragraphs.dates, paragraphs.second_parts]
+            indexes = paragraphs.indexes[:, [0, 1, -1]]
+            if paragraphs.labels > 1:
+                # The texts after the first date are joined into the second part
+                second_parts, second_indexes = intern_parts(
+                    [
+                        " ".join(paragraphs.texts_of(index)[2:])
+                        for index in range(len(paragraphs))
+                    ]
+                )
+                parts[2] = second_parts
+                indexes[:, 2] = second_indexes
+            for column, column_parts in enumerate(parts):
+                columns[PARQUET_PART_COLUMNS[column]] = pa.DictionaryArray.from_arrays(
+                    pa.array(indexes[:, column], pa.int32()),
+                    pa.array(column_parts, pa.string()),
+                )
+            columns["date_index_start"] = pa.array(date_spans[:, 0, 0], pa.int32())
+            columns["date_index_end"] = pa.array(date_spans[:, 0, 1], pa.int32())
+            columns["date_spans"] = pa.array(
+                date_spans.reshape(len(paragraphs), -1).tolist(),
+                pa.list_(pa.int32()),
+            )
+            tables.append(pa.table(columns))
+        # The dictionaries of the paragraphs are merged into one dictionary per column of the shard
+        table = pa.concat_tables(tables).unify_dictionaries().combine_chunks()
+        path = os.path.join(
+            self.output_dir, "{}-{:05d}.parquet".format(self.prefix, self.shard_index)
+        )
+        temporary_path = path + ".tmp"
+        pq.write_table(table, temporary_path, compression=self.compression)
+        os.replace(temporary_path, path)
+        self.paths.append(path)
+        self.shard_index += 1
+        self.pending = []
+        self.pending_records = 0
+
+    def flush(self):
+        """
+        Rows are written a shard at a time, the rows of the shard being filled stay in memory
+
+        Returns:
+            Index of the last corpus paragraph whose rows are all on disk, None if there is none
+
+        """
+        if not self.pending:
+            return self.last_paragraph_index
+        return self.pending[0][0] - 1
+
+    def close(self):
+        self.write_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_parquet_shard(path: str, materialise: bool = True):
+    """
+    Load a Parquet shard of ShardedParquetWriter
+
+    Args:
+        path: Path of the shard
+        materialise: Add the paragraph column, joining the parts and the date
+
+    Returns:
+        pyarrow Table
+
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    if materialise:
+        table = table.append_column(
+            "paragraph",
+            pc.binary_join_element_wise(
+                *[table[column].cast(pa.string()) for column in PARQUET_PART_COLUMNS],
+                " ",
+            ),
+        )
+    return table
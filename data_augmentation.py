@@ -1,8 +1,35 @@
+from augmentation_cache import AugmentationCache
+from augmentation_metrics import MetricsRecorder
+from checkpoint_journal import CheckpointJournal, paragraph_hash
+from corpus_io import (
+    ShardedJsonlWriter,
+    ShardedParquetWriter,
+    label_spans,
+    read_corpus,
+    split_parts,
+)
+from inference_backend import BACKENDS
+from near_duplicates import NearDuplicateFilter, format_contributions
 from nlp_augmenters import *
+from paragraph_combination import CombinedParagraphs, combine_columns
+from parallel_runner import run_in_workers
+from part_lineage import (
+    PartLineage,
+    attribute_paragraphs,
+    lineage_output,
+    stage_texts,
+)
+from sharding import ShardSelection, paragraph_seed, parse_shard, write_manifest
+from stage_major_runner import ChunkStage, StageMajorRunner
+from stage_planner import StageCostModel, YieldPlanner
+from stage_scheduler import Stage, StageScheduler
 from transform_date_format import *
 
-import random
+import argparse
+import functools
+import itertools
 import json
+import random
 
 
 dataset = [
@@ -19,151 +46,1147 @@ dataset = [
 ]
 
 
-nlpAugmenter = NLPAugmenters()
+# Parts of a paragraph with one date label
+PARTS = ["first_part", "second_part"]
 
-for index_element, element in enumerate(dataset):
+# Stage augmenting both parts of a paragraph with the contextual word embeddings, the insert and
+# substitute stages of each part take their outputs from it
+CONTEXTUAL_STAGE_NAME = "contextualWordEmbsAug"
 
-    print("**** paragraph number {} ****".format(index_element))
+# Stages applied to each part of a paragraph, in the order their outputs are concatenated
+PART_STAGE_NAMES = [
+    "synonymAug",
+    "antonymAug",
+    "contextualWordEmbsAug - insert",
+    "contextualWordEmbsAug - substitute",
+    "xlnetAug",
+    "deBacktranslationAug",
+    "ruBacktranslationAug",
+    "arBacktranslationAug",
+]
 
-    first_parts = []
-    dates = []
-    second_parts = []
+# Stages generating new texts from the text of a part
+GENERATION_STAGE_NAMES = PART_STAGE_NAMES[:5]
 
-    # Take the part of the paragraph and apply the library Data Aug to augment it
-    first_sentence = element["paragraph"][: element["date_index_start"]]
-    first_parts += nlpAugmenter.synonymAugmenter(
-        first_sentence, number_generated_examples=5
-    )
-    print("[1/8] synonymAug Done")
-    first_parts += nlpAugmenter.antonymAugmenter(
-        first_sentence, number_generated_examples=5
+# Stages of a part consumed by each stage, the other stages only take the text of their part. The
+# back-translation stages translate the outputs of the generation stages, not the outputs of each other
+STAGE_DEPENDENCIES = {
+    "contextualWordEmbsAug - insert": [CONTEXTUAL_STAGE_NAME],
+    "contextualWordEmbsAug - substitute": [CONTEXTUAL_STAGE_NAME],
+    "deBacktranslationAug": GENERATION_STAGE_NAMES,
+    "ruBacktranslationAug": GENERATION_STAGE_NAMES,
+    "arBacktranslationAug": GENERATION_STAGE_NAMES,
+}
+
+
+def with_metrics(
+    function, metrics: MetricsRecorder, name: str, stage_inputs, message: str, **labels
+):
+    """
+    Wrap a stage function to measure it and print a progress message once it is done
+
+    Args:
+        function: Stage function
+        metrics: Recorder of the stage metrics
+        name: Name of the stage
+        stage_inputs: Function returning the input texts of the stage from its dependency outputs
+        message: Progress message
+        labels: Other fields of the stage record
+
+    Returns:
+        Wrapped stage function
+
+    """
+
+    def run(inputs):
+        with metrics.measure("stage", name, stage_inputs(inputs), **labels) as record:
+            output = function(inputs)
+            record["outputs"] = stage_texts(output)
+        # A single write keeps the messages of concurrent stages on separate lines
+        print("{} in {:.1f}s\n".format(message, record["wall_seconds"]), end="")
+        return output
+
+    return run
+
+
+def previous_parts(inputs: dict):
+    """
+    Concatenate the outputs of the stages consumed by a back-translation stage
+
+    """
+    return [generated for outputs in inputs.values() for generated in outputs]
+
+
+def backtranslation_inputs(sentence: str, inputs: dict):
+    """
+    Texts translated by a back-translation stage: the text of its part and the outputs of the stages it
+    consumes. batchBackTranslationAugmenter translates each distinct text once
+
+    """
+    return [sentence] + previous_parts(inputs)
+
+
+def backtranslate(nlpAugmenter: NLPAugmenters, language: str, texts: list):
+    """
+    Back-translate the texts of several back-translation stages with one batched call
+
+    Args:
+        nlpAugmenter: NLPAugmenters instance used for all augmentations
+        language: Key of NLPAugmenters.backtranslation_models (de, ru or ar)
+        texts: List of the texts of each stage, returned by backtranslation_inputs
+
+    Returns:
+        List of the outputs of each stage, returned by part_lineage.lineage_output
+
+    """
+    from_model_name, to_model_name = nlpAugmenter.backtranslation_models[language]
+    translated = iter(
+        nlpAugmenter.batchBackTranslationAugmenter(
+            [text for stage_texts in texts for text in stage_texts],
+            from_model_name,
+            to_model_name,
+        )
     )
-    print("[2/8] antonymAug Done")
-    first_parts += nlpAugmenter.contextualWordEmbsAugmenter(
-        first_sentence, number_generated_examples=5
+    return [
+        lineage_output(stage_texts, [next(translated) for _ in stage_texts])
+        for stage_texts in texts
+    ]
+
+
+def paragraph_parts(element: dict):
+    """
+    Split a paragraph around its date labels
+
+    Returns:
+        List of the text before the first label, the texts between consecutive labels and the text
+        after the last label
+
+    """
+    return split_parts(element["paragraph"], label_spans(element))
+
+
+def part_names(labels: int):
+    """
+    Names of the parts of a paragraph with several date labels: first_part before the first label,
+    part_<i> between the labels i and i + 1, and second_part after the last label
+
+    """
+    return (
+        ["first_part"]
+        + ["part_{}".format(label) for label in range(1, labels)]
+        + ["second_part"]
     )
-    print("[3/8] contextualWordEmbsAug - insert Done")
-    first_parts += nlpAugmenter.contextualWordEmbsAugmenter(
-        first_sentence, action="substitute", number_generated_examples=5
+
+
+def label_dates(element: dict):
+    """
+    Dates of the labels of a paragraph, normalised to the "September 6, 2001" shape when date_detector.py
+    found them
+
+    Returns:
+        List of dates, one per label
+
+    """
+    if "normalized_dates" in element:
+        return list(element["normalized_dates"])
+    spans = label_spans(element)
+    if len(spans) == 1 and element.get("normalized_date"):
+        return [element["normalized_date"]]
+    return [element["paragraph"][start:end] for start, end in spans]
+
+
+def build_part_stages(
+    nlpAugmenter: NLPAugmenters,
+    part: str,
+    sentence: str,
+    paragraph_index: int = None,
+    part_index: int = None,
+):
+    """
+    Build the DAG of stages augmenting one part of a paragraph.
+    The synonym, antonym and XLNet stages are independent, the contextual stages take their outputs
+    from the stage of build_contextual_stage. The back-translation stages consume the outputs of the
+    generation stages, see STAGE_DEPENDENCIES
+
+    Args:
+        nlpAugmenter: NLPAugmenters instance used for all augmentations
+        part: Name of the part returned by part_names, e.g. "first_part" for the text before the date label
+            or "second_part" for the text after it
+        sentence: Text of the part
+        paragraph_index: Index of the paragraph, recorded in the stage metrics
+        part_index: Position of the part in the paragraph, its position in PARTS by default
+
+    Returns:
+        List of stages named part/stage name
+
+    """
+    if part == "first_part":
+        xlnet_augmenter = (
+            nlpAugmenter.generate_text_before_label_with_autoregressive_model
+        )
+    elif part == "second_part":
+        xlnet_augmenter = (
+            nlpAugmenter.generate_text_after_label_with_autoregressive_model
+        )
+    else:
+        # A part between two labels is not completed: both of its ends belong to the sentence of a label
+        xlnet_augmenter = lambda text, number_generated_examples: []
+
+    if part_index is None:
+        part_index = PARTS.index(part)
+
+    functions = {
+        "synonymAug": lambda inputs: nlpAugmenter.synonymAugmenter(
+            sentence, number_generated_examples=5
+        ),
+        "antonymAug": lambda inputs: nlpAugmenter.antonymAugmenter(
+            sentence, number_generated_examples=5
+        ),
+        "contextualWordEmbsAug - insert": lambda inputs: inputs[CONTEXTUAL_STAGE_NAME][
+            "insert"
+        ][part_index],
+        "contextualWordEmbsAug - substitute": lambda inputs: inputs[
+            CONTEXTUAL_STAGE_NAME
+        ]["substitute"][part_index],
+        "xlnetAug": lambda inputs: xlnet_augmenter(
+            sentence, number_generated_examples=5
+        ),
+    }
+    for language in ["de", "ru", "ar"]:
+        functions[language + "BacktranslationAug"] = functools.partial(
+            lambda language, inputs: backtranslate(
+                nlpAugmenter, language, [backtranslation_inputs(sentence, inputs)]
+            )[0],
+            language,
+        )
+    stages = []
+    for index, name in enumerate(PART_STAGE_NAMES):
+        dependencies = [
+            dependency
+            if dependency == CONTEXTUAL_STAGE_NAME
+            else part + "/" + dependency
+            for dependency in STAGE_DEPENDENCIES.get(name, [])
+        ]
+        if name.endswith("BacktranslationAug"):
+            stage_inputs = lambda inputs: backtranslation_inputs(sentence, inputs)
+        else:
+            stage_inputs = lambda inputs: sentence
+        message = "[{}/{}] {} Done ({})".format(
+            index + 1, len(PART_STAGE_NAMES), name, part
+        )
+        stages.append(
+            Stage(
+                part + "/" + name,
+                with_metrics(
+                    functions[name],
+                    nlpAugmenter.metrics,
+                    part + "/" + name,
+                    stage_inputs,
+                    message,
+                    paragraph=paragraph_index,
+                ),
+                dependencies,
+            )
+        )
+    return stages
+
+
+def build_contextual_stage(
+    nlpAugmenter: NLPAugmenters, sentences: list, paragraph_index: int = None
+):
+    """
+    Build the stage running the contextual insert and substitute augmentations of all the parts of a
+    paragraph in one batch, so each part is tokenized once and every variant shares the forward passes
+
+    Args:
+        nlpAugmenter: NLPAugmenters instance used for all augmentations
+        sentences: Texts of the parts, in the order of the paragraph
+        paragraph_index: Index of the paragraph, recorded in the stage metrics
+
+    Returns:
+        Stage whose output is a dict of action: list of augmented texts per part
+
+    """
+    return Stage(
+        CONTEXTUAL_STAGE_NAME,
+        with_metrics(
+            lambda inputs: nlpAugmenter.batchContextualWordEmbsAugmenter(
+                sentences,
+                actions=["insert", "substitute"],
+                number_generated_examples=5,
+            ),
+            nlpAugmenter.metrics,
+            CONTEXTUAL_STAGE_NAME,
+            lambda inputs: sentences,
+            "{} Done".format(CONTEXTUAL_STAGE_NAME),
+            paragraph=paragraph_index,
+        ),
     )
-    print("[4/8] contextualWordEmbsAug - substitute Done")
-    first_parts += nlpAugmenter.generate_text_before_label_with_autoregressive_model(
-        first_sentence, number_generated_examples=5
+
+
+def part_outputs(results: dict, part: str):
+    """
+    Concatenate the outputs of the stages of one part of a paragraph
+
+    Args:
+        results: Dict of stage name: stage output returned by StageScheduler.run
+        part: "first_part" or "second_part"
+
+    Returns:
+        List of augmented texts
+
+    """
+    return [
+        generated
+        for name in PART_STAGE_NAMES
+        for generated in stage_texts(results[part + "/" + name])
+    ]
+
+
+def part_lineage(results: dict, part: str, sentence: str):
+    """
+    Lineage of the augmented texts of one part of a paragraph
+
+    Args:
+        results: Dict of stage name: stage output returned by StageScheduler.run
+        part: Name of the part returned by part_names
+        sentence: Text of the part
+
+    Returns:
+        PartLineage of the part
+
+    """
+    lineage = PartLineage(sentence)
+    for name in PART_STAGE_NAMES:
+        output = results[part + "/" + name]
+        parents = None
+        if isinstance(output, dict):
+            parents = output["parents"]
+        elif name in STAGE_DEPENDENCIES and output:
+            # Output journaled without its lineage
+            parents = [None] * len(output)
+        lineage.add(name, stage_texts(output), parents)
+    return lineage
+
+
+def paragraph_capacity(unique_parts: dict):
+    """
+    Number of unique paragraphs the unique texts of the parts can be combined into. One date is
+    generated per first part for each label, so each label has as many dates as first parts
+
+    Args:
+        unique_parts: Dict of part: number of unique texts, one more part than labels
+
+    Returns:
+        Number of combinations of the parts and dates, e.g. (first part, date, second part) for one label
+
+    """
+    capacity = unique_parts["first_part"] ** (len(unique_parts) - 1)
+    for count in unique_parts.values():
+        capacity *= count
+    return capacity
+
+
+def filter_part(
+    nlpAugmenter: NLPAugmenters,
+    results: dict,
+    part: str,
+    near_duplicate_threshold: float,
+    paragraph_index: int = None,
+):
+    """
+    Concatenate the outputs of the stages of one part of a paragraph and drop their near duplicates
+
+    Args:
+        nlpAugmenter: NLPAugmenters instance, whose recorder measures the filter
+        results: Dict of stage name: stage output returned by StageScheduler.run
+        part: "first_part" or "second_part"
+        near_duplicate_threshold: Jaccard similarity of the word shingles from which two texts are
+            near duplicates. Only exact duplicates are dropped if it is None
+        paragraph_index: Index of the paragraph, recorded in the stage metrics
+
+    Returns:
+        List of augmented texts
+
+    """
+    texts = part_outputs(results, part)
+    if near_duplicate_threshold is None:
+        return texts
+    sources = [
+        name
+        for name in PART_STAGE_NAMES
+        for _ in stage_texts(results[part + "/" + name])
+    ]
+    name = part + "/near_duplicate_filter"
+    with nlpAugmenter.metrics.measure(
+        "stage", name, texts, paragraph=paragraph_index
+    ) as record:
+        kept, contributions = NearDuplicateFilter(near_duplicate_threshold).filter(
+            texts, sources
+        )
+        record["outputs"] = kept
+        record["contributions"] = contributions
+    print(
+        "{}: {} sentences kept out of {} ({})".format(
+            name, len(kept), len(texts), format_contributions(contributions)
+        )
     )
-    print("[5/8] xlnetAug Done")
-    first_parts += nlpAugmenter.augment_data_using_de_backtranslation(
-        first_sentence, first_parts
+    return kept
+
+
+def augment_paragraph(
+    nlpAugmenter: NLPAugmenters,
+    element: dict,
+    index_element: int,
+    max_stage_workers: int = 4,
+    journal_path: str = None,
+    near_duplicate_threshold: float = 0.8,
+    target: int = 200,
+    early_stopping: bool = False,
+):
+    """
+    Augment the parts of a paragraph around its date labels and combine them into new paragraphs
+
+    Args:
+        nlpAugmenter: NLPAugmenters instance used for all augmentations
+        element: Dict with the paragraph and the indexes of its date label, or the date_spans of its labels
+        index_element: Index of the paragraph in the dataset
+        max_stage_workers: Number of independent stages running at the same time
+        journal_path: Path of the checkpoint journal. Completed stages are recorded in it
+            and the stages it already holds for this paragraph are not run again
+        near_duplicate_threshold: Jaccard similarity of the word shingles from which two augmented
+            texts of a part are near duplicates, the later one is dropped. None keeps every unique text
+        target: Number of new paragraphs
+        early_stopping: Start the cheapest stages per unique output first and skip or truncate the
+            other stages once the unique parts can be combined into target paragraphs
+
+    Returns:
+        CombinedParagraphs of the new paragraphs, yielding dicts with the new paragraphs and their dates
+
+    """
+    print("**** paragraph number {} ****".format(index_element))
+
+    # Take the parts of the paragraph around its labels and apply the library Data Aug to augment them.
+    # The stages of all the parts run in one DAG, so the parts of the paragraph overlap
+    sentences = paragraph_parts(element)
+    parts = part_names(len(sentences) - 1)
+    planner = None
+    if early_stopping:
+        # Stage costs and yields are measured by the metrics of the previous stages and paragraphs
+        planner = YieldPlanner(
+            target,
+            StageCostModel(nlpAugmenter.metrics),
+            paragraph_capacity,
+            parts,
+        )
+    stages = [build_contextual_stage(nlpAugmenter, sentences, index_element)]
+    for part_index, (part, sentence) in enumerate(zip(parts, sentences)):
+        stages += build_part_stages(
+            nlpAugmenter, part, sentence, index_element, part_index
+        )
+    # The stage threads would otherwise import the models at the same time
+    nlpAugmenter.import_models()
+    scheduler = StageScheduler(
+        stages,
+        max_workers=max_stage_workers,
+        planner=planner,
     )
-    print("[6/8] deBacktranslationAug Done")
-    first_parts += nlpAugmenter.augment_data_using_ru_backtranslation(
-        first_sentence, first_parts
+    if journal_path:
+        journal = CheckpointJournal(journal_path)
+        element_hash = paragraph_hash(element)
+        completed = journal.completed_stages(index_element, element_hash)
+        if completed:
+            print("{} stages replayed from the journal".format(len(completed)))
+        results = scheduler.run(
+            completed=completed,
+            on_stage_done=lambda name, output: journal.record_stage(
+                index_element, element_hash, name, output
+            ),
+        )
+        journal.close()
+    else:
+        results = scheduler.run()
+    print(scheduler.report())
+    if planner is not None and planner.report():
+        print(planner.report())
+    return combine_paragraph(
+        nlpAugmenter,
+        element,
+        index_element,
+        results,
+        near_duplicate_threshold,
+        target,
     )
-    print("[7/8] ruBacktranslationAug Done")
-    first_parts += nlpAugmenter.augment_data_using_ar_backtranslation(
-        first_sentence, first_parts
+
+
+def combine_paragraph(
+    nlpAugmenter: NLPAugmenters,
+    element: dict,
+    index_element: int,
+    results: dict,
+    near_duplicate_threshold: float = 0.8,
+    target: int = 200,
+):
+    """
+    Filter the augmented parts of a paragraph, generate its dates and combine them into new paragraphs
+
+    Args:
+        nlpAugmenter: NLPAugmenters instance, whose recorder measures the stages
+        element: Dict with the paragraph and the indexes of its date label, or the date_spans of its labels
+        index_element: Index of the paragraph in the dataset
+        results: Dict of stage name: stage output of the augmentation stages of the paragraph
+        near_duplicate_threshold: Jaccard similarity of the word shingles from which two augmented
+            texts of a part are near duplicates, the later one is dropped. None keeps every unique text
+        target: Number of new paragraphs
+
+    Returns:
+        CombinedParagraphs of the new paragraphs, yielding dicts with the new paragraphs and their dates
+
+    """
+    # The dates and combinations of a seeded run are drawn from the seed of the paragraph, so they do
+    # not depend on the other paragraphs of the run
+    seed = paragraph_seed(nlpAugmenter.seed, paragraph_hash(element))
+    # A part without any augmented text keeps its own text, so the other parts are still combined
+    sentences = paragraph_parts(element)
+    parts = part_names(len(sentences) - 1)
+    part_texts = []
+    for part, sentence in zip(parts, sentences):
+        texts = filter_part(
+            nlpAugmenter, results, part, near_duplicate_threshold, index_element
+        )
+        print(
+            "{} new sentence generated for the paragraph's {}. Unique sentences = {}".format(
+                len(texts), part.replace("_", " "), len(list(set(texts)))
+            )
+        )
+        part_texts.append(texts or [sentence.strip()])
+
+    # Take each label X and transform it into another type of date
+    # Labels found by date_detector.py carry the date normalised to the "September 6, 2001" shape
+    old_dates = label_dates(element)
+    with nlpAugmenter.metrics.measure(
+        "stage", "transform_date_types", old_dates, paragraph=index_element
+    ) as record:
+        dates = [
+            transform_date_types(
+                date,
+                len(part_texts[0]),
+                seed=None if seed is None else seed + label,
+            )
+            for label, date in enumerate(old_dates)
+        ]
+        record["outputs"] = [new_date for new_dates in dates for new_date in new_dates]
+    print("{} new date generated".format(sum(len(new_dates) for new_dates in dates)))
+
+    # Concatenate the first part, then each date and the part after it, for each augmented paragraph.
+    # if there are duplicates in the parts, we will create random combinations between those lists to generate at least 200 examples
+    columns = [part_texts[0]]
+    for label, new_dates in enumerate(dates):
+        columns += [new_dates, part_texts[label + 1]]
+    with nlpAugmenter.metrics.measure(
+        "stage",
+        "combine_parts",
+        element["paragraph"],
+        paragraph=index_element,
+    ) as record:
+        # Paragraphs are kept as index rows into the unique parts, they are materialised when written
+        new_paragraphs = CombinedParagraphs(
+            *combine_columns(
+                columns,
+                target=target,
+                rng=random if seed is None else random.Random(seed),
+            )
+        )
+        record["output_summary"] = new_paragraphs.output_summary()
+        # The lineage of the parts attributes the new paragraphs to the augmenters, their cost is in
+        # the stage records of the paragraph
+        record["attribution"] = attribute_paragraphs(
+            new_paragraphs,
+            [
+                part_lineage(results, part, sentence)
+                for part, sentence in zip(parts, sentences)
+            ],
+        )
+    print(
+        "Paragraphs per augmenter: {}".format(
+            ", ".join(
+                "{} {}".format(stage, count)
+                for stage, count in record["attribution"].items()
+            )
+        )
     )
-    print("[8/8] arBacktranslationAug Done")
     print(
-        "{} new sentence generated for the paragraph's first part. Unique sentences = {}".format(
-            len(first_parts), len(list(set(first_parts)))
+        "{} unique paragraphs after combination out of {} possible combinations".format(
+            len(new_paragraphs),
+            functools.reduce(
+                lambda product, column: product * len(column),
+                new_paragraphs.columns,
+                1,
+            ),
         )
     )
 
-    # Take the label X and transform it into another type of date
-    date = element["paragraph"][element["date_index_start"] : element["date_index_end"]]
-    for i in range(len(first_parts)):
-        dates.append(transform_date_type(date))
-    print("{} new date generated".format(len(dates)))
+    return new_paragraphs
+
+
+def build_chunk_stages(nlpAugmenter: NLPAugmenters, chunk: list):
+    """
+    Build the stages of the stage-major mode. Each stage augments the parts of every paragraph of a
+    chunk with one call, and the stages with a model release it once they are done: the contextual
+    stage predicts the variants of all the parts in one batched call, the XLNet stage completes all
+    the prefixes together and each back-translation stage translates the texts of all the parts with
+    one pass of its translation models per batch
+
+    Args:
+        nlpAugmenter: NLPAugmenters instance used for all augmentations
+        chunk: List of (paragraph index, paragraph record) pairs
+
+    Returns:
+        List of ChunkStage, in execution order
+
+    """
+    sentences = {}
+    for index, element in chunk:
+        texts = paragraph_parts(element)
+        sentences[index] = dict(zip(part_names(len(texts) - 1), texts))
+
+    def sentence(index, name):
+        return sentences[index][name.split("/")[0]]
+
+    def each_part(method):
+        return lambda items: [
+            method(sentence(index, name), number_generated_examples=5)
+            for index, name, _ in items
+        ]
+
+    def contextual(items):
+        # The parts of every paragraph of the chunk are predicted in one batched call
+        outputs = nlpAugmenter.batchContextualWordEmbsAugmenter(
+            [text for index, _, _ in items for text in sentences[index].values()],
+            actions=["insert", "substitute"],
+            number_generated_examples=5,
+        )
+        results = []
+        start = 0
+        for index, _, _ in items:
+            end = start + len(sentences[index])
+            results.append(
+                {
+                    action: action_outputs[start:end]
+                    for action, action_outputs in outputs.items()
+                }
+            )
+            start = end
+        return results
+
+    def contextual_action(action):
+        return lambda items: [
+            inputs[CONTEXTUAL_STAGE_NAME][action][
+                list(sentences[index]).index(name.split("/")[0])
+            ]
+            for index, name, inputs in items
+        ]
+
+    def xlnet(items):
+        # The prefixes of the chunk are completed in one batched call, the call of each part then
+        # finds its completions in the augmentation cache. The parts between two labels are not completed
+        prefixes = []
+        for index, name, _ in items:
+            if name.startswith("first_part"):
+                prefixes.append(
+                    NLPAugmenters.autoregressive_prefix(
+                        sentence(index, name), BEFORE_LABEL_TEXT_LIMIT
+                    )
+                )
+            elif name.startswith("second_part"):
+                prefixes.append(
+                    NLPAugmenters.autoregressive_prefix(
+                        sentence(index, name), AFTER_LABEL_TEXT_LIMIT, after_label=True
+                    )
+                )
+        nlpAugmenter.batchContextualWordEmbsForSentenceAugmenter(prefixes)
+        outputs = []
+        for index, name, _ in items:
+            if name.startswith("first_part"):
+                outputs.append(
+                    nlpAugmenter.generate_text_before_label_with_autoregressive_model(
+                        sentence(index, name), number_generated_examples=5
+                    )
+                )
+            elif name.startswith("second_part"):
+                outputs.append(
+                    nlpAugmenter.generate_text_after_label_with_autoregressive_model(
+                        sentence(index, name), number_generated_examples=5
+                    )
+                )
+            else:
+                outputs.append([])
+        return outputs
+
+    def backtranslation(language):
+        return lambda items: backtranslate(
+            nlpAugmenter,
+            language,
+            [
+                backtranslation_inputs(sentence(index, name), inputs)
+                for index, name, inputs in items
+            ],
+        )
+
+    functions = {
+        "synonymAug": (each_part(nlpAugmenter.synonymAugmenter), []),
+        "antonymAug": (each_part(nlpAugmenter.antonymAugmenter), []),
+        "contextualWordEmbsAug - insert": (contextual_action("insert"), []),
+        "contextualWordEmbsAug - substitute": (contextual_action("substitute"), []),
+        "xlnetAug": (xlnet, ["xlnet"]),
+        "deBacktranslationAug": (backtranslation("de"), ["de_backtranslation"]),
+        "ruBacktranslationAug": (backtranslation("ru"), ["ru_backtranslation"]),
+        "arBacktranslationAug": (backtranslation("ar"), ["ar_backtranslation"]),
+    }
+    stages = []
+    for name in PART_STAGE_NAMES:
+        dependencies = STAGE_DEPENDENCIES.get(name, [])
+        if name == "contextualWordEmbsAug - insert":
+            # The shared contextual stage runs after the synonym and antonym stages, which need no
+            # model, so an early stopping planner sees their outputs first
+            stages.append(
+                ChunkStage(
+                    CONTEXTUAL_STAGE_NAME,
+                    lambda index: {CONTEXTUAL_STAGE_NAME: []},
+                    contextual,
+                    ["contextual"],
+                )
+            )
+        function, models = functions[name]
+        stages.append(
+            ChunkStage(
+                name,
+                functools.partial(
+                    chunk_paragraph_stages, sentences, name, dependencies
+                ),
+                function,
+                models,
+            )
+        )
+    for position, stage in enumerate(stages):
+        stage.function = with_metrics(
+            stage.function,
+            nlpAugmenter.metrics,
+            stage.name,
+            functools.partial(chunk_stage_inputs, sentences),
+            "[{}/{}] {} Done on {} paragraphs".format(
+                position + 1, len(stages), stage.name, len(chunk)
+            ),
+            paragraphs=len(chunk),
+        )
+    return stages
+
+
+def chunk_paragraph_stages(
+    sentences: dict, name: str, dependencies: list, paragraph_index: int
+):
+    """
+    Paragraph stages of a chunk stage for one paragraph: the stage on each of its parts
+
+    Args:
+        sentences: Dict of paragraph index: dict of part: text
+        name: Name of the stage in PART_STAGE_NAMES
+        dependencies: Names of the stages it consumes
+        paragraph_index: Index of the paragraph
+
+    Returns:
+        Dict of paragraph stage name: names of the paragraph stages it consumes
+
+    """
+    return {
+        part
+        + "/"
+        + name: [
+            dependency
+            if dependency == CONTEXTUAL_STAGE_NAME
+            else part + "/" + dependency
+            for dependency in dependencies
+        ]
+        for part in sentences[paragraph_index]
+    }
+
+
+def chunk_stage_inputs(sentences: dict, items: list):
+    """
+    Input texts of a chunk stage: the text of each part, or of all the parts for the shared contextual
+    stage, and the texts consumed by the back-translation stages
+
+    """
+    texts = []
+    for index, name, inputs in items:
+        if "/" not in name:
+            texts += list(sentences[index].values())
+            continue
+        if name.endswith("BacktranslationAug"):
+            texts += backtranslation_inputs(
+                sentences[index][name.split("/")[0]], inputs
+            )
+        else:
+            texts.append(sentences[index][name.split("/")[0]])
+    return texts
+
+
+def augment_stage_major(
+    nlpAugmenter: NLPAugmenters,
+    paragraphs,
+    chunk_size: int = 256,
+    journal_path: str = "augmentation_journal.sqlite",
+    near_duplicate_threshold: float = 0.8,
+    target: int = 200,
+    early_stopping: bool = False,
+):
+    """
+    Augment paragraphs stage-major: the paragraphs are read chunk_size at a time, each stage runs on
+    the whole chunk and its models are released before the next stage loads its own, so only one model
+    is resident at a time. The stage outputs are spilled to the checkpoint journal
+
+    Args:
+        nlpAugmenter: NLPAugmenters instance used for all augmentations
+        paragraphs: Iterable of (corpus index, paragraph) pairs, the paragraphs being dicts with the
+            paragraph and the indexes of its date label
+        chunk_size: Number of paragraphs each stage runs on before the next stage starts
+        journal_path: Path of the checkpoint journal holding the stage outputs
+        near_duplicate_threshold: Jaccard similarity of the word shingles from which two augmented
+            texts of a part are near duplicates, the later one is dropped. None keeps every unique text
+        target: Number of new paragraphs per paragraph
+        early_stopping: Skip or truncate the stages of a paragraph once its unique parts can be
+            combined into target paragraphs
+
+    Returns:
+        Generator of (corpus index, CombinedParagraphs) pairs, one per paragraph and in the order of paragraphs
+
+    """
+    journal = CheckpointJournal(journal_path)
+    nlpAugmenter.import_models()
+    planner_factory = None
+    if early_stopping:
+        planner_factory = lambda index, element: YieldPlanner(
+            target,
+            StageCostModel(nlpAugmenter.metrics),
+            paragraph_capacity,
+            part_names(len(label_spans(element))),
+        )
+    paragraphs = iter(paragraphs)
+    while True:
+        chunk = list(itertools.islice(paragraphs, chunk_size))
+        if not chunk:
+            break
+        print("**** paragraphs number {} to {} ****".format(chunk[0][0], chunk[-1][0]))
+        runner = StageMajorRunner(
+            build_chunk_stages(nlpAugmenter, chunk),
+            journal,
+            nlpAugmenter.release,
+            planner_factory,
+        )
+        for index_element, element, results in runner.run(chunk):
+            print("**** paragraph number {} ****".format(index_element))
+            yield index_element, combine_paragraph(
+                nlpAugmenter,
+                element,
+                index_element,
+                results,
+                near_duplicate_threshold,
+                target,
+            )
+        print(runner.report())
+    journal.close()
+
+
+def save_augmented_paragraphs(new_paragraphs: list, index_element: int):
+    """
+    Save the augmented data of a paragraph in a json file
+
+    Args:
+        new_paragraphs: CombinedParagraphs or list of dicts with the new paragraphs and their dates
+        index_element: Index of the paragraph in the dataset
+
+    """
+    with open(
+        "augmentation_paragraph_number_{}.json".format(index_element + 1), "w"
+    ) as final:
+        json.dump(list(new_paragraphs), final)
+
 
-    # Take the remaining of the paragraph and apply the Data Aug
-    second_sentence = element["paragraph"][element["date_index_end"] + 1 :]
-    second_parts += nlpAugmenter.synonymAugmenter(
-        second_sentence, number_generated_examples=5
+def main():
+    parser = argparse.ArgumentParser(
+        description="Augment the paragraphs of the dataset"
     )
-    print("[1/8] synonymAug Done")
-    second_parts += nlpAugmenter.antonymAugmenter(
-        second_sentence, number_generated_examples=5
+    parser.add_argument(
+        "--input",
+        default=None,
+        help="JSONL corpus of paragraph, date_index_start and date_index_end records. Defaults to the paragraphs of this script",
     )
-    print("[2/8] antonymAug Done")
-    second_parts += nlpAugmenter.contextualWordEmbsAugmenter(
-        second_sentence, number_generated_examples=5
+    parser.add_argument(
+        "--output-dir",
+        default="output",
+        help="Directory of the augmented JSONL shards when --input is given",
     )
-    print("[3/8] contextualWordEmbsAug - insert Done")
-    second_parts += nlpAugmenter.contextualWordEmbsAugmenter(
-        second_sentence, action="substitute", number_generated_examples=5
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=100000,
+        help="Maximum number of augmented paragraphs per output shard",
     )
-    print("[4/8] contextualWordEmbsAug - substitute Done")
-    second_parts += nlpAugmenter.generate_text_after_label_with_autoregressive_model(
-        second_sentence, number_generated_examples=5
+    parser.add_argument(
+        "--output-format",
+        choices=["jsonl", "parquet"],
+        default="jsonl",
+        help="Format of the output shards. Parquet shards store the parts and dates as dictionaries with the date offsets and need pyarrow",
     )
-    print("[5/8] xlnetAug Done")
-    second_parts += nlpAugmenter.augment_data_using_de_backtranslation(
-        second_sentence, second_parts
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Compress the output shards with gzip (JSONL) or zstd (Parquet)",
     )
-    print("[6/8] deBacktranslationAug Done")
-    second_parts += nlpAugmenter.augment_data_using_ru_backtranslation(
-        second_sentence, second_parts
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes augmenting paragraphs in parallel",
     )
-    print("[7/8] ruBacktranslationAug Done")
-    second_parts += nlpAugmenter.augment_data_using_ar_backtranslation(
-        second_sentence, second_parts
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=None,
+        help="Torch intra-op threads of each worker. Defaults to the number of cores divided by the number of workers",
     )
-    print("[8/8] arBacktranslationAug Done")
-    print(
-        "{} new sentence generated for the paragraph's second part. Unique sentences = {}".format(
-            len(second_parts), len(list(set(second_parts)))
-        )
+    parser.add_argument(
+        "--stage-workers",
+        type=int,
+        default=4,
+        help="Number of independent augmentation stages of a paragraph running at the same time",
     )
-
-    # Concatenate the first part, the date and remaining part of each augmented paragraph
-    new_paragraphs = []
-    paragraphs = []
-    min_data = min(len(first_parts), len(second_parts))
-    for index in range(min_data):
-        new_paragraph = (
-            first_parts[index] + " " + dates[index] + " " + second_parts[index]
+    parser.add_argument(
+        "--cache",
+        default="augmentation_cache.sqlite",
+        help="Path of the persistent augmentation cache",
+    )
+    parser.add_argument(
+        "--journal",
+        default="augmentation_journal.sqlite",
+        help="Path of the checkpoint journal recording completed stages and paragraphs",
+    )
+    parser.add_argument(
+        "--metrics",
+        default="augmentation_metrics.jsonl",
+        help="Path of the JSON lines file of the per-call and per-stage metrics",
+    )
+    parser.add_argument(
+        "--prometheus",
+        default="augmentation_metrics.prom",
+        help="Path of the summed metrics in the Prometheus text format",
+    )
+    parser.add_argument(
+        "--profile-stage",
+        default=None,
+        help='Run a stage or NLPAugmenters call under cProfile, e.g. "contextualWordEmbsAug - insert"',
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default="profiles",
+        help="Directory of the cProfile dumps of --profile-stage",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="fp32",
+        help="Inference backend of the models: eager fp32, dynamically quantised int8 or TorchScript graphs",
+    )
+    parser.add_argument(
+        "--artifacts-dir",
+        default="inference_artifacts",
+        help="Directory of the models converted by --backend",
+    )
+    parser.add_argument(
+        "--wordnet-index",
+        default=None,
+        help="WordNet index built by wordnet_index.py, used by the synonym and antonym augmenters instead of NLTK WordNet",
+    )
+    parser.add_argument(
+        "--near-duplicate-threshold",
+        type=float,
+        default=0.8,
+        help="Jaccard similarity of the word shingles from which two augmented texts of a paragraph part are near duplicates. 0 keeps every unique text",
+    )
+    parser.add_argument(
+        "--target-paragraphs",
+        type=int,
+        default=200,
+        help="Number of new paragraphs generated per paragraph",
+    )
+    parser.add_argument(
+        "--early-stopping",
+        action="store_true",
+        help="Skip or truncate the expensive stages of a paragraph (XLNet, back-translation) once the unique parts of the cheaper stages can be combined into --target-paragraphs paragraphs",
+    )
+    parser.add_argument(
+        "--stage-major",
+        action="store_true",
+        help="Run each stage on a chunk of paragraphs and release its model before the next stage, so only one model is resident at a time",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=256,
+        help="Number of paragraphs of a chunk with --stage-major",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default="0/1",
+        help='Augment only the paragraphs of shard i of N, e.g. "3/8". Paragraphs are assigned to shards by their hash, merge the outputs of the shards with sharding.py',
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Global seed. Every random draw of a paragraph is seeded from it and the paragraph, so a shard can be run again bit-identically",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted run from its journal instead of starting a new one",
+    )
+    args = parser.parse_args()
+    if args.stage_major and args.workers > 1:
+        parser.error(
+            "--stage-major runs in one process, it cannot be used with --workers"
         )
-        paragraphs.append(new_paragraph)
-        paragraph_dict = {"paragraph": new_paragraph, "date": dates[index]}
-        new_paragraphs.append(paragraph_dict)
-    print(
-        "{} new paragraphs. Unique paragraphs = {}".format(
-            len(paragraphs), len(list(set(paragraphs)))
+    if args.seed is not None and args.early_stopping:
+        parser.error(
+            "--early-stopping decides from measured stage timings, a seeded run could not be reproduced with it"
         )
-    )
 
-    # if there are duplicates in first_parts and second_parts lists, we will create random combinations between those two lists to generate at least 200 examples
-    if min_data < 200:
-        remaining_paragraphs = 200 - min_data
-        while remaining_paragraphs > 0:
-            random_first_part = random.randint(0, len(first_parts) - 1)
-            random_second_part = random.randint(0, len(second_parts) - 1)
-            random_date = random.randint(0, len(dates) - 1)
-
-            new_paragraph = (
-                first_parts[random_first_part]
-                + " "
-                + dates[random_date]
-                + " "
-                + second_parts[random_second_part]
+    journal = CheckpointJournal(args.journal)
+    metrics = MetricsRecorder(args.metrics, args.profile_stage, args.profile_dir)
+    run_settings = {"shard": list(args.shard), "seed": args.seed}
+    if not args.resume:
+        journal.reset()
+        metrics.reset()
+        journal.set_state("run_settings", run_settings)
+    elif journal.state("run_settings", run_settings) != run_settings:
+        parser.error(
+            "The journal was recorded with {}, it cannot be resumed with other --shard or --seed".format(
+                journal.state("run_settings")
             )
+        )
+    # Paragraphs whose output is committed are skipped, the others replay their completed stages
+    committed_through = journal.committed_through
+    if committed_through >= 0:
+        print("Resuming after paragraph number {}".format(committed_through))
 
-            if new_paragraph not in paragraphs:
-                paragraphs.append(new_paragraph)
-                paragraph_dict = {
-                    "paragraph": new_paragraph,
-                    "date": dates[random_date],
-                }
-                new_paragraphs.append(paragraph_dict)
-                remaining_paragraphs -= 1
+    # Paragraphs are streamed from the corpus, so only the ones being augmented are kept in memory.
+    # They keep their corpus index in every shard
+    selection = ShardSelection(*args.shard)
+    paragraphs = (
+        (index_element, element)
+        for index_element, element in selection.select(
+            read_corpus(args.input) if args.input else dataset
+        )
+        if index_element > committed_through
+    )
+    augment = functools.partial(
+        augment_paragraph,
+        max_stage_workers=args.stage_workers,
+        journal_path=args.journal,
+        near_duplicate_threshold=args.near_duplicate_threshold or None,
+        target=args.target_paragraphs,
+        early_stopping=args.early_stopping,
+    )
+    if args.workers > 1:
+        results = run_in_workers(
+            augment,
+            paragraphs,
+            workers=args.workers,
+            threads_per_worker=args.threads_per_worker,
+            cache_path=args.cache,
+            metrics_path=args.metrics,
+            profile=args.profile_stage,
+            profile_dir=args.profile_dir,
+            backend=args.backend,
+            artifacts_dir=args.artifacts_dir,
+            wordnet_index=args.wordnet_index,
+            seed=args.seed,
+        )
+    else:
+        # Outputs are cached on disk, so re-running the script on the same paragraphs skips model inference
+        nlpAugmenter = NLPAugmenters(
+            cache=AugmentationCache(args.cache),
+            metrics=metrics,
+            backend=args.backend,
+            artifacts_dir=args.artifacts_dir,
+            wordnet_index=args.wordnet_index,
+            seed=args.seed,
+        )
+        if args.stage_major:
+            results = augment_stage_major(
+                nlpAugmenter,
+                paragraphs,
+                chunk_size=args.chunk_size,
+                journal_path=args.journal,
+                near_duplicate_threshold=args.near_duplicate_threshold or None,
+                target=args.target_paragraphs,
+                early_stopping=args.early_stopping,
+            )
+        else:
+            results = (
+                (index_element, augment(nlpAugmenter, element, index_element))
+                for index_element, element in paragraphs
+            )
+    if args.input:
+        writer_class = (
+            ShardedParquetWriter
+            if args.output_format == "parquet"
+            else ShardedJsonlWriter
+        )
+        with writer_class(
+            args.output_dir,
+            shard_size=args.shard_size,
+            compress=args.compress,
+            state=journal.writer_state if committed_through >= 0 else None,
+        ) as writer:
+            for index_element, new_paragraphs in results:
+                writer.write_combined(index_element, new_paragraphs)
+                # A paragraph is committed once its rows are on disk. Parquet rows are written a
+                # shard at a time, the journal keeps the stages of the paragraphs waiting for it
+                on_disk = writer.flush()
+                if on_disk is not None and on_disk > journal.committed_through:
+                    journal.commit_paragraph(on_disk, writer.state())
+        on_disk = writer.flush()
+        if on_disk is not None and on_disk > journal.committed_through:
+            journal.commit_paragraph(on_disk, writer.state())
+        # Every paragraph of the shard is written, the manifest marks the output complete for the merge
+        write_manifest(
+            args.output_dir,
+            selection.manifest(
+                args.seed, args.output_format, writer.records, writer.paths
+            ),
+        )
         print(
-            "{} new paragraphs after combination. Unique paragraphs = {}".format(
-                len(paragraphs), len(list(set(paragraphs)))
+            "{} augmented paragraphs written to {} shards".format(
+                writer.records, len(writer.paths)
             )
         )
+    else:
+        for index_element, new_paragraphs in results:
+            save_augmented_paragraphs(new_paragraphs, index_element)
+            journal.commit_paragraph(index_element)
 
-    # Save the augmented data of each paragraph in a json file
-    with open(
-        "augmentation_paragraph_number_{}.json".format(index_element + 1), "w"
-    ) as final:
-        json.dump(new_paragraphs, final)
+    if args.workers <= 1:
+        print("Augmentation cache: {}".format(nlpAugmenter.cache.stats()))
+    # The workers append their records to the metrics file, they are summed from it.
+    # It also holds the records of the paragraphs of an interrupted run
+    if args.metrics:
+        metrics.load()
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+    print(metrics.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import calendar
+import json
+import re
+
+from corpus_io import has_words, split_parts
+from transform_date_format import days, days_letters, days_numbers, months
+
+
+def alternation(words: list):
+    # Longest words first, so "twenty-first" is tried before "first"
+    return "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+
+month_numbers = {month.lower(): index + 1 for index, month in enumerate(months)}
+month_numbers.update(
+    {month[:3].lower(): index + 1 for index, month in enumerate(months)}
+)
+month_numbers["sept"] = 9
+day_ordinals = {
+    ordinal.strip().lower(): index + 1 for index, ordinal in enumerate(days_numbers)
+}
+day_ordinals.update(
+    {ordinal.lower(): index + 1 for index, ordinal in enumerate(days_letters)}
+)
+
+MONTH_NAME = "(?:{})".format(alternation(months))
+MONTH_ANY = "(?:{})".format(alternation(list(month_numbers)))
+ORDINAL_NUMBER = "(?:{})".format(alternation([day.strip() for day in days_numbers]))
+ORDINAL_WORD = "(?:{})".format(alternation(days_letters))
+DAY = r"(?:3[01]|[12]\d|0?[1-9])"
+MONTH_NUMBER = r"(?:1[0-2]|0?[1-9])"
+YEAR = r"\d{4}"
+
+# Date shapes of date_formats, each with month, day and year groups
+date_shapes = [
+    # the Twenty-second of January, 1999
+    r"the (?P<day>{ORDINAL_WORD}) (?:day )?of (?P<month>{MONTH_NAME}),? (?P<year>{YEAR})",
+    # January the Twenty-second, 1999
+    r"(?P<month>{MONTH_NAME}) the (?P<day>{ORDINAL_WORD}),? (?P<year>{YEAR})",
+    # 22nd January 1999
+    r"(?P<day>{ORDINAL_NUMBER}) (?:day of )?(?P<month>{MONTH_NAME}),? (?P<year>{YEAR})",
+    # January 22nd, 1999
+    r"(?P<month>{MONTH_NAME}) (?P<day>{ORDINAL_NUMBER}),? (?P<year>{YEAR})",
+    # January 22, 1999 / Jan 22 1999 / Jan. 22, 1999 / January. 22, 1999
+    r"(?P<month>{MONTH_ANY})\.? (?P<day>{DAY}),? (?P<year>{YEAR})",
+    # 22 January 1999 / 22-January-1999 / 22-Jan-1999
+    r"(?P<day>{DAY})[ -](?P<month>{MONTH_ANY})\.?[ -](?P<year>{YEAR})",
+    # 1999-01-22
+    r"(?P<year>{YEAR})-(?P<month>{MONTH_NUMBER})-(?P<day>{DAY})",
+    # 01-22-1999 / 01/22/1999
+    r"(?P<month>{MONTH_NUMBER})(?P<separator>[/-])(?P<day>{DAY})(?P=separator)(?P<year>{YEAR})",
+]
+
+
+def compile_date_pattern():
+    """
+    Compile every date shape into a single alternation, so a paragraph is scanned once
+
+    Returns:
+        Compiled pattern. The group shape<i> tells which shape matched and its groups are suffixed with _<i>
+
+    """
+    alternatives = []
+    for index, shape in enumerate(date_shapes):
+        shape = shape.format(
+            ORDINAL_WORD=ORDINAL_WORD,
+            ORDINAL_NUMBER=ORDINAL_NUMBER,
+            MONTH_NAME=MONTH_NAME,
+            MONTH_ANY=MONTH_ANY,
+            MONTH_NUMBER=MONTH_NUMBER,
+            DAY=DAY,
+            YEAR=YEAR,
+        )
+        # Group names must be unique across the alternatives
+        shape = re.sub(r"\(\?P<(\w+)>", r"(?P<\1_{}>".format(index), shape)
+        shape = re.sub(r"\(\?P=(\w+)\)", r"(?P=\1_{})".format(index), shape)
+        alternatives.append("(?P<shape{}>{})".format(index, shape))
+    # Every date starts with a digit, "the" or a month: other positions are rejected before trying the alternatives
+    first_characters = r"(?=\d|the |jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)"
+    return re.compile(
+        r"(?<![\w/-]){}(?:{})(?![\w/]|-\d)".format(
+            first_characters, "|".join(alternatives)
+        ),
+        re.IGNORECASE,
+    )
+
+
+date_pattern = compile_date_pattern()
+# Every date shape contains a year, paragraphs without one are skipped before the full scan
+year_pattern = re.compile(YEAR)
+
+
+def parse_day(day: str):
+    if day.isdigit():
+        return int(day)
+    return day_ordinals[day.lower()]
+
+
+def detect_dates(paragraph: str):
+    """
+    Find and normalise every date mention of a paragraph
+
+    Args:
+        paragraph: Text to scan
+
+    Returns:
+        List of dicts with the start and end character offsets of the mention (end excluded),
+        its text and the date normalised to the "%B %-d, %Y" shape (e.g. "September 6, 2001")
+
+    """
+    if not year_pattern.search(paragraph):
+        return []
+    spans = []
+    for match in date_pattern.finditer(paragraph):
+        index = match.lastgroup[len("shape") :]
+        month = match.group("month_" + index)
+        month = int(month) if month.isdigit() else month_numbers[month.lower()]
+        day = parse_day(match.group("day_" + index))
+        year = int(match.group("year_" + index))
+        month_days = days[month - 1] + (month == 2 and calendar.isleap(year))
+        if day > month_days:
+            continue
+        spans.append(
+            {
+                "start": match.start(),
+                "end": match.end(),
+                "text": match.group(),
+                "date": "{} {}, {}".format(months[month - 1], day, year),
+            }
+        )
+    return spans
+
+
+def label_corpus(paragraphs, multi_span: bool = False):
+    """
+    Label the date mentions of paragraphs for the augmentation pipeline
+
+    Args:
+        paragraphs: Iterable of paragraphs
+        multi_span: Label every date mention of a paragraph in one record instead of one record per mention
+
+    Returns:
+        Generator of paragraph, date_index_start, date_index_end and normalized_date records, one per date mention.
+        With multi_span, one record per paragraph with dates, with the date_spans and normalized_dates of
+        all of its mentions and the first one as date_index_start and date_index_end. Mentions followed
+        by punctuation only, up to the end of the paragraph or to the next labelled mention, are not labelled
+
+    """
+    for paragraph in paragraphs:
+        # A mention followed by punctuation only leaves no text after the label to augment
+        spans = [
+            span
+            for span in detect_dates(paragraph)
+            if has_words(split_parts(paragraph, [(span["start"], span["end"])])[-1])
+        ]
+        if multi_span:
+            # From the last mention, so the text after a dropped mention goes to the part of the previous one
+            labelled = []
+            next_start = len(paragraph)
+            for span in reversed(spans):
+                text_after = paragraph[span["end"] : next_start]
+                if has_words(text_after):
+                    labelled.insert(0, span)
+                    next_start = span["start"]
+            spans = labelled
+        if multi_span and len(spans) > 1:
+            yield {
+                "paragraph": paragraph,
+                "date_index_start": spans[0]["start"],
+                "date_index_end": spans[0]["end"],
+                "date_spans": [[span["start"], span["end"]] for span in spans],
+                "normalized_dates": [span["date"] for span in spans],
+            }
+            continue
+        for span in spans:
+            yield {
+                "paragraph": paragraph,
+                "date_index_start": span["start"],
+                "date_index_end": span["end"],
+                "normalized_date": span["date"],
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Label the date mentions of raw paragraphs as a JSONL corpus for data_augmentation.py"
+    )
+    parser.add_argument(
+        "input",
+        help="Text file with one paragraph per line, or JSONL file with a paragraph field",
+    )
+    parser.add_argument("output", help="Path of the labelled JSONL corpus")
+    parser.add_argument(
+        "--multi-span",
+        action="store_true",
+        help="Write one record per paragraph with all of its date mentions, augmented together",
+    )
+    args = parser.parse_args()
+
+    def read_paragraphs():
+        with open(args.input, encoding="utf-8") as paragraphs:
+            for line in paragraphs:
+                line = line.strip()
+                if not line:
+                    continue
+                yield json.loads(line)["paragraph"] if line.startswith("{") else line
+
+    labels = 0
+    with open(args.output, "w", encoding="utf-8") as corpus:
+        for record in label_corpus(read_paragraphs(), multi_span=args.multi_span):
+            corpus.write(json.dumps(record, ensure_ascii=False) + "\n")
+            labels += len(record.get("date_spans", [None]))
+    print("{} date mentions labelled".format(labels))
+
+
+if __name__ == "__main__":
+    main()
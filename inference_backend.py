@@ -0,0 +1,335 @@
+import argparse
+import os
+import re
+import sys
+
+# torch, transformers and nlpaug are imported on first use, the fp32 backend never imports them
+
+# fp32: eager PyTorch models as loaded by transformers
+# int8: Linear layers dynamically quantised to int8, for every model
+# torchscript: traced graph of the masked language model. The translation and XLNet models
+#   generate token by token with Python control flow that a single graph cannot hold, they are
+#   quantised to int8 like with the int8 backend
+BACKENDS = ["fp32", "int8", "torchscript"]
+
+# transformers auto classes of the model kinds
+AUTO_MODELS = {
+    "masked_lm": "AutoModelForMaskedLM",
+    "causal_lm": "AutoModelForCausalLM",
+    "seq2seq": "AutoModelForSeq2SeqLM",
+}
+
+AGREEMENT_TEXTS = [
+    "This Lease Agreement is entered into on January 22, 1999 by and between the Landlord and the Tenant.",
+    "The Tenant shall pay the monthly rent on the first day of each month without any deduction.",
+    "Either party may terminate this agreement by giving sixty days written notice to the other party.",
+    "The Premises shall be used only as a private residence and for no other purpose whatsoever.",
+]
+
+
+def quantize_int8(model):
+    """
+    Dynamically quantise the Linear layers of a model to int8: weights are stored in int8 and
+    activations are quantised on the fly, which needs no calibration data
+
+    Returns:
+        Quantised copy of the model
+
+    """
+    import torch
+
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+class InferenceBackend:
+    """
+    Conversion of the models of the augmenters to a CPU-optimised backend.
+    A model is converted once, the converted artifact is saved in artifacts_dir and loaded
+    instead of converting the model again by the next runs and workers
+
+    Args:
+        name: One of BACKENDS
+        artifacts_dir: Directory of the converted artifacts. They are pickled modules: only load artifacts you wrote
+
+    """
+
+    def __init__(
+        self, name: str = "fp32", artifacts_dir: str = "inference_artifacts"
+    ) -> None:
+        if name not in BACKENDS:
+            raise ValueError(
+                "Unknown inference backend {}, expected one of {}".format(
+                    name, ", ".join(BACKENDS)
+                )
+            )
+        self.name = name
+        self.artifacts_dir = artifacts_dir
+        self.conversions = 0
+        self.loads = 0
+
+    def artifact_format(self, kind: str):
+        if self.name == "torchscript" and kind == "masked_lm":
+            return "torchscript"
+        return "int8"
+
+    def artifact_path(self, model_name: str, kind: str):
+        """
+        Path of the converted artifact of a model. Artifacts depend on the torch and transformers
+        versions, they are part of the file name
+
+        """
+        import torch
+        import transformers
+
+        artifact_format = self.artifact_format(kind)
+        return os.path.join(
+            self.artifacts_dir,
+            "{}.{}.torch-{}.transformers-{}.pt".format(
+                re.sub(r"[^\w.-]", "_", model_name),
+                artifact_format,
+                torch.__version__.split("+")[0],
+                transformers.__version__,
+            ),
+        )
+
+    def convert(self, model, model_name: str, kind: str, tokenizer=None):
+        """
+        Convert a model, or load its converted artifact
+
+        Args:
+            model: fp32 transformers model
+            model_name: Model name or model path, naming the artifact
+            kind: "masked_lm", "causal_lm" or "seq2seq"
+            tokenizer: Tokenizer of the model, used to build the example inputs of a traced graph
+
+        Returns:
+            The converted model, or model itself with the fp32 backend
+
+        """
+        # nlpaug caches its models across augmenters, a model rebuilt from its cache is already converted
+        if self.name == "fp32" or getattr(model, "converted_to", None) == self.name:
+            return model
+        import torch
+
+        path = self.artifact_path(model_name, kind)
+        if os.path.exists(path):
+            self.loads += 1
+            if self.artifact_format(kind) == "torchscript":
+                return torch.jit.load(path)
+            converted = torch.load(path, weights_only=False)
+            # Unpickling rebuilds the generation config from the model config, it is taken from the loaded model instead
+            converted.config = model.config
+            converted.generation_config = model.generation_config
+            converted.converted_to = self.name
+            return converted
+        os.makedirs(self.artifacts_dir, exist_ok=True)
+        # Written to a temporary file first, so a concurrent worker never loads a partial artifact
+        temporary_path = "{}.{}.tmp".format(path, os.getpid())
+        if self.artifact_format(kind) == "torchscript":
+            converted = self.trace(model, tokenizer)
+            torch.jit.save(converted, temporary_path)
+        else:
+            converted = quantize_int8(model)
+            torch.save(converted, temporary_path)
+            converted.converted_to = self.name
+        os.replace(temporary_path, path)
+        self.conversions += 1
+        return converted
+
+    @staticmethod
+    def trace(model, tokenizer):
+        """
+        Trace the forward pass of a masked language model taking input_ids and attention_mask.
+        The graph returns a dict with the logits, like the eager model
+
+        """
+        import torch
+
+        inputs = tokenizer(AGREEMENT_TEXTS[:2], padding=True, return_tensors="pt")
+        with torch.no_grad():
+            return torch.jit.trace(
+                model,
+                (inputs["input_ids"], inputs["attention_mask"]),
+                strict=False,
+            )
+
+    def prepare(self, augmenter):
+        """
+        Swap the models of a newly built augmenter for their converted version.
+        Augmenters without a model are returned as they are
+
+        Args:
+            augmenter: Augmenter built by the augmenter registry
+
+        Returns:
+            The augmenter
+
+        """
+        if self.name == "fp32":
+            return augmenter
+        import nlpaug.augmenter.word as naw
+        from masked_lm_augmenter import MaskedLMAugmenter
+        from xlnet_augmenter import XLNetAugmenter
+
+        if isinstance(augmenter, MaskedLMAugmenter):
+            augmenter.model = self.convert(
+                augmenter.model, augmenter.model_path, "masked_lm", augmenter.tokenizer
+            )
+        elif isinstance(augmenter, naw.BackTranslationAug):
+            # The translation models are shared through nlpaug's model cache, the swap applies to the whole process
+            translation = augmenter.model
+            translation.src_model = self.convert(
+                translation.src_model, translation.src_model_name, "seq2seq"
+            )
+            translation.tgt_model = self.convert(
+                translation.tgt_model, translation.tgt_model_name, "seq2seq"
+            )
+        elif isinstance(augmenter, XLNetAugmenter):
+            augmenter.model = self.convert(
+                augmenter.model, augmenter.model_path, "causal_lm"
+            )
+        return augmenter
+
+
+def augmenter_models(nlpAugmenter):
+    """
+    Models of the augmenters of an NLPAugmenters instance
+
+    Returns:
+        List of (model name, kind) pairs
+
+    """
+    import nlpaug.augmenter.word as naw
+    from masked_lm_augmenter import MaskedLMAugmenter
+    from xlnet_augmenter import XLNetAugmenter
+
+    models = []
+    for factory, params in nlpAugmenter.augmenter_specs().values():
+        if factory is MaskedLMAugmenter:
+            models.append((params["model_path"], "masked_lm"))
+        elif factory is XLNetAugmenter:
+            models.append((params["model_path"], "causal_lm"))
+        elif factory is naw.BackTranslationAug:
+            models.append((params["from_model_name"], "seq2seq"))
+            models.append((params["to_model_name"], "seq2seq"))
+    return list(dict.fromkeys(models))
+
+
+def check_agreement(
+    model_name: str,
+    kind: str,
+    backend: InferenceBackend,
+    texts: list = AGREEMENT_TEXTS,
+    max_length: int = 64,
+):
+    """
+    Compare the outputs of a converted model with the outputs of the fp32 model
+
+    Args:
+        model_name: Model name or model path
+        kind: "masked_lm", "causal_lm" or "seq2seq"
+        backend: Backend converting the model
+        texts: Texts the models are run on
+        max_length: Maximum length of the generated translations
+
+    Returns:
+        Dict with the agreement, the share of top-1 predictions (language models) or generated
+        tokens (translation models) that are the same, and the share of texts with exactly the same output
+
+    """
+    import torch
+    import transformers
+
+    auto_model = getattr(transformers, AUTO_MODELS[kind])
+    tokenizer = transformers.AutoTokenizer.from_pretrained(model_name)
+    reference = auto_model.from_pretrained(model_name).eval()
+    candidate = backend.convert(
+        auto_model.from_pretrained(model_name).eval(),
+        model_name,
+        kind,
+        tokenizer,
+    )
+    same_tokens = 0
+    tokens = 0
+    same_texts = 0
+    with torch.no_grad():
+        for text in texts:
+            inputs = tokenizer(text, return_tensors="pt")
+            if kind == "seq2seq":
+                # Greedy decoding, so the difference comes from the models and not from sampling
+                outputs = [
+                    model.generate(
+                        **inputs, num_beams=1, do_sample=False, max_length=max_length
+                    )[0].tolist()
+                    for model in [reference, candidate]
+                ]
+            else:
+                outputs = [
+                    model(inputs["input_ids"], inputs["attention_mask"])["logits"]
+                    .argmax(-1)[0]
+                    .tolist()
+                    for model in [reference, candidate]
+                ]
+            same_tokens += sum(1 for left, right in zip(*outputs) if left == right)
+            tokens += max(len(output) for output in outputs)
+            same_texts += outputs[0] == outputs[1]
+    return {
+        "model": model_name,
+        "kind": kind,
+        "backend": backend.name,
+        "agreement": same_tokens / max(1, tokens),
+        "exact_match": same_texts / max(1, len(texts)),
+    }
+
+
+def main():
+    from nlp_augmenters import NLPAugmenters
+
+    parser = argparse.ArgumentParser(
+        description="Convert the models of the augmenters and check the agreement of the converted models with fp32"
+    )
+    parser.add_argument("--backend", choices=BACKENDS[1:], default="int8")
+    parser.add_argument(
+        "--artifacts-dir",
+        default="inference_artifacts",
+        help="Directory of the converted artifacts",
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        help="Names of the models to check, every model of the augmenters by default",
+    )
+    parser.add_argument(
+        "--min-agreement",
+        type=float,
+        default=0.9,
+        help="Minimum agreement with fp32. Exit with status 1 if a model is below it",
+    )
+    args = parser.parse_args()
+
+    backend = InferenceBackend(args.backend, args.artifacts_dir)
+    models = augmenter_models(NLPAugmenters())
+    if args.models:
+        models = [(name, kind) for name, kind in models if name in args.models]
+    failures = 0
+    for model_name, kind in models:
+        result = check_agreement(model_name, kind, backend)
+        print(
+            "{:<40} {:<10} agreement {:.3f} exact match {:.3f}".format(
+                model_name, kind, result["agreement"], result["exact_match"]
+            )
+        )
+        failures += result["agreement"] < args.min_agreement
+    if failures:
+        print(
+            "{} models below the minimum agreement of {}".format(
+                failures, args.min_agreement
+            )
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(values: list, share: float):
+    """
+    Percentile of a list of values, by the nearest rank
+
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+async def post(reader, writer, host: str, path: str, body: dict):
+    """
+    Send a POST request on a kept-alive connection
+
+    Returns:
+        HTTP status and decoded JSON response
+
+    """
+    payload = json.dumps(body).encode("utf-8")
+    writer.write(
+        (
+            "POST {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n"
+            "Content-Length: {}\r\n\r\n".format(path, host, len(payload))
+        ).encode("latin-1")
+        + payload
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    response = await reader.readexactly(int(headers.get("content-length", 0)))
+    return status, json.loads(response or b"null")
+
+
+async def client(url: str, bodies: list, start: int, step: int, results: dict):
+    """
+    Send bodies[start::step] one after the other on one connection, recording the latencies
+
+    """
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        for body in bodies[start::step]:
+            started = time.perf_counter()
+            status, _ = await post(reader, writer, parts.netloc, parts.path, body)
+            if status == 200:
+                results["latencies"].append(time.perf_counter() - started)
+            elif status == 503:
+                results["rejected"] += 1
+            else:
+                results["errors"] += 1
+    finally:
+        writer.close()
+
+
+async def run_level(url: str, bodies: list, concurrency: int):
+    """
+    Send the bodies with concurrency clients
+
+    Returns:
+        Dict with the throughput, the latency percentiles and the numbers of rejected and failed requests
+
+    """
+    results = {"latencies": [], "rejected": 0, "errors": 0}
+    started = time.perf_counter()
+    await asyncio.gather(
+        *[
+            client(url, bodies, index, concurrency, results)
+            for index in range(concurrency)
+        ]
+    )
+    seconds = time.perf_counter() - started
+    latencies = results["latencies"]
+    return {
+        "concurrency": concurrency,
+        "requests": len(bodies),
+        "seconds": seconds,
+        "throughput": len(latencies) / seconds,
+        "p50_ms": 1000 * percentile(latencies, 0.5),
+        "p99_ms": 1000 * percentile(latencies, 0.99),
+        "rejected": results["rejected"],
+        "errors": results["errors"],
+    }
+
+
+def request_bodies(endpoint: str, requests: int, length: int, params: dict):
+    """
+    Build the request bodies: sample paragraphs for augment_paragraph, distinct texts of length
+    words otherwise, so the augmentation cache does not answer them
+
+    """
+    if endpoint == "augment_paragraph":
+        from data_augmentation import dataset
+
+        return [dict(dataset[index % len(dataset)]) for index in range(requests)]
+    from benchmark import benchmark_texts
+
+    return [dict(params, text=text) for text in benchmark_texts(length, requests)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput and latency of the augmentation service against the number of concurrent clients"
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument(
+        "--endpoint",
+        default="synonymAugmenter",
+        help="augment_paragraph, or an augmenter method served under /augment/",
+    )
+    parser.add_argument(
+        "--params",
+        default="{}",
+        help="JSON object of the parameters sent with each text",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16],
+        help="Numbers of concurrent clients",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=64,
+        help="Number of requests per concurrency level",
+    )
+    parser.add_argument(
+        "--length", type=int, default=20, help="Number of words per text"
+    )
+    parser.add_argument(
+        "--output", default=None, help="Path of the JSON file of the results"
+    )
+    args = parser.parse_args()
+
+    if args.endpoint == "augment_paragraph":
+        url = args.url.rstrip("/") + "/augment_paragraph"
+    else:
+        url = args.url.rstrip("/") + "/augment/" + args.endpoint
+    results = []
+    print(
+        "{:>11} {:>9} {:>12} {:>9} {:>9} {:>8} {:>6}".format(
+            "concurrency",
+            "requests",
+            "requests/s",
+            "p50 ms",
+            "p99 ms",
+            "rejected",
+            "errors",
+        )
+    )
+    for index, concurrency in enumerate(args.concurrency):
+        # Each level gets texts of its own, otherwise the cache of the service answers the later levels
+        bodies = request_bodies(
+            args.endpoint,
+            args.requests * (index + 1),
+            args.length,
+            json.loads(args.params),
+        )[args.requests * index :]
+        result = asyncio.run(run_level(url, bodies, concurrency))
+        results.append(result)
+        print(
+            "{concurrency:>11} {requests:>9} {throughput:>12.1f} {p50_ms:>9.1f} {p99_ms:>9.1f} {rejected:>8} {errors:>6}".format(
+                **result
+            )
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
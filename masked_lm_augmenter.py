@@ -0,0 +1,238 @@
+import math
+import random
+import string
+
+import torch
+
+
+class MaskedLMAugmenter:
+    """
+    Batched version of nlpaug's ContextualWordEmbsAug for BERT masked language models.
+    Every variant of every text is augmented at the same time: at each step one position of each
+    variant is masked, and the masked sequences are sorted by length and predicted in padded batches.
+    Special tokens, [UNK] and subword pieces are excluded from the predictions at the vocabulary level
+
+    Args:
+        model_path: Model name or model path of a BERT masked language model
+        top_k: Number of best predictions the new word is sampled from
+        aug_p: Percentage of the words augmented in each variant
+        aug_min: Minimum number of words augmented in each variant
+        aug_max: Maximum number of words augmented in each variant
+        batch_size: Number of masked sequences predicted in one forward pass
+        device: Torch device of the model
+
+    """
+
+    def __init__(
+        self,
+        model_path: str = "nlpaueb/legal-bert-base-uncased",
+        top_k: int = 100,
+        aug_p: float = 0.3,
+        aug_min: int = 1,
+        aug_max: int = 10,
+        batch_size: int = 32,
+        device: str = "cpu",
+    ) -> None:
+        self.model_path = model_path
+        self.aug_p = aug_p
+        self.aug_min = aug_min
+        self.aug_max = aug_max
+        self.batch_size = batch_size
+        self.device = device
+        # Imported on first use, the stage threads only start once NLPAugmenters.import_models has run
+        from transformers import AutoModelForMaskedLM, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.model = AutoModelForMaskedLM.from_pretrained(model_path).to(device).eval()
+        # Room for the special tokens, as nlpaug keeps it
+        self.max_num_token = self.model.config.max_position_embeddings - 2 * 5
+
+        # Logit bias removing the tokens that are never predicted
+        vocab = self.tokenizer.get_vocab()
+        allowed_ids = set(vocab.values()) - set(self.tokenizer.all_special_ids)
+        allowed_ids -= {
+            index for token, index in vocab.items() if token.startswith("##")
+        }
+        self.logit_bias = torch.full(
+            (self.model.config.vocab_size,), float("-inf"), device=device
+        )
+        self.logit_bias[sorted(allowed_ids)] = 0.0
+        self.top_k = min(top_k, len(allowed_ids))
+
+    def tokenize(self, text: str):
+        """
+        Split a text into the word pieces augmented and the text left as it is after max_num_token pieces
+
+        Returns:
+            Token ids, token strings and tail text. Unknown words keep their text instead of [UNK]
+
+        """
+        unknown_id = self.tokenizer.unk_token_id
+        if self.tokenizer.is_fast:
+            encoding = self.tokenizer(
+                text, add_special_tokens=False, return_offsets_mapping=True
+            )
+            ids = encoding["input_ids"]
+            offsets = encoding["offset_mapping"]
+            tokens = [
+                text[start:end] if index == unknown_id else token
+                for index, token, (start, end) in zip(
+                    ids, self.tokenizer.convert_ids_to_tokens(ids), offsets
+                )
+            ]
+            tail = (
+                text[offsets[self.max_num_token][0] :].strip()
+                if len(ids) > self.max_num_token
+                else ""
+            )
+        else:
+            tokens = self.tokenizer.tokenize(text)
+            ids = self.tokenizer.convert_tokens_to_ids(tokens)
+            tail = self.detokenize(tokens[self.max_num_token :])
+        return ids[: self.max_num_token], tokens[: self.max_num_token], tail
+
+    def detokenize(self, tokens: list):
+        return self.tokenizer.clean_up_tokenization(
+            self.tokenizer.convert_tokens_to_string(tokens)
+        ).strip()
+
+    def sample_positions(self, tokens: list, rng=random):
+        """
+        Sample the positions to augment, like nlpaug: aug_p of the tokens, between aug_min and aug_max,
+        skipping punctuation and subword pieces. Positions are returned from last to first so an
+        augmentation never shifts the positions still to augment
+
+        """
+        candidates = [
+            position
+            for position, token in enumerate(tokens)
+            if token not in string.punctuation and not token.startswith("##")
+        ]
+        count = min(
+            max(int(math.ceil(self.aug_p * len(tokens))), self.aug_min), self.aug_max
+        )
+        count = min(count, len(candidates))
+        return sorted(rng.sample(candidates, count), reverse=True)
+
+    def augment(
+        self,
+        texts: list,
+        actions: list = ("insert", "substitute"),
+        n: int = 5,
+        seeds: list = None,
+    ):
+        """
+        Augment texts with every action. Each text is tokenized once for all the actions and variants
+
+        Args:
+            texts: Texts to augment
+            actions: "insert" to inject new words, "substitute" to replace words
+            n: Number of variants per text and action
+            seeds: Optional dict of action: seed per text. The variants of a text and action then draw
+                from their own generator, so they do not depend on the other texts of the call
+
+        Returns:
+            Dict of action: list of n augmented texts per text. Empty texts give no variant
+
+        """
+        variants = []
+        outputs = {action: [[] for _ in texts] for action in actions}
+        for text_index, text in enumerate(texts):
+            text = text.strip()
+            if not text:
+                continue
+            ids, tokens, tail = self.tokenize(text)
+            for action in actions:
+                rng = (
+                    random
+                    if seeds is None
+                    else random.Random(seeds[text_index][action])
+                )
+                for _ in range(n):
+                    variants.append(
+                        {
+                            "text_index": text_index,
+                            "action": action,
+                            "ids": list(ids),
+                            "tokens": list(tokens),
+                            "positions": self.sample_positions(tokens, rng),
+                            "tail": tail,
+                            "rng": rng,
+                        }
+                    )
+
+        active = [variant for variant in variants if variant["positions"]]
+        while active:
+            for variant in active:
+                self.mask(variant)
+            self.predict(active)
+            # Like nlpaug, a variant stops growing once it exceeds max_num_token pieces
+            active = [
+                variant
+                for variant in active
+                if variant["positions"] and len(variant["ids"]) <= self.max_num_token
+            ]
+
+        for variant in variants:
+            augmented_text = self.detokenize(variant["tokens"])
+            if variant["tail"]:
+                augmented_text += " " + variant["tail"]
+            outputs[variant["action"]][variant["text_index"]].append(augmented_text)
+        return outputs
+
+    def mask(self, variant: dict):
+        """
+        Put the mask token at the next position of a variant: inserted before the token for insert,
+        replacing the word and its subword pieces for substitute
+
+        """
+        position = variant["positions"].pop(0)
+        ids, tokens = variant["ids"], variant["tokens"]
+        if variant["action"] == "insert":
+            end = position
+        else:
+            end = position + 1
+            while end < len(tokens) and tokens[end].startswith("##"):
+                end += 1
+        ids[position:end] = [self.tokenizer.mask_token_id]
+        tokens[position:end] = [self.tokenizer.mask_token]
+        variant["mask_position"] = position
+
+    def predict(self, variants: list):
+        """
+        Predict the masked word of each variant in padded batches of sequences of similar lengths,
+        and sample it among the top_k allowed tokens
+
+        """
+        variants = sorted(variants, key=lambda variant: len(variant["ids"]))
+        for start in range(0, len(variants), self.batch_size):
+            batch = variants[start : start + self.batch_size]
+            sequences = [
+                self.tokenizer.build_inputs_with_special_tokens(variant["ids"])
+                for variant in batch
+            ]
+            length = max(len(sequence) for sequence in sequences)
+            input_ids = torch.full(
+                (len(batch), length), self.tokenizer.pad_token_id, dtype=torch.long
+            )
+            attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+            mask_positions = []
+            for row, sequence in enumerate(sequences):
+                input_ids[row, : len(sequence)] = torch.tensor(sequence)
+                attention_mask[row, : len(sequence)] = 1
+                mask_positions.append(sequence.index(self.tokenizer.mask_token_id))
+            with torch.no_grad():
+                # Positional inputs and the logits item, so a traced graph of the model works as well
+                logits = self.model(
+                    input_ids.to(self.device), attention_mask.to(self.device)
+                )["logits"]
+            mask_logits = logits[torch.arange(len(batch)), mask_positions]
+            candidates = (mask_logits + self.logit_bias).topk(self.top_k).indices
+            for variant, variant_candidates in zip(batch, candidates.tolist()):
+                # nlpaug samples the new word uniformly among the best predictions
+                index = variant["rng"].choice(variant_candidates)
+                position = variant.pop("mask_position")
+                variant["ids"][position] = index
+                variant["tokens"][position] = self.tokenizer.convert_ids_to_tokens(
+                    index
+                )
@@ -0,0 +1,242 @@
+import argparse
+import re
+import sys
+import zlib
+
+import numpy as np
+
+
+WORD_PATTERN = re.compile(r"\w+")
+HASH_MASK = 0xFFFFFFFF
+
+# Clauses whose one-word variants the filter has to drop, from a short clause to a paragraph part
+CHECK_TEXTS = [
+    "The Tenant shall pay the rent to the Landlord on the first day of each month.",
+    "Either party may terminate this agreement by giving sixty days written notice to the other party.",
+    "The Tenant may exercise the option granted pursuant to this Section 39.1 (if at all) only by "
+    "notifying the Landlord, in writing, not later than the date of the commencement of the term.",
+]
+
+
+def shingle_hashes(text: str, size: int = 1, word_hashes: dict = None):
+    """
+    32-bit hashes of the word shingles of a text: its lowercased word n-grams. A text shorter than
+    size words is one shingle
+
+    Args:
+        text: Text to shingle
+        size: Number of words per shingle
+        word_hashes: Cache of the hashes of the words, shared between texts
+
+    Returns:
+        Set of shingle hashes
+
+    """
+    if word_hashes is None:
+        word_hashes = {}
+    words = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        word_hash = word_hashes.get(word)
+        if word_hash is None:
+            word_hash = word_hashes[word] = zlib.crc32(word.encode("utf-8"))
+        words.append(word_hash)
+    if len(words) <= size:
+        return {hash(tuple(words)) & HASH_MASK}
+    # Tuples of ints hash the same way in every process, unlike strings
+    return {
+        hash(tuple(words[index : index + size])) & HASH_MASK
+        for index in range(len(words) - size + 1)
+    }
+
+
+def lsh_parameters(threshold: float, num_perm: int):
+    """
+    Choose the number of bands and rows per band of the LSH index, so that the similarity at which
+    two texts have a 50% chance to share a band, (1 / bands) ** (1 / rows), is the closest to threshold
+    without exceeding it: texts at threshold are compared most of the time instead of half of the time
+
+    Returns:
+        Number of bands and number of rows per band
+
+    """
+    return max(
+        (
+            (bands, num_perm // bands)
+            for bands in range(1, num_perm + 1)
+            if num_perm % bands == 0 and (1 / bands) ** (bands / num_perm) <= threshold
+        ),
+        key=lambda parameters: (1 / parameters[0]) ** (1 / parameters[1]),
+        default=(num_perm, 1),
+    )
+
+
+class NearDuplicateFilter:
+    """
+    Near-duplicate filter of generated texts with MinHash signatures of their word shingles and an
+    LSH index of the signature bands. Each text is compared with the kept texts sharing one of its
+    bands only, so filtering n texts takes near-linear time. A text is dropped when the estimated
+    Jaccard similarity of its shingles with a kept text reaches threshold
+
+    Args:
+        threshold: Jaccard similarity from which two texts are near duplicates
+        num_perm: Number of hash permutations of the signatures
+        shingle_size: Number of words per shingle. Single words, so that one word swapped in a
+            clause of a dozen words keeps a similarity above 0.8, where 3-word shingles fall to 0.7
+        chunk_size: Number of texts whose signatures are computed together
+        seed: Seed of the hash permutations
+
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        num_perm: int = 128,
+        shingle_size: int = 1,
+        chunk_size: int = 1024,
+        seed: int = 1,
+    ) -> None:
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.chunk_size = chunk_size
+        self.bands, self.rows = lsh_parameters(threshold, num_perm)
+        rng = np.random.RandomState(seed)
+        # Multiply-shift permutations of the 32-bit shingle hashes: ((a * x + b) mod 2 ** 64) >> 32
+        self.a = rng.randint(0, 2**63, num_perm, dtype=np.uint64) * np.uint64(
+            2
+        ) + np.uint64(1)
+        self.b = rng.randint(0, 2**63, num_perm, dtype=np.uint64)
+
+    def signatures(self, texts: list):
+        """
+        MinHash signatures of texts
+
+        Returns:
+            uint32 array of shape (len(texts), num_perm)
+
+        """
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        word_hashes = {}
+        for start in range(0, len(texts), self.chunk_size):
+            chunk = [
+                shingle_hashes(text, self.shingle_size, word_hashes)
+                for text in texts[start : start + self.chunk_size]
+            ]
+            hashes = np.fromiter(
+                (value for text_hashes in chunk for value in text_hashes),
+                dtype=np.uint64,
+            )
+            # Variants of a text share most of their shingles, each distinct shingle is permuted once
+            unique_hashes, inverse = np.unique(hashes, return_inverse=True)
+            permuted = (
+                (unique_hashes[:, None] * self.a + self.b) >> np.uint64(32)
+            ).astype(np.uint32)[inverse]
+            # Minimum of every permutation over the shingles of each text
+            offsets = np.cumsum([0] + [len(text_hashes) for text_hashes in chunk[:-1]])
+            signatures[start : start + len(chunk)] = np.minimum.reduceat(
+                permuted, offsets, axis=0
+            )
+        return signatures
+
+    def filter(self, texts: list, sources: list = None):
+        """
+        Keep the first text of each group of near duplicates, in the order of texts
+
+        Args:
+            texts: Texts to filter
+            sources: Name of the augmenter of each text
+
+        Returns:
+            Kept texts, and a dict of source: {"candidates": number of texts, "kept": number of kept texts}
+
+        """
+        if sources is None:
+            sources = [None] * len(texts)
+        contributions = {}
+        for source in sources:
+            contributions.setdefault(source, {"candidates": 0, "kept": 0})
+            contributions[source]["candidates"] += 1
+        if not texts:
+            return [], contributions
+        signatures = self.signatures(texts)
+        buckets = [{} for _ in range(self.bands)]
+        kept = []
+        for index, signature in enumerate(signatures):
+            keys = [
+                signature[band * self.rows : (band + 1) * self.rows].tobytes()
+                for band in range(self.bands)
+            ]
+            candidates = {
+                kept_index
+                for band, key in enumerate(keys)
+                for kept_index in buckets[band].get(key, ())
+            }
+            if any(
+                np.mean(signatures[kept_index] == signature) >= self.threshold
+                for kept_index in candidates
+            ):
+                continue
+            kept.append(index)
+            contributions[sources[index]]["kept"] += 1
+            for band, key in enumerate(keys):
+                buckets[band].setdefault(key, []).append(index)
+        return [texts[index] for index in kept], contributions
+
+
+def format_contributions(contributions: dict):
+    """
+    One line summary of the texts each augmenter contributed before and after filtering
+
+    """
+    return ", ".join(
+        "{} {}/{}".format(source, counts["kept"], counts["candidates"])
+        for source, counts in contributions.items()
+    )
+
+
+def check_word_variants(threshold: float = 0.8, texts: list = CHECK_TEXTS):
+    """
+    Check that the filter drops the variants of a text differing from it by one word, like a synonym
+    swapped by an augmenter
+
+    Args:
+        threshold: Jaccard similarity of the filter
+        texts: Texts whose variants replace each of their words in turn
+
+    Returns:
+        List of the variants the filter keeps along with their text
+
+    """
+    near_duplicate_filter = NearDuplicateFilter(threshold)
+    kept = []
+    for text in texts:
+        words = text.split()
+        for index in range(len(words)):
+            variant = " ".join(words[:index] + ["Substitute"] + words[index + 1 :])
+            if len(near_duplicate_filter.filter([text, variant])[0]) == 2:
+                kept.append(variant)
+    return kept
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the near-duplicate filter drops the one-word variants of contract clauses"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.8,
+        help="Jaccard similarity of the filter, the default of data_augmentation.py --near-duplicate-threshold",
+    )
+    args = parser.parse_args()
+
+    kept = check_word_variants(args.threshold)
+    for variant in kept:
+        print("Kept one-word variant: {}".format(variant))
+    if kept:
+        sys.exit(1)
+    print("Every one-word variant is dropped at threshold {}".format(args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,334 @@
-import nlpaug.augmenter.word as naw
-import nlpaug.augmenter.sentence as nas
+import contextlib
+import functools
+import inspect
+import random
+import threading
+
+from augmentation_cache import AugmentationCache
+from augmentation_metrics import MetricsRecorder
+from augmenter_registry import AugmenterRegistry
+from inference_backend import InferenceBackend
+
+# nlpaug imports torch and transformers, which takes seconds and hundreds of MB: it is imported by the
+# methods using it, so jobs and worker processes start without it
+
+
+# Translation models used by the back-translation augmenters: (from_model_name, to_model_name)
+BACKTRANSLATION_MODELS = {
+    "de": ("facebook/wmt19-en-de", "facebook/wmt19-de-en"),
+    "ru": ("facebook/wmt19-en-ru", "facebook/wmt19-ru-en"),
+    "ar": ("Helsinki-NLP/opus-mt-en-ar", "Helsinki-NLP/opus-mt-ar-en"),
+}
+
+# Number of words of the sentence completed by the XLNet augmenters, before and after the date label
+BEFORE_LABEL_TEXT_LIMIT = 11
+AFTER_LABEL_TEXT_LIMIT = 9
+
+
+def seed_random_generators(seed: int):
+    """
+    Seed the random generators used by nlpaug: random, numpy and torch (if it is installed)
+
+    Args:
+        seed: Seed of the random draws
+
+    """
+    random.seed(seed)
+    try:
+        import numpy as np
+
+        np.random.seed(seed % 2**32)
+    except ImportError:
+        pass
+    try:
+        import torch
+
+        torch.manual_seed(seed)
+    except ImportError:
+        pass
+
+
+def cached(method):
+    """
+    Decorator caching the outputs of an NLPAugmenters method taking a text argument and measuring its calls.
+    The cache key is made of the method name, the other arguments, the text and the seed
+
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        arguments = signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        params = dict(arguments.arguments)
+        del params["self"]
+        text = params.pop("text")
+        with self.metrics.measure("call", method.__name__, text) as record:
+            output = self.cached_call(
+                method.__name__,
+                params,
+                text,
+                lambda: method(self, *args, **kwargs),
+                record,
+            )
+            record["outputs"] = output
+        return output
+
+    return wrapper
 
 
 # Implement a class to customize used methods of nlpaug library
 class NLPAugmenters:
-    def __init__(self) -> None:
-        pass
+    """
+    Customized methods of nlpaug library.
+    Built augmenters and their models are kept in a registry and reused across calls
+
+    Args:
+        max_rss_mb: RSS budget in MB. Least recently used augmenters are released when it is exceeded
+        cache: Persistent cache of the augmentation outputs. Nothing is cached if it is None
+        seed: Seed of the random draws. If it is set, each call is seeded from it and its cache key, and the
+            batch methods seed each text from its own cache key, so an output does not depend on the other
+            texts of its batch
+        backtranslation_models: Dict of language: (from_model_name, to_model_name) overriding BACKTRANSLATION_MODELS
+        metrics: Recorder of the call metrics. Calls are only summed in memory if it is None
+        backend: Inference backend of the models, one of inference_backend.BACKENDS: "fp32", "int8" or "torchscript"
+        artifacts_dir: Directory of the models converted by the backend
+        wordnet_index: Path of a WordNet index built by wordnet_index.py. If it is set, the synonym and antonym
+            augmenters sample from it instead of querying NLTK WordNet
+        torch_threads: Torch intra-op threads, set when the first model is loaded. The torch defaults are
+            kept if it is None
+
+    """
+
+    def __init__(
+        self,
+        max_rss_mb: float = None,
+        cache: AugmentationCache = None,
+        seed: int = None,
+        backtranslation_models: dict = None,
+        metrics: MetricsRecorder = None,
+        backend: str = "fp32",
+        artifacts_dir: str = "inference_artifacts",
+        wordnet_index: str = None,
+        torch_threads: int = None,
+    ) -> None:
+        self.backend = InferenceBackend(backend, artifacts_dir)
+        self.registry = AugmenterRegistry(
+            max_rss_mb=max_rss_mb,
+            prepare=self.backend.prepare,
+            torch_threads=torch_threads,
+        )
+        self.cache = cache
+        self.seed = seed
+        self.backtranslation_models = dict(BACKTRANSLATION_MODELS)
+        self.backtranslation_models.update(backtranslation_models or {})
+        self.metrics = metrics or MetricsRecorder()
+        self.wordnet_index = wordnet_index
+        # Content hash of the WordNet index, computed with the first cache key needing it
+        self.wordnet_index_hash = None
+        # Seed of the cached call running on each thread
+        self.call_seeds = threading.local()
+        # The nlpaug augmenters draw from the global generators: their seeded calls take turns
+        self.seed_lock = threading.RLock()
+
+    def cache_key(self, method: str, params: dict, text):
+        """
+        Build the cache key of a call. Outputs of converted models are cached apart from the fp32 outputs,
+        and the outputs sampled from a WordNet index apart from the NLTK WordNet outputs and from the
+        outputs of other indexes
 
+        """
+        if self.backend.name != "fp32":
+            params = dict(params, backend=self.backend.name)
+        if self.wordnet_index is not None and method in [
+            "synonymAugmenter",
+            "antonymAugmenter",
+        ]:
+            if self.wordnet_index_hash is None:
+                self.wordnet_index_hash = AugmentationCache.file_hash(
+                    self.wordnet_index
+                )
+            params = dict(params, wordnet_index=self.wordnet_index_hash)
+        return AugmentationCache.key(method, params, text, self.seed)
+
+    def text_seed(self, method: str, params: dict, text):
+        """
+        Seed of the random draws of one text of a call, derived from its cache key
+
+        Returns:
+            Integer seed, None if the instance has no seed
+
+        """
+        if self.seed is None:
+            return None
+        return int(self.cache_key(method, params, text)[:16], 16)
+
+    def call_rng(self):
+        """
+        Random generator of the cached call running on the thread, seeded from its cache key
+
+        Returns:
+            random.Random instance, or the random module if the instance has no seed
+
+        """
+        seed = getattr(self.call_seeds, "seed", None)
+        return random if seed is None else random.Random(seed)
+
+    @contextlib.contextmanager
+    def global_random_generators(self):
+        """
+        Seed the global random generators from the seed of the cached call running on the thread, for
+        the nlpaug augmenters drawing from them. The seeded calls hold seed_lock until they are done, so
+        they run one at a time; the calls of the instance without a seed do not wait
+
+        """
+        seed = getattr(self.call_seeds, "seed", None)
+        if seed is None:
+            yield
+            return
+        with self.seed_lock:
+            seed_random_generators(seed)
+            yield
+
+    def cached_call(
+        self, method: str, params: dict, text, compute, record: dict = None
+    ):
+        """
+        Get the output of a call from the cache or compute and cache it
+
+        Args:
+            method: Name of the NLPAugmenters method
+            params: Parameters of the call, including the model names
+            text: Input text
+            compute: Function computing the output on a cache miss
+            record: Metrics record of the call, its cache hits and misses are counted
+
+        Returns:
+            The output of the call
+
+        """
+        if self.cache is None and self.seed is None:
+            return compute()
+        key = self.cache_key(method, params, text)
+        if self.cache is not None:
+            output = self.cache.get(key)
+            if record is not None:
+                record["cache_hits" if output is not None else "cache_misses"] = 1
+            if output is not None:
+                return output
+        if self.seed is not None:
+            # The augmenters draw from the seed of the call, see call_rng and global_random_generators
+            previous_seed = getattr(self.call_seeds, "seed", None)
+            self.call_seeds.seed = int(key[:16], 16)
+            try:
+                output = compute()
+            finally:
+                self.call_seeds.seed = previous_seed
+        else:
+            output = compute()
+        if self.cache is not None:
+            self.cache.put(key, output)
+        return output
+
+    def augmenter_specs(self):
+        """
+        Augmenters used by the data augmentation pipeline with their default parameters
+
+        Returns:
+            Dict of augmenter name: (augmenter class, constructor parameters)
+
+        """
+        import nlpaug.augmenter.word as naw
+        from masked_lm_augmenter import MaskedLMAugmenter
+        from xlnet_augmenter import XLNetAugmenter
+
+        specs = {
+            "synonym": (naw.SynonymAug, {"aug_src": "wordnet", "aug_p": 0.5}),
+            "antonym": (naw.AntonymAug, {}),
+            # Shared by the insert and substitute actions
+            "contextual": (
+                MaskedLMAugmenter,
+                {"model_path": "nlpaueb/legal-bert-base-uncased"},
+            ),
+            "xlnet": (XLNetAugmenter, {"model_path": "xlnet-base-cased"}),
+        }
+        if self.wordnet_index is not None:
+            from wordnet_index import WordNetIndexAugmenter
+
+            specs["synonym"] = (
+                WordNetIndexAugmenter,
+                {
+                    "index_path": self.wordnet_index,
+                    "relation": "synonyms",
+                    "aug_p": 0.5,
+                },
+            )
+            specs["antonym"] = (
+                WordNetIndexAugmenter,
+                {"index_path": self.wordnet_index, "relation": "antonyms"},
+            )
+        for language, model_names in self.backtranslation_models.items():
+            specs[language + "_backtranslation"] = (
+                naw.BackTranslationAug,
+                {"from_model_name": model_names[0], "to_model_name": model_names[1]},
+            )
+        return specs
+
+    @staticmethod
+    def import_models():
+        """
+        Import nlpaug, torch, transformers and the modules of the batched augmenters on the calling thread.
+        They are imported lazily by the methods using them, and transformers resolves its classes on first
+        access: stage threads importing them at the same time can get a module that is not initialised
+        yet, so the pipelines call it before starting their stage threads
+
+        """
+        import nlpaug.augmenter.word
+        import torch
+        from transformers import (
+            AutoModelForCausalLM,
+            AutoModelForMaskedLM,
+            AutoModelForSeq2SeqLM,
+            AutoTokenizer,
+        )
+
+        import masked_lm_augmenter
+        import xlnet_augmenter
+
+    def preload(self, *augmenter_names: str):
+        """
+        Load augmenters and their models ahead of their first use
+
+        Args:
+            augmenter_names: Names from augmenter_specs(). Every augmenter is loaded if none is given
+
+        """
+        specs = self.augmenter_specs()
+        for name in augmenter_names or specs:
+            factory, params = specs[name]
+            self.registry.preload(factory, **params)
+
+    def release(self, *augmenter_names: str):
+        """
+        Release augmenters and their models
+
+        Args:
+            augmenter_names: Names from augmenter_specs(). Every augmenter is released if none is given
+
+        Returns:
+            Number of released augmenters
+
+        """
+        if not augmenter_names:
+            return self.registry.release()
+        specs = self.augmenter_specs()
+        released = 0
+        for name in augmenter_names:
+            factory, params = specs[name]
+            released += self.registry.release(factory, **params)
+        return released
+
+    @cached
     def synonymAugmenter(
         self, text: str, aug_p: float = 0.5, number_generated_examples: int = 5
     ):
@@ -22,9 +344,25 @@ class NLPAugmenters:
             List of augmented sentences
 
         """
-        synonymAug = naw.SynonymAug(aug_src="wordnet", aug_p=aug_p)
-        return synonymAug.augment(text, n=number_generated_examples)
+        if self.wordnet_index is not None:
+            from wordnet_index import WordNetIndexAugmenter
+
+            synonymAug = self.registry.get(
+                WordNetIndexAugmenter,
+                index_path=self.wordnet_index,
+                relation="synonyms",
+                aug_p=aug_p,
+            )
+            return synonymAug.augment(
+                text, n=number_generated_examples, rng=self.call_rng()
+            )
+        import nlpaug.augmenter.word as naw
+
+        synonymAug = self.registry.get(naw.SynonymAug, aug_src="wordnet", aug_p=aug_p)
+        with self.global_random_generators():
+            return synonymAug.augment(text, n=number_generated_examples)
 
+    @cached
     def antonymAugmenter(self, text: str, number_generated_examples: int = 5):
         """
         Augmenter that substitutes opposite meaning word according to WordNet antonym
@@ -37,9 +375,24 @@ class NLPAugmenters:
             List of augmented sentences
 
         """
-        antonymAug = naw.AntonymAug()
-        return antonymAug.augment(text, n=number_generated_examples)
+        if self.wordnet_index is not None:
+            from wordnet_index import WordNetIndexAugmenter
+
+            antonymAug = self.registry.get(
+                WordNetIndexAugmenter,
+                index_path=self.wordnet_index,
+                relation="antonyms",
+            )
+            return antonymAug.augment(
+                text, n=number_generated_examples, rng=self.call_rng()
+            )
+        import nlpaug.augmenter.word as naw
 
+        antonymAug = self.registry.get(naw.AntonymAug)
+        with self.global_random_generators():
+            return antonymAug.augment(text, n=number_generated_examples)
+
+    @cached
     def contextualWordEmbsAugmenter(
         self,
         text: str,
@@ -60,13 +413,116 @@ class NLPAugmenters:
             List of augmented sentences
 
         """
-        contextualWEAug = naw.ContextualWordEmbsAug(
-            model_path=model_path, action=action
+        from masked_lm_augmenter import MaskedLMAugmenter
+
+        contextualWEAug = self.registry.get(MaskedLMAugmenter, model_path=model_path)
+        seeds = None
+        if self.seed is not None:
+            # Same seed as the text and action in batchContextualWordEmbsAugmenter, which shares the cache entry
+            seeds = [
+                {
+                    action: self.text_seed(
+                        "contextualWordEmbsAugmenter",
+                        {
+                            "model_path": model_path,
+                            "action": action,
+                            "number_generated_examples": number_generated_examples,
+                        },
+                        text,
+                    )
+                }
+            ]
+        outputs = contextualWEAug.augment(
+            [text], actions=[action], n=number_generated_examples, seeds=seeds
         )
-        generated_data = contextualWEAug.augment(text, n=number_generated_examples)
-        cleaned_data = [sent.replace("[UNK]", "") for sent in generated_data]
-        return cleaned_data
+        return outputs[action][0]
 
+    def batchContextualWordEmbsAugmenter(
+        self,
+        texts: list,
+        model_path: str = "nlpaueb/legal-bert-base-uncased",
+        actions: list = ("insert", "substitute"),
+        number_generated_examples: int = 5,
+        batch_size: int = 32,
+    ):
+        """
+        Augmenter that leverages contextual word embeddings to augment a list of sentences with several actions.
+        Each sentence is tokenized once for all actions, and the variants of all sentences and actions
+        are predicted together in padded batches of similar lengths
+
+        Args:
+            texts: Sentences to be augmented
+            model_path: Model name or model path of the BERT model
+            actions: Actions among 'insert' and 'substitute'
+            number_generated_examples: Number of sentences to be augmented per sentence and action
+            batch_size: Number of masked sentences predicted in one forward pass
+
+        Returns:
+            Dict of action: list of augmented sentences for each sentence of texts, in the same order.
+            Sentences found in the cache are not augmented again
+
+        """
+        from masked_lm_augmenter import MaskedLMAugmenter
+
+        contextualWEAug = self.registry.get(MaskedLMAugmenter, model_path=model_path)
+        contextualWEAug.batch_size = batch_size
+        with self.metrics.measure(
+            "call", "batchContextualWordEmbsAugmenter", texts
+        ) as record:
+            # Outputs are cached per sentence and action, sharing the entries of contextualWordEmbsAugmenter
+            keys = {
+                (text, action): self.cache_key(
+                    "contextualWordEmbsAugmenter",
+                    {
+                        "model_path": model_path,
+                        "action": action,
+                        "number_generated_examples": number_generated_examples,
+                    },
+                    text,
+                )
+                for text in texts
+                for action in actions
+            }
+            outputs = {}
+            if self.cache is not None:
+                for text_action, key in keys.items():
+                    output = self.cache.get(key)
+                    if output is not None:
+                        outputs[text_action] = output
+            missing = [
+                text_action for text_action in keys if text_action not in outputs
+            ]
+            record["cache_hits"] = len(outputs)
+            record["cache_misses"] = len(missing)
+            missing_texts = list(dict.fromkeys(text for text, _ in missing))
+            if missing_texts:
+                seeds = None
+                if self.seed is not None:
+                    seeds = [
+                        {action: int(keys[text, action][:16], 16) for action in actions}
+                        for text in missing_texts
+                    ]
+                generated = contextualWEAug.augment(
+                    missing_texts,
+                    actions=actions,
+                    n=number_generated_examples,
+                    seeds=seeds,
+                )
+                for text_index, text in enumerate(missing_texts):
+                    for action in actions:
+                        if (text, action) not in outputs:
+                            outputs[text, action] = generated[action][text_index]
+                            if self.cache is not None:
+                                self.cache.put(
+                                    keys[text, action], outputs[text, action]
+                                )
+            results = {
+                action: [outputs[text, action] for text in texts] for action in actions
+            }
+            record["outputs"] = list(results.values())
+        return results
+
+    @cached
     def BackTranslationAugmenter(
         self,
         text: str,
@@ -85,11 +541,81 @@ class NLPAugmenters:
             List of augmented sentences
 
         """
-        backTranslationAug = naw.BackTranslationAug(
-            from_model_name=from_model_name, to_model_name=to_model_name
+        import nlpaug.augmenter.word as naw
+
+        backTranslationAug = self.registry.get(
+            naw.BackTranslationAug,
+            from_model_name=from_model_name,
+            to_model_name=to_model_name,
         )
         return backTranslationAug.augment(text)
 
+    def batchBackTranslationAugmenter(
+        self,
+        texts: list,
+        from_model_name: str = "facebook/wmt19-en-de",
+        to_model_name: str = "facebook/wmt19-de-en",
+        batch_size: int = 32,
+    ):
+        """
+        Augmenter that leverages two translation models to augment a list of sentences.
+        Sentences are deduplicated before any translation, sorted by length to limit padding
+        and translated batch_size at a time with one pass of each translation model per batch
+
+        Args:
+            texts: Sentences to be augmented
+            from_model_name: Model name or model path of the model translating from English
+            to_model_name: Model name or model path of the model translating back to English
+            batch_size: Number of sentences translated in one pass of the translation models
+
+        Returns:
+            List of augmented sentences, one per sentence of texts and in the same order.
+            Sentences found in the cache are not translated again
+
+        """
+        import nlpaug.augmenter.word as naw
+
+        backTranslationAug = self.registry.get(
+            naw.BackTranslationAug,
+            from_model_name=from_model_name,
+            to_model_name=to_model_name,
+        )
+        with self.metrics.measure(
+            "call", "batchBackTranslationAugmenter", texts
+        ) as record:
+            backTranslationAug.model.batch_size = batch_size
+            unique_texts = [text for text in dict.fromkeys(texts) if text.strip()]
+            # Translations are cached per sentence, sharing the entries of BackTranslationAugmenter
+            params = {
+                "from_model_name": from_model_name,
+                "to_model_name": to_model_name,
+            }
+            translations = {}
+            if self.cache is not None:
+                for text in unique_texts:
+                    output = self.cache.get(
+                        self.cache_key("BackTranslationAugmenter", params, text)
+                    )
+                    if output:
+                        translations[text] = output[0]
+            missing_texts = [text for text in unique_texts if text not in translations]
+            missing_texts.sort(key=len)
+            record["cache_hits"] = len(translations)
+            record["cache_misses"] = len(missing_texts)
+            for start in range(0, len(missing_texts), batch_size):
+                batch = missing_texts[start : start + batch_size]
+                for text, translation in zip(batch, backTranslationAug.augment(batch)):
+                    translations[text] = translation
+                    if self.cache is not None:
+                        self.cache.put(
+                            self.cache_key("BackTranslationAugmenter", params, text),
+                            [translation],
+                        )
+            outputs = [translations.get(text, text) for text in texts]
+            record["outputs"] = outputs
+        return outputs
+
+    @cached
     def ContextualWordEmbsForSentenceAugmenter(
         self,
         text: str,
@@ -101,19 +627,124 @@ class NLPAugmenters:
 
         Args:
             text: Sentence to be augmented
-            model_path: Model name or model path. It used transformers to load the model. The default model we use is nlpaueb/legal-bert-base-uncased, which has been pre-trained on 12 GB of diverse English legal text from several fields (e.g., legislation, court cases, contracts) scraped from publicly available resources
-            action: Either 'insert or 'substitute'. If value is 'insert', a new word will be injected to random position according to contextual word embeddings calculation. If value is 'substitute', word will be replaced according to contextual embeddings calculation
+            model_path: Model name or model path of the XLNet model
             number_generated_examples: Number of sentences to be augmented
 
         Returns:
             List of augmented sentences
 
         """
-        contextualWEFSAug = nas.ContextualWordEmbsForSentenceAug(model_path=model_path)
-        return contextualWEFSAug.augment(text, n=number_generated_examples)
+        from xlnet_augmenter import XLNetAugmenter
+
+        contextualWEFSAug = self.registry.get(XLNetAugmenter, model_path=model_path)
+        seeds = None
+        if self.seed is not None:
+            # Same seed as the text in batchContextualWordEmbsForSentenceAugmenter, which shares the cache entry
+            seeds = [
+                self.text_seed(
+                    "ContextualWordEmbsForSentenceAugmenter",
+                    {
+                        "model_path": model_path,
+                        "number_generated_examples": number_generated_examples,
+                    },
+                    text,
+                )
+            ]
+        return contextualWEFSAug.augment(
+            [text], n=number_generated_examples, seeds=seeds
+        )[0]
+
+    def batchContextualWordEmbsForSentenceAugmenter(
+        self,
+        texts: list,
+        model_path: str = "xlnet-base-cased",
+        number_generated_examples: int = 5,
+        batch_size: int = 64,
+    ):
+        """
+        Augmenter that completes a list of sentences according to XLNet prediction.
+        Each sentence is encoded once and its variants are generated together from the cached
+        hidden states of the sentence, with the variants of the other sentences
+
+        Args:
+            texts: Sentences to be completed
+            model_path: Model name or model path of the XLNet model
+            number_generated_examples: Number of sentences to be augmented per sentence
+            batch_size: Number of variants generated together
+
+        Returns:
+            List of augmented sentences for each sentence of texts, in the same order.
+            Sentences found in the cache are not completed again
+
+        """
+        from xlnet_augmenter import XLNetAugmenter
+
+        contextualWEFSAug = self.registry.get(XLNetAugmenter, model_path=model_path)
+        contextualWEFSAug.batch_size = batch_size
+        with self.metrics.measure(
+            "call", "batchContextualWordEmbsForSentenceAugmenter", texts
+        ) as record:
+            # Outputs are cached per sentence, sharing the entries of ContextualWordEmbsForSentenceAugmenter
+            params = {
+                "model_path": model_path,
+                "number_generated_examples": number_generated_examples,
+            }
+            keys = {
+                text: self.cache_key(
+                    "ContextualWordEmbsForSentenceAugmenter", params, text
+                )
+                for text in texts
+            }
+            outputs = {}
+            if self.cache is not None:
+                for text, key in keys.items():
+                    output = self.cache.get(key)
+                    if output is not None:
+                        outputs[text] = output
+            missing_texts = [text for text in keys if text not in outputs]
+            record["cache_hits"] = len(outputs)
+            record["cache_misses"] = len(missing_texts)
+            if missing_texts:
+                seeds = None
+                if self.seed is not None:
+                    seeds = [int(keys[text][:16], 16) for text in missing_texts]
+                generated = contextualWEFSAug.augment(
+                    missing_texts, n=number_generated_examples, seeds=seeds
+                )
+                for text, output in zip(missing_texts, generated):
+                    outputs[text] = output
+                    if self.cache is not None:
+                        self.cache.put(keys[text], output)
+            results = [outputs[text] for text in texts]
+            record["outputs"] = results
+        return results
+
+    @staticmethod
+    def autoregressive_prefix(text: str, text_limit: int, after_label: bool = False):
+        """
+        Words of a part of a paragraph completed by the XLNet augmenters
+
+        Args:
+            text: Part of a paragraph
+            text_limit: Number of words of the sentence to be completed
+            after_label: The part follows the date label: its first sentence, which contains the label,
+                is paraphrased and the second sentence is completed
+
+        Returns:
+            First text_limit words of the sentence, followed by a space
+
+        """
+        index_after_first_sentence = text.find(".")
+        if after_label and index_after_first_sentence != -1:
+            text = text[index_after_first_sentence + 2 :]
+        return " ".join(text.split()[:text_limit]) + " "
 
     def generate_text_before_label_with_autoregressive_model(
-        self, text: str, text_limit: int = 11, number_generated_examples: int = 5
+        self,
+        text: str,
+        text_limit: int = BEFORE_LABEL_TEXT_LIMIT,
+        number_generated_examples: int = 5,
+        model_path: str = "xlnet-base-cased",
     ):
         """
         Augmenter that inserts sentence according to XLNet.
@@ -124,22 +755,20 @@ class NLPAugmenters:
             text: Sentence to be augmented
             text_limit: number of words of the sentence to be completed by the auto-regressive model
             number_generated_examples: Number of sentences to be augmented
+            model_path: Model name or model path of the XLNet model
 
         Returns:
             List of augmented sentences
 
         """
         # Extract the first words of the first sentence and use them as input for the XLNet model
-        tokens = text.split()
-        if len(tokens) >= text_limit:
-            first_sentence_to_be_generated = " ".join(tokens[:text_limit]) + " "
-        else:
-            first_sentence_to_be_generated = " ".join(tokens[: len(tokens)]) + " "
+        first_sentence_to_be_generated = self.autoregressive_prefix(text, text_limit)
         # Complete the sentence
-        generated_sentences = self.ContextualWordEmbsForSentenceAugmenter(
-            first_sentence_to_be_generated,
+        generated_sentences = self.batchContextualWordEmbsForSentenceAugmenter(
+            [first_sentence_to_be_generated],
+            model_path=model_path,
             number_generated_examples=number_generated_examples,
-        )
+        )[0]
         # Extract the last sentence that will be paraphrased
         index_last_sentence = text.rfind(".")
         # if there is only one sentence in text, we just complete the sentence
@@ -153,16 +782,21 @@ class NLPAugmenters:
                 number_generated_examples=number_generated_examples,
             )
             concat_lists = []
-            for index, i in enumerate(generated_sentences):
+            # The paraphrases can be fewer than the completions when WordNet has few synonyms
+            for i, completed_sentence in zip(generated_sentences, completed_sentences):
                 new_sentence = i
                 if i[-1] != ".":
                     new_sentence += "."
-                new_sentence += " " + completed_sentences[index]
+                new_sentence += " " + completed_sentence
                 concat_lists.append(new_sentence)
         return concat_lists
 
     def generate_text_after_label_with_autoregressive_model(
-        self, text: str, text_limit: int = 9, number_generated_examples: int = 5
+        self,
+        text: str,
+        text_limit: int = AFTER_LABEL_TEXT_LIMIT,
+        number_generated_examples: int = 5,
+        model_path: str = "xlnet-base-cased",
     ):
         """
         Augmenter that inserts sentence according to XLNet.
@@ -173,6 +807,7 @@ class NLPAugmenters:
             text: Sentence to be augmented
             text_limit: number of words of the sentence to be completed by the auto-regressive model
             number_generated_examples: Number of sentences to be augmented
+            model_path: Model name or model path of the XLNet model
 
         Returns:
             List of augmented sentences
@@ -181,11 +816,6 @@ class NLPAugmenters:
         index_after_first_sentence = text.find(".")
         # if there is only one sentence in text, we just complete the sentence
         if index_after_first_sentence == -1:
-            tokens = text.split()
-            if len(tokens) >= text_limit:
-                sentence_to_be_generated = " ".join(tokens[:text_limit]) + " "
-            else:
-                sentence_to_be_generated = " ".join(tokens[: len(tokens)]) + " "
             first_sentence_to_be_generated = []
         else:
             # Paraphrase the first sentence
@@ -195,29 +825,61 @@ class NLPAugmenters:
                 aug_p=0.6,
                 number_generated_examples=number_generated_examples,
             )
-            # Extract the second sentence
-            tokens = text[index_after_first_sentence + 2 :].split()
-            if len(tokens) >= text_limit:
-                sentence_to_be_generated = " ".join(tokens[:text_limit]) + " "
-            else:
-                sentence_to_be_generated = " ".join(tokens[: len(tokens)]) + " "
+        # Extract the first words of the second sentence
+        sentence_to_be_generated = self.autoregressive_prefix(
+            text, text_limit, after_label=True
+        )
         # Complete the sentence
-        generated_sentences = self.ContextualWordEmbsForSentenceAugmenter(
-            sentence_to_be_generated,
+        generated_sentences = self.batchContextualWordEmbsForSentenceAugmenter(
+            [sentence_to_be_generated],
+            model_path=model_path,
             number_generated_examples=number_generated_examples,
-        )
+        )[0]
         # Concatenate the paraphrased sentence and the compeleted sentence
         if first_sentence_to_be_generated:
             concat_lists = [
-                i + ". " + generated_sentences[index]
-                for index, i in enumerate(first_sentence_to_be_generated)
+                i + ". " + generated_sentence
+                for i, generated_sentence in zip(
+                    first_sentence_to_be_generated, generated_sentences
+                )
             ]
         else:
             concat_lists = generated_sentences
         return concat_lists
 
+    def augment_data_using_backtranslation(
+        self,
+        original_sentence: str,
+        data_to_augment: list,
+        language: str,
+        batch_size: int = 32,
+    ):
+        """
+        Augmenter that leverages two translation models for augmentation.
+        This augmenter translates English to language, then translates language back to English.
+        The original sentence and data_to_augment are deduplicated and translated in batches
+
+        Args:
+            original_sentence: the original sentence used to create new examples by other augmenters
+            data_to_augment: List of augmented data from original_sentence
+            language: Key of backtranslation_models (de, ru or ar)
+            batch_size: Number of sentences translated in one pass of the translation models
+
+        Returns:
+            List of augmented sentences
+
+        """
+        from_model_name, to_model_name = self.backtranslation_models[language]
+        translated_data = self.batchBackTranslationAugmenter(
+            [original_sentence] + list(data_to_augment),
+            from_model_name,
+            to_model_name,
+            batch_size=batch_size,
+        )
+        return list(dict.fromkeys(translated_data))
+
     def augment_data_using_de_backtranslation(
-        self, original_sentence: str, data_to_augment: list
+        self, original_sentence: str, data_to_augment: list, batch_size: int = 32
     ):
         """
         Augmenter that leverages two translation models for augmentation.
@@ -226,27 +888,18 @@ class NLPAugmenters:
         Args:
             original_sentence: the original sentence used to create new examples by other augmenters
             data_to_augment: List of augmented data from original_sentence
+            batch_size: Number of sentences translated in one pass of the translation models
 
         Returns:
             List of augmented sentences
 
         """
-        de_aug_data = []
-        de_aug_data.append(
-            self.BackTranslationAugmenter(
-                original_sentence, "facebook/wmt19-en-de", "facebook/wmt19-de-en"
-            )[0]
+        return self.augment_data_using_backtranslation(
+            original_sentence, data_to_augment, "de", batch_size=batch_size
         )
-        for i in data_to_augment:
-            de_aug_data.append(
-                self.BackTranslationAugmenter(
-                    i, "facebook/wmt19-en-de", "facebook/wmt19-de-en"
-                )[0]
-            )
-        return list(set(de_aug_data))
 
     def augment_data_using_ru_backtranslation(
-        self, original_sentence: str, data_to_augment: list
+        self, original_sentence: str, data_to_augment: list, batch_size: int = 32
     ):
         """
         Augmenter that leverages two translation models for augmentation.
@@ -255,52 +908,32 @@ class NLPAugmenters:
         Args:
             original_sentence: the original sentence used to create new examples by other augmenters
             data_to_augment: List of augmented data from original_sentence
+            batch_size: Number of sentences translated in one pass of the translation models
 
         Returns:
             List of augmented sentences
 
         """
-        ru_aug_data = []
-        ru_aug_data.append(
-            self.BackTranslationAugmenter(
-                original_sentence, "facebook/wmt19-en-ru", "facebook/wmt19-ru-en"
-            )[0]
+        return self.augment_data_using_backtranslation(
+            original_sentence, data_to_augment, "ru", batch_size=batch_size
         )
-        for i in data_to_augment:
-            ru_aug_data.append(
-                self.BackTranslationAugmenter(
-                    i, "facebook/wmt19-en-ru", "facebook/wmt19-ru-en"
-                )[0]
-            )
-        return list(set(ru_aug_data))
 
     def augment_data_using_ar_backtranslation(
-        self, original_sentence: str, data_to_augment: list
+        self, original_sentence: str, data_to_augment: list, batch_size: int = 32
     ):
         """
         Augmenter that leverages two translation models for augmentation.
-        This augmenter translates Arabic to German, then translates Arabic back to English.
+        This augmenter translates English to Arabic, then translates Arabic back to English.
 
         Args:
             original_sentence: the original sentence used to create new examples by other augmenters
             data_to_augment: List of augmented data from original_sentence
+            batch_size: Number of sentences translated in one pass of the translation models
 
         Returns:
             List of augmented sentences
 
         """
-        ar_aug_data = []
-        ar_aug_data.append(
-            self.BackTranslationAugmenter(
-                original_sentence,
-                "Helsinki-NLP/opus-mt-en-ar",
-                "Helsinki-NLP/opus-mt-ar-en",
-            )[0]
+        return self.augment_data_using_backtranslation(
+            original_sentence, data_to_augment, "ar", batch_size=batch_size
         )
-        for i in data_to_augment:
-            ar_aug_data.append(
-                self.BackTranslationAugmenter(
-                    i, "Helsinki-NLP/opus-mt-en-ar", "Helsinki-NLP/opus-mt-ar-en"
-                )[0]
-            )
-        return list(set(ar_aug_data))
@@ -0,0 +1,269 @@
+import random
+
+import numpy as np
+
+
+def intern_parts(parts: list):
+    """
+    Deduplicate a list of texts
+
+    Args:
+        parts: List of texts
+
+    Returns:
+        List of unique texts in first-seen order and, for each text of parts, its index in that list
+
+    """
+    table = {}
+    indexes = [table.setdefault(part, len(table)) for part in parts]
+    return list(table), indexes
+
+
+def sample_indexes(total: int, count: int, exclude: set, rng=random):
+    """
+    Sample distinct integers from range(total) without replacement, skipping the ones in exclude
+
+    Args:
+        total: Size of the range
+        count: Number of integers to sample. Fewer are returned if the range is exhausted
+        exclude: Integers that must not be sampled
+        rng: random.Random instance or the random module
+
+    Returns:
+        List of sampled integers
+
+    """
+    available = total - len(exclude)
+    count = min(count, available)
+    if count <= 0:
+        return []
+    if 2 * count >= available:
+        # Dense sampling: draw directly from the remaining integers
+        remaining = [index for index in range(total) if index not in exclude]
+        return rng.sample(remaining, count)
+    # Sparse sampling: each draw is accepted with probability > 1/2, so it needs fewer than 2 * count draws on average
+    sampled = set()
+    indexes = []
+    while len(indexes) < count:
+        index = rng.randrange(total)
+        if index in exclude or index in sampled:
+            continue
+        sampled.add(index)
+        indexes.append(index)
+    return indexes
+
+
+def combine_columns(columns: list, target: int = 200, rng=random):
+    """
+    Combine the texts of several columns, like the parts of a paragraph and its dates, into unique
+    rows. The texts with the same index are combined first, then random combinations are sampled
+    without replacement from the product space of the unique texts until there are target rows or the
+    space is exhausted
+
+    Args:
+        columns: Lists of texts, one per column
+        target: Minimum number of rows
+        rng: random.Random instance or the random module
+
+    Returns:
+        List of the unique texts of each column, and the list of rows as tuples of indexes into them
+
+    """
+    interned = [intern_parts(texts) for texts in columns]
+    sizes = [len(unique) for unique, _ in interned]
+    total = 1
+    for size in sizes:
+        total *= size
+
+    # Each row is encoded as one integer of the mixed-radix product space
+    combinations = []
+    taken = set()
+    for row in zip(*[indexes for _, indexes in interned]):
+        index = 0
+        for size, column_index in zip(sizes, row):
+            index = index * size + column_index
+        if index not in taken:
+            taken.add(index)
+            combinations.append(index)
+    combinations += sample_indexes(total, target - len(combinations), taken, rng)
+
+    rows = []
+    for index in combinations:
+        row = []
+        for size in reversed(sizes):
+            index, column_index = divmod(index, size)
+            row.append(column_index)
+        rows.append(tuple(reversed(row)))
+    return [unique for unique, _ in interned], rows
+
+
+def combine_parts(
+    first_parts: list, dates: list, second_parts: list, target: int = 200, rng=random
+):
+    """
+    Combine augmented first parts, dates and second parts into unique paragraphs with combine_columns
+
+    Args:
+        first_parts: Augmented texts before the date label
+        dates: Generated dates
+        second_parts: Augmented texts after the date label
+        target: Minimum number of paragraphs
+        rng: random.Random instance or the random module
+
+    Returns:
+        Lists of unique first parts, dates and second parts, and the list of (first part, date, second part)
+        index triples into those lists
+
+    """
+    columns, triples = combine_columns([first_parts, dates, second_parts], target, rng)
+    return (*columns, triples)
+
+
+def split_paragraph(paragraph: str, spans: list):
+    """
+    Split a combined paragraph back into its parts and dates
+
+    Args:
+        paragraph: Paragraph joining its parts and dates with spaces
+        spans: (start, end) character offsets of its dates
+
+    Returns:
+        List of the texts of the columns: first part, then each date followed by the part after it
+
+    """
+    texts = []
+    position = 0
+    for start, end in spans:
+        texts += [paragraph[position : max(start - 1, position)], paragraph[start:end]]
+        position = end + 1
+    return texts + [paragraph[position:]]
+
+
+class CombinedParagraphs:
+    """
+    Combined paragraphs kept as rows of indexes into the interned tables of their columns, returned
+    by combine_columns: the part before the first date label, then each date followed by the part
+    after it. A paragraph is only materialised as a string when it is accessed, so memory grows with
+    the number of unique parts instead of the number of paragraphs times their length
+
+    Args:
+        columns: Unique texts of each column, an odd number of columns
+        indexes: Rows of column indexes, e.g. (first part, date, second part) index triples
+
+    """
+
+    def __init__(self, columns: list, indexes) -> None:
+        self.columns = columns
+        self.indexes = np.asarray(indexes, dtype=np.int32).reshape(-1, len(columns))
+
+    @property
+    def first_parts(self):
+        return self.columns[0]
+
+    @property
+    def dates(self):
+        """
+        Unique dates of the first date label
+        """
+        return self.columns[1]
+
+    @property
+    def second_parts(self):
+        return self.columns[-1]
+
+    @property
+    def labels(self):
+        """
+        Number of date labels of the paragraphs
+        """
+        return len(self.columns) // 2
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def texts_of(self, index: int):
+        return [
+            column[column_index]
+            for column, column_index in zip(self.columns, self.indexes[index])
+        ]
+
+    def paragraph(self, index: int):
+        return " ".join(self.texts_of(index))
+
+    def record(self, index: int):
+        """
+        Materialise one paragraph
+
+        Returns:
+            Dict with the paragraph and its date. Paragraphs with several date labels have their dates
+            and their date_spans, the [start, end] character offsets of each date, instead
+
+        """
+        texts = self.texts_of(index)
+        if self.labels == 1:
+            return {"paragraph": " ".join(texts), "date": texts[1]}
+        return {
+            "paragraph": " ".join(texts),
+            "dates": texts[1::2],
+            "date_spans": self.date_spans()[index].tolist(),
+        }
+
+    def __iter__(self):
+        return (self.record(index) for index in range(len(self)))
+
+    def texts(self):
+        return (self.paragraph(index) for index in range(len(self)))
+
+    def date_spans(self):
+        """
+        Character offsets of every date in each materialised paragraph
+
+        Returns:
+            Array of shape (paragraphs, labels, 2) of the start and end offsets
+
+        """
+        lengths = np.stack(
+            [
+                np.array([len(text) for text in column], dtype=np.int32)[
+                    self.indexes[:, column_index]
+                ]
+                for column_index, column in enumerate(self.columns)
+            ],
+            axis=1,
+        ).reshape(len(self), len(self.columns))
+        # Each text is followed by a space, the offset of a text is the sum of the lengths before it
+        ends = np.cumsum(lengths + 1, axis=1) - 1
+        starts = ends - lengths
+        return np.stack([starts[:, 1::2], ends[:, 1::2]], axis=2)
+
+    def date_offsets(self):
+        """
+        Character offsets of the first date in each materialised paragraph, in the date_index_start and
+        date_index_end convention of the corpus records
+
+        Returns:
+            Arrays of the start and end offsets
+
+        """
+        spans = self.date_spans()
+        return spans[:, 0, 0], spans[:, 0, 1]
+
+    def output_summary(self):
+        """
+        Output counts of the combination for its stage metrics, computed without materialising the paragraphs
+
+        """
+        token_counts = [
+            np.array([len(text.split()) for text in texts], dtype=np.int64)
+            for texts in self.columns
+        ]
+        return {
+            "outputs": len(self),
+            "unique_outputs": len(np.unique(self.indexes, axis=0)),
+            "output_tokens": int(
+                sum(
+                    counts[self.indexes[:, column]].sum()
+                    for column, counts in enumerate(token_counts)
+                )
+            ),
+        }
@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from augmentation_cache import AugmentationCache
+from augmentation_metrics import MetricsRecorder
+from nlp_augmenters import NLPAugmenters
+
+
+# NLPAugmenters instance of the current worker process, kept warm across tasks
+worker_augmenter = None
+
+
+def init_worker(
+    threads_per_worker: int,
+    cache_path: str,
+    max_rss_mb: float,
+    metrics_path: str = None,
+    profile: str = None,
+    profile_dir: str = "profiles",
+    backend: str = "fp32",
+    artifacts_dir: str = "inference_artifacts",
+    wordnet_index: str = None,
+    seed: int = None,
+):
+    """
+    Initialize a worker process: limit its torch threads and build its NLPAugmenters instance
+
+    Args:
+        threads_per_worker: Torch intra-op threads of the worker
+        cache_path: Path of the persistent augmentation cache. Nothing is cached if it is None
+        max_rss_mb: RSS budget in MB of the worker's augmenter registry
+        metrics_path: JSON lines file the worker appends its metrics records to
+        profile: Name of the stage or call to run under cProfile
+        profile_dir: Directory of the cProfile dumps
+        backend: Inference backend of the models
+        artifacts_dir: Directory of the converted models, shared by the workers
+        wordnet_index: Path of the WordNet index, mapped by every worker
+        seed: Seed of the random draws of the worker's NLPAugmenters
+
+    """
+    global worker_augmenter
+    # A spawned process inherits the spawn start method: nlpaug's data loaders would then start a new
+    # interpreter for every batch, they use the platform default like in the main process instead
+    multiprocessing.set_start_method(None, force=True)
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+    os.environ["MKL_NUM_THREADS"] = str(threads_per_worker)
+    # Tokenizers would start their own thread pool in every worker
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    # torch is imported by the first augmenter using a model, importing it here would add seconds to
+    # the start of every worker: the registry limits its threads when it loads the first model
+    cache = AugmentationCache(cache_path) if cache_path else None
+    metrics = MetricsRecorder(metrics_path, profile, profile_dir)
+    worker_augmenter = NLPAugmenters(
+        max_rss_mb=max_rss_mb,
+        cache=cache,
+        metrics=metrics,
+        backend=backend,
+        artifacts_dir=artifacts_dir,
+        wordnet_index=wordnet_index,
+        seed=seed,
+        torch_threads=threads_per_worker,
+    )
+
+
+def run_task(function, item, index: int):
+    return function(worker_augmenter, item, index)
+
+
+def run_in_workers(
+    function,
+    items,
+    workers: int = None,
+    threads_per_worker: int = None,
+    cache_path: str = None,
+    max_rss_mb: float = None,
+    max_pending: int = None,
+    metrics_path: str = None,
+    profile: str = None,
+    profile_dir: str = "profiles",
+    backend: str = "fp32",
+    artifacts_dir: str = "inference_artifacts",
+    wordnet_index: str = None,
+    seed: int = None,
+):
+    """
+    Run function(nlpAugmenter, item, index) over items in a pool of worker processes.
+    Each worker keeps its own NLPAugmenters instance, so models are loaded once per worker
+
+    Args:
+        function: Picklable function taking the worker's NLPAugmenters, an item and its index
+        items: Iterable of (index, item) pairs, consumed lazily
+        workers: Number of worker processes. Defaults to the number of cores
+        threads_per_worker: Torch intra-op threads of each worker. Defaults to the number of cores divided by workers
+        cache_path: Path of the persistent augmentation cache shared by the workers
+        max_rss_mb: RSS budget in MB of each worker's augmenter registry
+        max_pending: Maximum number of submitted items not yielded yet. Defaults to twice the number of workers
+        metrics_path: JSON lines file the workers append their metrics records to
+        profile: Name of the stage or call to run under cProfile
+        profile_dir: Directory of the cProfile dumps
+        backend: Inference backend of the models
+        artifacts_dir: Directory of the converted models, shared by the workers
+        wordnet_index: Path of the WordNet index. Its pages are shared by the workers mapping it
+        seed: Seed of the random draws. Every draw is seeded from it and the item, so the results do not
+            depend on the worker running the item
+
+    Returns:
+        Generator of (index, result) pairs, in the order of items
+
+    """
+    cpu_count = os.cpu_count() or 1
+    workers = workers or cpu_count
+    threads_per_worker = threads_per_worker or max(1, cpu_count // workers)
+    max_pending = max_pending or 2 * workers
+
+    # Workers are spawned rather than forked, forking a process that already started torch threads can deadlock
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(
+            threads_per_worker,
+            cache_path,
+            max_rss_mb,
+            metrics_path,
+            profile,
+            profile_dir,
+            backend,
+            artifacts_dir,
+            wordnet_index,
+            seed,
+        ),
+    ) as executor:
+        pending = deque()
+        for index, item in items:
+            pending.append((index, executor.submit(run_task, function, item, index)))
+            if len(pending) >= max_pending:
+                index, future = pending.popleft()
+                yield index, future.result()
+        while pending:
+            index, future = pending.popleft()
+            yield index, future.result()
@@ -0,0 +1,135 @@
+import hashlib
+
+
+def content_hash(text: str):
+    """
+    Compact identifier of a text, the same in every process and run
+
+    Returns:
+        16 hexadecimal characters
+
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def lineage_output(texts: list, outputs: list):
+    """
+    Output of a stage deriving one text from each of its input texts, like a back-translation
+
+    Args:
+        texts: Input texts
+        outputs: Text derived from each input text
+
+    Returns:
+        Dict with the unique derived "texts" and, for each of them, the content hash of the first
+        input text it was derived from in "parents"
+
+    """
+    parents = {}
+    for text, output in zip(texts, outputs):
+        parents.setdefault(output, content_hash(text))
+    return {"texts": list(parents), "parents": list(parents.values())}
+
+
+def stage_texts(output):
+    """
+    Texts of a stage output: the texts of a lineage_output, the output itself otherwise
+
+    """
+    if isinstance(output, dict) and "texts" in output:
+        return output["texts"]
+    return output
+
+
+class PartLineage:
+    """
+    Lineage of the augmented texts of one part of a paragraph. Each text has a compact record: the
+    stage it comes from, the content hash of the text it was generated from (the text of the part for
+    the stages augmenting the part itself) and its own content hash. A text generated by several
+    stages keeps the record of the first stage adding it, as the near duplicate filter does
+
+    Args:
+        sentence: Text of the part, the root of the lineage
+
+    """
+
+    def __init__(self, sentence: str) -> None:
+        self.root = content_hash(sentence)
+        self.records = {}
+
+    def add(self, stage: str, texts: list, parents: list = None):
+        """
+        Record the texts of a stage
+
+        Args:
+            stage: Name of the stage
+            texts: Texts of its output
+            parents: Content hash of the text each text was generated from, the text of the part by
+                default. None for a text whose parent is unknown
+
+        """
+        if parents is None:
+            parents = [self.root] * len(texts)
+        for text, parent in zip(texts, parents):
+            text_hash = content_hash(text)
+            if text_hash not in self.records:
+                self.records[text_hash] = {
+                    "stage": stage,
+                    "parent": parent,
+                    "hash": text_hash,
+                }
+
+    def record(self, text: str):
+        """
+        Returns:
+            Lineage record of a text, None for a text no stage generated, like the text of the part
+
+        """
+        return self.records.get(content_hash(text))
+
+    def path(self, text: str):
+        """
+        Stages a text went through, from the stage augmenting the part to the stage that output it
+
+        Returns:
+            List of stage names, empty for a text no stage generated
+
+        """
+        stages = []
+        record = self.record(text)
+        while record is not None and len(stages) < len(self.records):
+            stages.insert(0, record["stage"])
+            record = self.records.get(record["parent"])
+        return stages
+
+
+def attribute_paragraphs(paragraphs, lineages: list):
+    """
+    Attribute combined paragraphs to the stages their parts come from
+
+    Args:
+        paragraphs: paragraph_combination.CombinedParagraphs whose columns are the parts of the
+            paragraph with a date column between two parts
+        lineages: PartLineage of each part
+
+    Returns:
+        Dict of stage name: number of paragraphs with at least one part from the stage, "original" for
+        the parts of the paragraph kept as they are
+
+    """
+    stages_of_columns = [
+        [
+            (lineage.record(text) or {"stage": "original"})["stage"]
+            for text in paragraphs.columns[2 * position]
+        ]
+        for position, lineage in enumerate(lineages)
+    ]
+    counts = {}
+    for row in paragraphs.indexes:
+        stages = {
+            stages_of_column[row[2 * position]]
+            for position, stages_of_column in enumerate(stages_of_columns)
+        }
+        for stage in stages:
+            counts[stage] = counts.get(stage, 0) + 1
+    return counts
@@ -0,0 +1,396 @@
+import argparse
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import sys
+
+from checkpoint_journal import paragraph_hash
+from corpus_io import (
+    PARQUET_PART_COLUMNS,
+    ShardedJsonlWriter,
+    ShardedParquetWriter,
+    load_parquet_shard,
+    open_text,
+    read_corpus,
+)
+from paragraph_combination import CombinedParagraphs, intern_parts, split_paragraph
+
+
+# File of an output directory describing the shard it holds, written once the shard is complete
+MANIFEST_NAME = "manifest.json"
+
+
+def parse_shard(text: str):
+    """
+    Parse a shard argument like "3/8", the fourth of eight shards
+
+    Returns:
+        Shard index and number of shards
+
+    """
+    try:
+        shard, shards = (int(value) for value in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("{!r} is not a shard like 0/4".format(text))
+    if shards < 1 or not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError(
+            "Shard {} does not exist in {} shards".format(shard, shards)
+        )
+    return shard, shards
+
+
+def paragraph_shard(element_hash: str, shards: int):
+    """
+    Shard of a paragraph, from its hash: it does not depend on the position of the paragraph in the
+    corpus, the number of workers or the machine
+
+    Args:
+        element_hash: Hash of the paragraph returned by checkpoint_journal.paragraph_hash
+        shards: Number of shards
+
+    """
+    return int(element_hash[:16], 16) % shards
+
+
+def paragraph_seed(seed: int, element_hash: str):
+    """
+    Seed of the random draws of a paragraph derived from the global seed and the paragraph hash
+
+    Returns:
+        Integer seed, None if seed is None
+
+    """
+    if seed is None:
+        return None
+    content = "{}:{}".format(seed, element_hash).encode("utf-8")
+    return int(hashlib.sha256(content).hexdigest()[:16], 16)
+
+
+class ShardSelection:
+    """
+    Paragraphs of one shard of a corpus. The selected paragraphs keep their corpus index and their
+    hashes are digested, so the merge can check that every shard was run on the same corpus
+
+    Args:
+        shard: Index of the shard
+        shards: Number of shards
+
+    """
+
+    def __init__(self, shard: int = 0, shards: int = 1) -> None:
+        self.shard = shard
+        self.shards = shards
+        self.paragraphs = 0
+        self.digest = hashlib.sha256()
+
+    def add(self, element_hash: str):
+        self.paragraphs += 1
+        self.digest.update(element_hash.encode("ascii"))
+
+    def select(self, paragraphs):
+        """
+        Args:
+            paragraphs: Iterable of the corpus paragraphs
+
+        Returns:
+            Generator of (corpus index, paragraph) pairs of the shard
+
+        """
+        for index, element in enumerate(paragraphs):
+            element_hash = paragraph_hash(element)
+            if paragraph_shard(element_hash, self.shards) == self.shard:
+                self.add(element_hash)
+                yield index, element
+
+    def manifest(self, seed: int, output_format: str, records: int, paths: list):
+        """
+        Manifest of the complete output of the shard
+
+        Args:
+            seed: Global seed of the run
+            output_format: "jsonl" or "parquet"
+            records: Number of augmented paragraphs written
+            paths: Paths of the output files
+
+        """
+        return {
+            "shard": self.shard,
+            "shards": self.shards,
+            "seed": seed,
+            "paragraphs": self.paragraphs,
+            "paragraphs_digest": self.digest.hexdigest(),
+            "output_format": output_format,
+            "records": records,
+            "files": [os.path.basename(path) for path in paths],
+        }
+
+
+def write_manifest(output_dir: str, manifest: dict):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def read_manifest(output_dir: str):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def row_columns(row: dict):
+    """
+    Texts of the columns of a Parquet row: its first part, then each date followed by the part after
+    it. The second part of a row with several date labels holds all the text after its first date,
+    which is split again at the offsets of its date_spans
+
+    Returns:
+        List of texts
+
+    """
+    paragraph = " ".join(row[column] for column in PARQUET_PART_COLUMNS)
+    flat_spans = row.get("date_spans") or [
+        row["date_index_start"],
+        row["date_index_end"],
+    ]
+    return split_paragraph(paragraph, list(zip(flat_spans[::2], flat_spans[1::2])))
+
+
+def read_rows(output_dir: str, manifest: dict):
+    """
+    Stream the augmented paragraphs of a shard output, in the order they were written
+
+    Returns:
+        Generator of dicts with their paragraph_index
+
+    """
+    for name in manifest["files"]:
+        path = os.path.join(output_dir, name)
+        if manifest["output_format"] == "parquet":
+            yield from load_parquet_shard(path, materialise=False).to_pylist()
+        else:
+            with open_text(path) as shard:
+                for line in shard:
+                    yield json.loads(line)
+
+
+def check_manifests(shard_dirs: list, manifests: list, selections: list):
+    """
+    Check that the shard outputs are complete and cover every shard of the corpus exactly once,
+    with the same seed and output format
+
+    Args:
+        shard_dirs: Output directories of the shards
+        manifests: Their manifests, None for a directory without one
+        selections: ShardSelection of each shard of the corpus
+
+    Returns:
+        List of error messages
+
+    """
+    errors = []
+    dirs_of_shards = {}
+    # The settings of the first complete shard are the reference of the others
+    reference_dir, reference = next(
+        (
+            (output_dir, manifest)
+            for output_dir, manifest in zip(shard_dirs, manifests)
+            if manifest is not None
+        ),
+        (None, None),
+    )
+    for output_dir, manifest in zip(shard_dirs, manifests):
+        if manifest is None:
+            errors.append(
+                "{}: no {}, the shard is not complete".format(output_dir, MANIFEST_NAME)
+            )
+            continue
+        for setting in ["shards", "seed", "output_format"]:
+            if manifest[setting] != reference[setting]:
+                errors.append(
+                    "{}: {} is {}, {} in {}".format(
+                        output_dir,
+                        setting,
+                        manifest[setting],
+                        reference[setting],
+                        reference_dir,
+                    )
+                )
+        if manifest["shards"] != len(selections):
+            continue
+        dirs_of_shards.setdefault(manifest["shard"], []).append(output_dir)
+        selection = selections[manifest["shard"]]
+        if (
+            manifest["paragraphs"] != selection.paragraphs
+            or manifest["paragraphs_digest"] != selection.digest.hexdigest()
+        ):
+            errors.append(
+                "{}: {} paragraphs augmented, they are not the {} paragraphs of shard {}/{} of the corpus".format(
+                    output_dir,
+                    manifest["paragraphs"],
+                    selection.paragraphs,
+                    manifest["shard"],
+                    len(selections),
+                )
+            )
+    for shard in range(len(selections)):
+        dirs = dirs_of_shards.get(shard, [])
+        if not dirs:
+            errors.append("Shard {}/{} is missing".format(shard, len(selections)))
+        elif len(dirs) > 1:
+            errors.append(
+                "Shard {}/{} is in several outputs: {}".format(
+                    shard, len(selections), ", ".join(dirs)
+                )
+            )
+    return errors
+
+
+def merge_rows(shard_dirs: list, manifests: list, shard_of_paragraphs: list):
+    """
+    Merge the rows of the shard outputs in corpus order, checking each row against its shard
+
+    Args:
+        shard_dirs: Output directories of the shards
+        manifests: Their manifests
+        shard_of_paragraphs: Shard of each corpus paragraph
+
+    Returns:
+        Generator of rows in paragraph_index order and list of error messages, filled once the
+        generator is exhausted
+
+    """
+    errors = []
+
+    def rows_of(output_dir, manifest):
+        records = 0
+        previous = -1
+        for row in read_rows(output_dir, manifest):
+            index = row["paragraph_index"]
+            if index < previous:
+                errors.append(
+                    "{}: paragraph {} written after paragraph {}".format(
+                        output_dir, index, previous
+                    )
+                )
+            elif (
+                index >= len(shard_of_paragraphs)
+                or shard_of_paragraphs[index] != manifest["shard"]
+            ):
+                errors.append(
+                    "{}: paragraph {} does not belong to shard {}".format(
+                        output_dir, index, manifest["shard"]
+                    )
+                )
+            previous = index
+            records += 1
+            yield row
+        if records != manifest["records"]:
+            errors.append(
+                "{}: {} augmented paragraphs read, {} written".format(
+                    output_dir, records, manifest["records"]
+                )
+            )
+
+    rows = heapq.merge(
+        *(
+            rows_of(output_dir, manifest)
+            for output_dir, manifest in zip(shard_dirs, manifests)
+        ),
+        key=lambda row: row["paragraph_index"],
+    )
+    return rows, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge the outputs of the shards of a data_augmentation.py --shard run and check that they are complete"
+    )
+    parser.add_argument(
+        "shard_dirs", nargs="+", help="Output directories of the shards"
+    )
+    parser.add_argument(
+        "--input", required=True, help="JSONL corpus the shards were augmented from"
+    )
+    parser.add_argument(
+        "--output-dir", default="merged", help="Directory of the merged shards"
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=100000,
+        help="Maximum number of augmented paragraphs per merged shard",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Compress the merged shards with gzip (JSONL) or zstd (Parquet)",
+    )
+    args = parser.parse_args()
+
+    manifests = [read_manifest(output_dir) for output_dir in args.shard_dirs]
+    shards = next(
+        (manifest["shards"] for manifest in manifests if manifest is not None), 1
+    )
+    # The shard of every corpus paragraph is computed again from its hash
+    selections = [ShardSelection(shard, shards) for shard in range(shards)]
+    shard_of_paragraphs = []
+    for element in read_corpus(args.input):
+        element_hash = paragraph_hash(element)
+        shard = paragraph_shard(element_hash, shards)
+        selections[shard].add(element_hash)
+        shard_of_paragraphs.append(shard)
+    errors = check_manifests(args.shard_dirs, manifests, selections)
+    if errors:
+        print("\n".join(errors))
+        sys.exit(1)
+
+    output_format = manifests[0]["output_format"]
+    writer_class = (
+        ShardedParquetWriter if output_format == "parquet" else ShardedJsonlWriter
+    )
+    rows, errors = merge_rows(args.shard_dirs, manifests, shard_of_paragraphs)
+    augmented = 0
+    with writer_class(
+        args.output_dir, shard_size=args.shard_size, compress=args.compress
+    ) as writer:
+        for paragraph_index, paragraph_rows in itertools.groupby(
+            rows, key=lambda row: row["paragraph_index"]
+        ):
+            paragraph_rows = list(paragraph_rows)
+            augmented += 1
+            if output_format == "parquet":
+                columns = [
+                    intern_parts(list(texts))
+                    for texts in zip(*map(row_columns, paragraph_rows))
+                ]
+                writer.write_combined(
+                    paragraph_index,
+                    CombinedParagraphs(
+                        [unique for unique, _ in columns],
+                        list(zip(*[indexes for _, indexes in columns])),
+                    ),
+                )
+            else:
+                writer.write_all(paragraph_rows)
+    if errors:
+        print("\n".join(errors))
+        print("The merged output in {} is incomplete".format(args.output_dir))
+        sys.exit(1)
+    print(
+        "{} augmented paragraphs of {} shards written to {} shards, {} of the {} corpus paragraphs have augmented paragraphs".format(
+            writer.records,
+            shards,
+            len(writer.paths),
+            augmented,
+            len(shard_of_paragraphs),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
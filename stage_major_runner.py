@@ -0,0 +1,123 @@
+from augmenter_registry import current_rss_mb
+from checkpoint_journal import CheckpointJournal, paragraph_hash
+
+
+class ChunkStage:
+    """
+    Stage of the stage-major runner, run on every paragraph of a chunk with one call
+
+    Args:
+        name: Name of the stage in the progress messages
+        stages: Function taking a paragraph index and returning a dict of paragraph stage name: names of
+            the paragraph stages it consumes, e.g. one stage per part of the paragraph. Paragraph stages are
+            named like the stages of the paragraph-major DAG, e.g. "first_part/deBacktranslationAug", so
+            both modes share the stage outputs of the journal
+        function: Function taking a list of (paragraph index, paragraph stage name, inputs) items, inputs
+            being a dict of consumed stage name: output, and returning one output per item
+        models: Names of the NLPAugmenters augmenters (keys of augmenter_specs) released once the stage is done
+
+    """
+
+    def __init__(self, name: str, stages, function, models: list = ()) -> None:
+        self.name = name
+        self.stages = stages
+        self.function = function
+        self.models = list(models)
+
+    def __repr__(self) -> str:
+        return "ChunkStage({!r}, models={!r})".format(self.name, self.models)
+
+
+class StageMajorRunner:
+    """
+    Runner of the augmentation stages stage-major: each stage runs on every paragraph of a chunk before
+    the next stage starts, and the models of a stage are released once it is done. Only the models of
+    one stage are resident at a time, and each model runs on the texts of the whole chunk, in full batches.
+    The stage outputs are spilled to the checkpoint journal as soon as a stage is done and read back
+    from it by the stages consuming them, so the chunk size only bounds the texts of one stage in memory.
+    Stages already recorded in the journal for a paragraph are not run again
+
+    Args:
+        stages: List of ChunkStage, in execution order. A stage comes after the stages it consumes
+        journal: CheckpointJournal holding the stage outputs
+        release: Function releasing augmenters by name, e.g. NLPAugmenters.release
+        planner_factory: Optional function taking a paragraph index and record and returning the planner
+            of the paragraph, e.g. a stage_planner.YieldPlanner. A paragraph stage it skips outputs an empty list
+
+    """
+
+    def __init__(
+        self,
+        stages: list,
+        journal: CheckpointJournal,
+        release,
+        planner_factory=None,
+    ) -> None:
+        self.stages = stages
+        self.journal = journal
+        self.release = release
+        self.planner_factory = planner_factory
+        self.peak_rss_mb = {}
+
+    def run(self, chunk: list):
+        """
+        Run every stage on a chunk of paragraphs
+
+        Args:
+            chunk: List of (paragraph index, paragraph record) pairs
+
+        Returns:
+            Generator of (paragraph index, paragraph record, dict of paragraph stage name: output),
+            one paragraph at a time
+
+        """
+        hashes = {index: paragraph_hash(element) for index, element in chunk}
+        planners = {}
+        if self.planner_factory is not None:
+            planners = {
+                index: self.planner_factory(index, element) for index, element in chunk
+            }
+        for stage in self.stages:
+            items = []
+            for index, _ in chunk:
+                results = self.journal.completed_stages(index, hashes[index])
+                for name, dependencies in stage.stages(index).items():
+                    if name in results:
+                        continue
+                    inputs = {
+                        dependency: results[dependency] for dependency in dependencies
+                    }
+                    planner = planners.get(index)
+                    if planner is not None:
+                        if planner.decide(name, results, []) == "skip":
+                            self.journal.record_stage(index, hashes[index], name, [])
+                            continue
+                        inputs = planner.prepare_inputs(name, inputs, results, [])
+                    items.append((index, name, inputs))
+            if items:
+                outputs = stage.function(items)
+                for (index, name, _), output in zip(items, outputs):
+                    self.journal.record_stage(index, hashes[index], name, output)
+            self.peak_rss_mb[stage.name] = max(
+                self.peak_rss_mb.get(stage.name, 0), current_rss_mb()
+            )
+            if stage.models:
+                self.release(*stage.models)
+        for index, element in chunk:
+            planner = planners.get(index)
+            if planner is not None and planner.report():
+                print(planner.report())
+            yield index, element, self.journal.completed_stages(index, hashes[index])
+
+    def report(self):
+        """
+        Summarize the resident memory after each stage, before its models are released
+
+        Returns:
+            Multi-line string
+
+        """
+        return "\n".join(
+            "{}: {:.0f} MB resident".format(name, rss)
+            for name, rss in self.peak_rss_mb.items()
+        )
@@ -0,0 +1,217 @@
+import math
+
+from part_lineage import stage_texts
+
+
+# Seconds per input text and new unique outputs per input text of each stage, used until the stage
+# is measured. A stage without dependencies has one input, the text of its part
+DEFAULT_STAGE_COSTS = {
+    "synonymAug": (0.05, 5.0),
+    "antonymAug": (0.05, 3.0),
+    "contextualWordEmbsAug": (1.0, 20.0),
+    "contextualWordEmbsAug - insert": (0.0, 5.0),
+    "contextualWordEmbsAug - substitute": (0.0, 5.0),
+    "xlnetAug": (10.0, 5.0),
+    "deBacktranslationAug": (0.5, 0.8),
+    "ruBacktranslationAug": (0.5, 0.8),
+    "arBacktranslationAug": (0.5, 0.8),
+}
+
+
+class StageCostModel:
+    """
+    Cost and yield of the stages, measured at runtime from the stage records of a MetricsRecorder.
+    Records are summed per stage name without its part prefix, so the stages of every part and of
+    every previous paragraph refine the same estimates
+
+    Args:
+        metrics: MetricsRecorder measuring the stages
+        priors: Dict of stage name: (seconds per input, unique outputs per input) used until a stage is measured
+
+    """
+
+    def __init__(self, metrics, priors: dict = DEFAULT_STAGE_COSTS) -> None:
+        self.metrics = metrics
+        self.priors = priors
+
+    def estimate(self, name: str):
+        """
+        Returns:
+            Seconds per input text and new unique outputs per input text of a stage
+
+        """
+        short_name = name.split("/")[-1]
+        totals = self.metrics.totals.get(("stage", short_name))
+        if not totals or not totals["inputs"]:
+            return self.priors.get(short_name, (1.0, 1.0))
+        return (
+            totals["wall_seconds"] / totals["inputs"],
+            totals["unique_outputs"] / totals["inputs"],
+        )
+
+    def cost_per_output(self, name: str):
+        seconds, outputs = self.estimate(name)
+        return seconds / max(outputs, 1e-6)
+
+
+def count_inputs(inputs: dict):
+    """
+    Number of input texts of a stage: the text of its part and the texts of its dependencies
+
+    """
+    return 1 + sum(
+        len(output) for output in inputs.values() if isinstance(output, list)
+    )
+
+
+def truncate_inputs(inputs: dict, limit: int):
+    """
+    Keep at most limit texts of the dependency outputs, taken in turn from each dependency so every
+    augmenter stays represented
+
+    Returns:
+        Dict of dependency name: truncated output
+
+    """
+    lists = {
+        name: output for name, output in inputs.items() if isinstance(output, list)
+    }
+    kept = {name: 0 for name in lists}
+    remaining = limit
+    while remaining > 0 and any(kept[name] < len(lists[name]) for name in lists):
+        for name in lists:
+            if remaining > 0 and kept[name] < len(lists[name]):
+                kept[name] += 1
+                remaining -= 1
+    return {
+        name: output[: kept[name]] if name in lists else output
+        for name, output in inputs.items()
+    }
+
+
+class YieldPlanner:
+    """
+    Planner of a StageScheduler stopping the augmentation of a paragraph once it has enough unique parts.
+    Ready stages are started cheapest cost per unique output first. Before a stage starts, the number
+    of paragraphs the unique parts can be combined into is computed from the finished stages and the
+    expected yield of the running ones: the stage is skipped if the target is already reached, deferred
+    if the running stages are expected to reach it, and started otherwise. A stage consuming the outputs
+    of other stages, like back-translation, only gets as many of them as it needs to reach the target
+
+    Args:
+        target: Number of unique paragraphs to reach
+        cost_model: StageCostModel of the stages
+        capacity: Function taking a dict of part: number of unique texts and returning the number of
+            unique paragraphs they can be combined into
+        parts: Names of the parts, the prefixes of the stage names
+        margin: Factor applied to the number of inputs a truncated stage needs, for its yield variance
+
+    """
+
+    def __init__(
+        self,
+        target: int,
+        cost_model: StageCostModel,
+        capacity,
+        parts: list,
+        margin: float = 1.5,
+    ) -> None:
+        self.target = target
+        self.cost_model = cost_model
+        self.capacity = capacity
+        self.parts = list(parts)
+        self.margin = margin
+        self.expected = {}
+        self.skipped = []
+        self.truncated = {}
+
+    def part(self, name: str):
+        prefix = name.split("/")[0]
+        return prefix if prefix in self.parts else None
+
+    def unique_parts(self, results: dict, running: list = ()):
+        """
+        Number of unique texts of each part from the finished stages, plus the expected new outputs of
+        the running ones
+
+        """
+        texts = {part: set() for part in self.parts}
+        for name, output in results.items():
+            part = self.part(name)
+            output = stage_texts(output)
+            if part is not None and isinstance(output, list):
+                texts[part].update(output)
+        counts = {part: len(texts[part]) for part in self.parts}
+        for name in running:
+            part = self.part(name)
+            if part is not None:
+                counts[part] += self.expected.get(name, 0)
+        return counts
+
+    def priority(self, name: str):
+        return self.cost_model.cost_per_output(name)
+
+    def decide(self, name: str, results: dict, running: list):
+        """
+        Decide whether a ready stage runs now
+
+        Returns:
+            "run", "defer" or "skip"
+
+        """
+        # Once reached, the target stays reached: the stages consuming a skipped stage are skipped too
+        if self.capacity(self.unique_parts(results)) >= self.target:
+            self.skipped.append(name)
+            return "skip"
+        if self.cost_model.estimate(name)[0] == 0:
+            # Free stages, like the slices of a shared stage output, always run
+            return "run"
+        if (
+            running
+            and self.capacity(self.unique_parts(results, running)) >= self.target
+        ):
+            return "defer"
+        return "run"
+
+    def prepare_inputs(self, name: str, inputs: dict, results: dict, running: list):
+        """
+        Truncate the dependency outputs of a stage to the number of inputs it needs to reach the
+        target and record its expected yield
+
+        Returns:
+            Inputs of the stage
+
+        """
+        part = self.part(name)
+        seconds, outputs_per_input = self.cost_model.estimate(name)
+        total = count_inputs(inputs)
+        if part is not None and total > 1:
+            counts = self.unique_parts(results, running)
+            needed = 0
+            while self.capacity(dict(counts, **{part: counts[part] + needed})) < (
+                self.target
+            ) and needed < total * max(outputs_per_input, 1):
+                needed += 1
+            limit = math.ceil(self.margin * needed / max(outputs_per_input, 1e-6))
+            if limit < total:
+                # The text of the part is always an input of the stage
+                inputs = truncate_inputs(inputs, max(limit - 1, 0))
+                self.truncated[name] = (count_inputs(inputs), total)
+                total = count_inputs(inputs)
+        self.expected[name] = outputs_per_input * total
+        return inputs
+
+    def report(self):
+        """
+        Summarize the skipped and truncated stages
+
+        Returns:
+            Multi-line string
+
+        """
+        lines = ["{} skipped: target reached".format(name) for name in self.skipped]
+        lines += [
+            "{} truncated to {} of {} inputs".format(name, kept, total)
+            for name, (kept, total) in self.truncated.items()
+        ]
+        return "\n".join(lines)
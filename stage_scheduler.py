@@ -0,0 +1,213 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Stage:
+    """
+    Stage of an augmentation pipeline
+
+    Args:
+        name: Unique name of the stage
+        function: Function taking a dict of dependency name: dependency output and returning the stage output
+        dependencies: Names of the stages whose outputs are consumed by this stage
+
+    """
+
+    def __init__(self, name: str, function, dependencies: list = None) -> None:
+        self.name = name
+        self.function = function
+        self.dependencies = list(dependencies or [])
+
+    def __repr__(self) -> str:
+        return "Stage({!r}, dependencies={!r})".format(self.name, self.dependencies)
+
+
+class StageScheduler:
+    """
+    Scheduler running a DAG of stages. Stages whose dependencies are done run concurrently in a thread pool
+
+    Args:
+        stages: List of stages
+        max_workers: Number of stages running at the same time
+        planner: Optional planner deciding which ready stage starts first (priority), whether it
+            runs, waits for the running stages or is skipped (decide) and with which inputs
+            (prepare_inputs), e.g. stage_planner.YieldPlanner. A skipped stage outputs an empty list
+
+    """
+
+    def __init__(self, stages: list, max_workers: int = 4, planner=None) -> None:
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError("Duplicated stage name: {}".format(stage.name))
+            self.stages[stage.name] = stage
+        for stage in stages:
+            for dependency in stage.dependencies:
+                if dependency not in self.stages:
+                    raise ValueError(
+                        "Stage {} depends on unknown stage {}".format(
+                            stage.name, dependency
+                        )
+                    )
+        self.max_workers = max_workers
+        self.planner = planner
+        self.order = self.topological_order()
+        self.latencies = {}
+        self.skipped = []
+
+    def topological_order(self):
+        """
+        Order the stages so that every stage comes after its dependencies
+
+        Returns:
+            List of stage names
+
+        """
+        order = []
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(
+                    "Cycle between stages: {}".format(" -> ".join(path + [name]))
+                )
+            state[name] = "visiting"
+            for dependency in self.stages[name].dependencies:
+                visit(dependency, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, [])
+        return order
+
+    def run(self, completed: dict = None, on_stage_done=None):
+        """
+        Run every stage once its dependencies are done
+
+        Args:
+            completed: Dict of stage name: stage output of stages that are already done and are not run again
+            on_stage_done: Function called with the name and the output of each stage once it is done
+
+        Returns:
+            Dict of stage name: stage output
+
+        """
+        results = {
+            name: output
+            for name, output in (completed or {}).items()
+            if name in self.stages
+        }
+        self.latencies = {}
+        self.skipped = []
+        remaining = set(self.stages) - set(results)
+        running = {}
+
+        def run_stage(stage, inputs):
+            start = time.perf_counter()
+            output = stage.function(inputs)
+            return output, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while remaining or running:
+                skipped_stages = len(self.skipped)
+                ready = [
+                    name
+                    for name in self.order
+                    if name in remaining
+                    and all(
+                        dependency in results
+                        for dependency in self.stages[name].dependencies
+                    )
+                ]
+                if self.planner is not None:
+                    ready.sort(key=self.planner.priority)
+                for name in ready:
+                    stage = self.stages[name]
+                    inputs = {
+                        dependency: results[dependency]
+                        for dependency in stage.dependencies
+                    }
+                    if self.planner is not None:
+                        # Stages start one worker at a time, so each decision sees the stages running before it
+                        if len(running) >= self.max_workers:
+                            break
+                        decision = self.planner.decide(
+                            name, results, list(running.values())
+                        )
+                        if decision == "defer":
+                            continue
+                        remaining.discard(name)
+                        if decision == "skip":
+                            results[name] = []
+                            self.skipped.append(name)
+                            if on_stage_done is not None:
+                                on_stage_done(name, results[name])
+                            continue
+                        inputs = self.planner.prepare_inputs(
+                            name, inputs, results, list(running.values())
+                        )
+                    running[executor.submit(run_stage, stage, inputs)] = name
+                    remaining.discard(name)
+                if not running:
+                    if skipped_stages == len(self.skipped):
+                        break
+                    # Skipped stages are done, the stages depending on them may be ready
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name], self.latencies[name] = future.result()
+                    if on_stage_done is not None:
+                        on_stage_done(name, results[name])
+        return results
+
+    def critical_path(self, latencies: dict = None):
+        """
+        Compute the longest chain of dependent stages
+
+        Args:
+            latencies: Dict of stage name: latency in seconds. Defaults to the latencies of the last run
+
+        Returns:
+            List of stage names on the critical path and its total latency in seconds
+
+        """
+        latencies = self.latencies if latencies is None else latencies
+        finish = {}
+        previous = {}
+        for name in self.order:
+            dependencies = self.stages[name].dependencies
+            slowest = max(dependencies, key=lambda d: finish[d], default=None)
+            start = finish[slowest] if slowest is not None else 0.0
+            finish[name] = start + latencies.get(name, 0.0)
+            previous[name] = slowest
+        if not finish:
+            return [], 0.0
+        name = max(finish, key=finish.get)
+        total = finish[name]
+        path = []
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1], total
+
+    def report(self):
+        """
+        Summarize the latency of each stage and the critical path of the last run
+
+        Returns:
+            Multi-line string
+
+        """
+        lines = [
+            "{:<48} {:>8.2f}s".format(name, self.latencies[name])
+            for name in self.order
+            if name in self.latencies
+        ]
+        path, total = self.critical_path()
+        lines += ["{:<48} {:>9}".format(name, "skipped") for name in self.skipped]
+        lines.append("critical path ({:.2f}s): {}".format(total, " -> ".join(path)))
+        return "\n".join(lines)
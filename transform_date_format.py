@@ -1,7 +1,11 @@
+import calendar
+import functools
 import random
 import re
 from datetime import datetime
 
+import numpy as np
+
 
 date_formats = [
     "%d-%B-%Y",
@@ -176,3 +180,107 @@ def transform_date_type(
         new_date = datetime.strptime(new_date, "%B %d, %Y").strftime(new_date_format)
 
     return new_date
+
+
+# Shape of the dates understood by transform_date_type and transform_date_types: "September 6, 2001"
+date_pattern = re.compile(r"(\w+) (\d+), (\d{4})")
+
+
+def format_date(date_format: str, year: int, month: int, day: int):
+    """
+    Format a date with one of date_formats
+
+    Args:
+        date_format: Element of date_formats
+        year: Year
+        month: Month number, from 1 to 12
+        day: Day number, from 1 to 31
+
+    Returns:
+        Formatted date
+
+    """
+    month_name = months[month - 1]
+    day_number = days_numbers[day - 1].strip()
+    day_letters = days_letters[day - 1].capitalize()
+    if date_format == "British days_numbers":
+        # 22nd January 1999
+        return "{} {} {}".format(day_number, month_name, year)
+    elif date_format == "British days_letters":
+        # the Twenty-second of January, 1999
+        return "the {} of {}, {}".format(day_letters, month_name, year)
+    elif date_format == "American days_numbers":
+        # January 22nd, 1999
+        return "{} {}, {}".format(month_name, day_number, year)
+    elif date_format == "American days_letters":
+        # January the Twenty-second, 1999
+        return "{} the {}, {}".format(month_name, day_letters, year)
+    return datetime(year, month, day).strftime(date_format)
+
+
+@functools.lru_cache(maxsize=64)
+def date_lookup_table(year: int):
+    """
+    Precompute every date of a year in every format of date_formats
+
+    Args:
+        year: Year
+
+    Returns:
+        Array of shape (len(date_formats), 12, 31) of formatted dates (None for days a month does not have)
+        and array of the number of days of each month
+
+    """
+    month_days = np.array(days)
+    if calendar.isleap(year):
+        month_days[1] += 1
+    table = np.full((len(date_formats), 12, 31), None, dtype=object)
+    for format_index, date_format in enumerate(date_formats):
+        for month_index in range(12):
+            for day_index in range(month_days[month_index]):
+                table[format_index, month_index, day_index] = format_date(
+                    date_format, year, month_index + 1, day_index + 1
+                )
+    return table, month_days
+
+
+def transform_date_types(
+    old_date: str,
+    number_dates: int,
+    change_month: bool = True,
+    change_day: bool = True,
+    seed: int = None,
+):
+    """
+    Transform the date label into number_dates other types of date in one call.
+    The date is parsed once, months, days and formats are drawn with NumPy and the dates are read
+    from a precomputed lookup table of the year
+
+    Args:
+        old_date: date extracted form the paragraph, like "September 6, 2001"
+        number_dates: Number of new dates
+        change_month: change old_date month randomly
+        change_day: change old_date day randomly, within the number of days of the month (leap years included)
+        seed: Seed of the random draws
+
+    Returns:
+        List of new dates with different formats and values (if change_month=True or/and change_day=True)
+
+    """
+    old_date_re = date_pattern.search(old_date)
+    old_month = months.index(old_date_re.group(1).capitalize())
+    old_day = int(old_date_re.group(2))
+    year = int(old_date_re.group(3))
+
+    table, month_days = date_lookup_table(year)
+    rng = np.random.default_rng(seed)
+    format_indexes = rng.integers(0, len(date_formats), size=number_dates)
+    if change_month:
+        month_indexes = rng.integers(0, 12, size=number_dates)
+    else:
+        month_indexes = np.full(number_dates, old_month)
+    if change_day:
+        day_indexes = (rng.random(number_dates) * month_days[month_indexes]).astype(int)
+    else:
+        day_indexes = np.minimum(old_day, month_days[month_indexes]) - 1
+    return table[format_indexes, month_indexes, day_indexes].tolist()
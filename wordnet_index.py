@@ -0,0 +1,516 @@
+import argparse
+import json
+import math
+import mmap
+import os
+import random
+import re
+import string
+import zlib
+
+import numpy as np
+
+from corpus_io import read_corpus
+
+
+MAGIC = b"WNINDEX1"
+# WordNet parts of speech of the candidate lists of a word, "" being every part of speech
+POS_SLOTS = ["", "n", "v", "a", "s", "r"]
+RELATIONS = ["synonyms", "antonyms"]
+LISTS_PER_WORD = len(RELATIONS) * len(POS_SLOTS)
+HEADER_FIELDS = ["strings", "pool_bytes", "words", "candidates", "table_size"]
+
+# Tags of nltk.pos_tag mapped to WordNet parts of speech, as in nlpaug's PartOfSpeech
+TAG_POSES = {}
+for pos, tags in [
+    ("n", ["NN", "NNS", "NNP", "NNPS", "NP"]),
+    ("v", ["VB", "VBD", "VBG", "VBN", "VBZ", "VBP"]),
+    ("a", ["JJ", "JJR", "JJS", "IN"]),
+    ("s", ["JJ", "JJR", "JJS", "IN"]),
+    ("r", ["RB", "RBR", "RBS"]),
+]:
+    for tag in tags:
+        TAG_POSES.setdefault(tag, []).append(pos)
+# Like nlpaug's AntonymAug, only verbs, adjectives and adverbs are replaced by an antonym
+ANTONYM_TAGS = {
+    "VB",
+    "VBD",
+    "VBZ",
+    "VBG",
+    "VBN",
+    "VBP",
+    "JJ",
+    "JJR",
+    "JJS",
+    "RB",
+    "RBR",
+    "RBS",
+}
+
+# Tokenization of nlpaug's word augmenters
+TOKENIZER_REGEX = re.compile(r"(\W)")
+DETOKENIZER_REGEXS = [
+    (re.compile(r"\s([.,:;?!%]+)([ \'\"`])"), r"\1\2"),
+    (re.compile(r"\s([.,:;?!%]+)$"), r"\1"),
+    (re.compile(r"\s([\[\(\{\<])\s"), r" \g<1>"),
+    (re.compile(r"\s([\]\)\}\>])\s"), r"\g<1> "),
+]
+
+
+def tokenize(text: str):
+    return [token for token in TOKENIZER_REGEX.split(text) if token.strip()]
+
+
+def detokenize(tokens: list):
+    text = " ".join(tokens)
+    for regex, substitution in DETOKENIZER_REGEXS:
+        text = regex.sub(substitution, text)
+    return text.strip()
+
+
+def pos_tag(tokens: list):
+    """
+    Tag the tokens with nltk's perceptron tagger, downloading it on first use like nlpaug
+
+    """
+    import nltk
+
+    try:
+        return nltk.pos_tag(tokens)
+    except LookupError:
+        nltk.download("averaged_perceptron_tagger")
+        return nltk.pos_tag(tokens)
+
+
+def normalize_candidates(word: str, candidates: list):
+    """
+    Drop the candidates equal to the word and write the others as nlpaug substitutes them:
+    lower case, with spaces instead of underscores and hyphens
+
+    """
+    return [
+        candidate.replace("_", " ").replace("-", " ").lower()
+        for candidate in candidates
+        if candidate.lower() != word
+    ]
+
+
+def wordnet_relations(words, lang: str = "eng"):
+    """
+    Look up the synonyms and antonyms of words in NLTK WordNet, as nlpaug's WordNet model does
+
+    Args:
+        words: Iterable of lower case words
+        lang: WordNet language
+
+    Returns:
+        Generator of word, dict of relation: dict of part of speech: candidates
+
+    """
+    from nltk.corpus import wordnet
+
+    for word in words:
+        relations = {relation: {} for relation in RELATIONS}
+        for pos in POS_SLOTS:
+            synonyms = []
+            antonyms = []
+            for synset in wordnet.synsets(word, pos=pos or None, lang=lang):
+                for lemma in synset.lemmas(lang=lang):
+                    synonyms.append(lemma.name())
+                    antonyms += [antonym.name() for antonym in lemma.antonyms()]
+            relations["synonyms"][pos] = synonyms
+            relations["antonyms"][pos] = antonyms
+        yield word, relations
+
+
+def slice_relations(path: str):
+    """
+    Read the synonyms and antonyms of a JSON WordNet slice of word: {"synonyms": [...], "antonyms": [...]}.
+    The slice has no part of speech, its candidates are used for every part of speech
+
+    """
+    with open(path, encoding="utf-8") as wordnet_slice:
+        words = json.load(wordnet_slice)
+    for word, relations in words.items():
+        yield word.lower(), {
+            relation: {pos: relations.get(relation, []) for pos in POS_SLOTS}
+            for relation in RELATIONS
+        }
+
+
+def vocabulary_words(path: str):
+    """
+    Lower case words of a text file, or of the paragraphs of a JSONL corpus
+
+    """
+    words = set()
+    if path.endswith((".jsonl", ".jsonl.gz")):
+        texts = (record["paragraph"] for record in read_corpus(path))
+        for text in texts:
+            words.update(token.lower() for token in tokenize(text))
+    else:
+        with open(path, encoding="utf-8") as texts:
+            for text in texts:
+                words.update(token.lower() for token in tokenize(text))
+    return words
+
+
+def word_hash(word: bytes):
+    return zlib.crc32(word)
+
+
+def write_index(path: str, relations):
+    """
+    Write a WordNet index: a string pool with uint32 offsets, the candidate lists of each word as
+    uint32 string ids, and an open addressing hash table of the words. Every array is aligned so it
+    can be mapped from the file without copy
+
+    Args:
+        path: Path of the index file
+        relations: Iterable of word, dict of relation: dict of part of speech: candidates
+
+    Returns:
+        Number of indexed words
+
+    """
+    string_ids = {}
+    strings = []
+
+    def string_id(text: str):
+        if text not in string_ids:
+            string_ids[text] = len(strings)
+            strings.append(text)
+        return string_ids[text]
+
+    word_ids = []
+    list_offsets = [0]
+    candidates = []
+    for word, word_relations in relations:
+        lists = [
+            normalize_candidates(word, word_relations[relation].get(pos, []))
+            for relation in RELATIONS
+            for pos in POS_SLOTS
+        ]
+        if not any(lists):
+            continue
+        word_ids.append(string_id(word))
+        for candidate_list in lists:
+            candidates += [string_id(candidate) for candidate in candidate_list]
+            list_offsets.append(len(candidates))
+
+    encoded = [text.encode("utf-8") for text in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    np.cumsum([len(text) for text in encoded], out=string_offsets[1:])
+    pool = b"".join(encoded)
+    # Load factor of at most one half, so a lookup probes about one slot
+    table_size = 1 << max(1, math.ceil(math.log2(2 * max(1, len(word_ids)))))
+    table = np.full(table_size, -1, dtype=np.int32)
+    for word_index, word_id in enumerate(word_ids):
+        slot = word_hash(encoded[word_id]) & (table_size - 1)
+        while table[slot] >= 0:
+            slot = (slot + 1) & (table_size - 1)
+        table[slot] = word_index
+
+    arrays = [
+        string_offsets,
+        np.array(word_ids, dtype=np.uint32),
+        np.array(list_offsets, dtype=np.uint32),
+        np.array(candidates, dtype=np.uint32),
+        table,
+    ]
+    header = np.array(
+        [len(encoded), len(pool), len(word_ids), len(candidates), table_size],
+        dtype=np.uint64,
+    )
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as index:
+        index.write(MAGIC)
+        index.write(header.tobytes())
+        for array in arrays:
+            index.write(array.tobytes())
+        index.write(pool)
+    os.replace(temporary_path, path)
+    return len(word_ids)
+
+
+class WordNetIndex:
+    """
+    Read-only WordNet index mapped from its file. The arrays are views of the mapping, so the pages
+    of the index are shared by every process opening it and only the looked up parts are read
+
+    Args:
+        path: Path of the index written by write_index
+
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as index:
+            self.buffer = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[: len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a WordNet index".format(path))
+        offset = len(MAGIC)
+        header = np.frombuffer(
+            self.buffer, dtype=np.uint64, count=len(HEADER_FIELDS), offset=offset
+        )
+        self.sizes = dict(zip(HEADER_FIELDS, (int(size) for size in header)))
+        offset += header.nbytes
+        arrays = {}
+        for name, dtype, count in [
+            ("string_offsets", np.uint32, self.sizes["strings"] + 1),
+            ("word_ids", np.uint32, self.sizes["words"]),
+            ("list_offsets", np.uint32, self.sizes["words"] * LISTS_PER_WORD + 1),
+            ("candidates", np.uint32, self.sizes["candidates"]),
+            ("table", np.int32, self.sizes["table_size"]),
+        ]:
+            arrays[name] = np.frombuffer(
+                self.buffer, dtype=dtype, count=count, offset=offset
+            )
+            offset += arrays[name].nbytes
+        self.string_offsets = arrays["string_offsets"]
+        self.word_ids = arrays["word_ids"]
+        self.list_offsets = arrays["list_offsets"]
+        self.candidate_ids = arrays["candidates"]
+        self.table = arrays["table"]
+        self.pool_offset = offset
+        self.mask = self.sizes["table_size"] - 1
+
+    def string(self, string_id: int):
+        start = self.pool_offset + int(self.string_offsets[string_id])
+        end = self.pool_offset + int(self.string_offsets[string_id + 1])
+        return self.buffer[start:end].decode("utf-8")
+
+    def find(self, word: str):
+        """
+        Find the index of a word in the hash table
+
+        Returns:
+            Index of the word, or None if it is not indexed
+
+        """
+        encoded = word.encode("utf-8")
+        slot = word_hash(encoded) & self.mask
+        while True:
+            word_index = int(self.table[slot])
+            if word_index < 0:
+                return None
+            word_id = int(self.word_ids[word_index])
+            start = self.pool_offset + int(self.string_offsets[word_id])
+            end = self.pool_offset + int(self.string_offsets[word_id + 1])
+            if self.buffer[start:end] == encoded:
+                return word_index
+            slot = (slot + 1) & self.mask
+
+    def candidates(self, word: str, relation: str = "synonyms", poses: list = None):
+        """
+        Get the substitutes of a word
+
+        Args:
+            word: Word, looked up in lower case
+            relation: "synonyms" or "antonyms"
+            poses: WordNet parts of speech of the word. Every part of speech is used if it is empty
+
+        Returns:
+            List of substitutes, without the word itself. A substitute found for several parts of
+            speech or senses is repeated, as nlpaug samples it
+
+        """
+        word_index = self.find(word.lower())
+        if word_index is None:
+            return []
+        first_list = word_index * LISTS_PER_WORD + RELATIONS.index(relation) * len(
+            POS_SLOTS
+        )
+        results = []
+        for pos in poses or [""]:
+            list_index = first_list + POS_SLOTS.index(pos)
+            start = int(self.list_offsets[list_index])
+            end = int(self.list_offsets[list_index + 1])
+            results += [
+                self.string(int(string_id))
+                for string_id in self.candidate_ids[start:end]
+            ]
+        return results
+
+    def __len__(self) -> int:
+        return self.sizes["words"]
+
+
+# Indexes opened by the current process, shared by its augmenters
+opened_indexes = {}
+
+
+def open_index(path: str):
+    path = os.path.abspath(path)
+    if path not in opened_indexes:
+        opened_indexes[path] = WordNetIndex(path)
+    return opened_indexes[path]
+
+
+def get_word_case(word: str):
+    # Case of a word, as nlpaug's WordAugmenter.get_word_case
+    if not word:
+        return "empty"
+    if len(word) == 1 and word.isupper():
+        return "capitalize"
+    if word.isupper():
+        return "upper"
+    if word.islower():
+        return "lower"
+    if any(character.isupper() for character in word[1:]):
+        return "mixed"
+    if word[0].isupper():
+        return "capitalize"
+    return "unknown"
+
+
+def align_capitalization(source: str, destination: str):
+    if get_word_case(source) == "capitalize" and get_word_case(destination) == "lower":
+        return destination.capitalize()
+    return destination
+
+
+class WordNetIndexAugmenter:
+    """
+    Synonym or antonym augmenter sampling its substitutes from a WordNet index, with the algorithm of
+    nlpaug's SynonymAug and AntonymAug: the same tokenization, part of speech tags, number of
+    augmented words and candidates, without loading the WordNet corpus
+
+    Args:
+        index_path: Path of the index written by write_index
+        relation: "synonyms" or "antonyms"
+        aug_p: Percentage of the words augmented. Defaults to 0.3 for synonyms and 0.1 for antonyms, as in nlpaug
+        aug_min: Minimum number of words augmented
+        aug_max: Maximum number of words augmented
+
+    """
+
+    def __init__(
+        self,
+        index_path: str,
+        relation: str = "synonyms",
+        aug_p: float = None,
+        aug_min: int = 1,
+        aug_max: int = 10,
+    ) -> None:
+        if relation not in RELATIONS:
+            raise ValueError(
+                "Unknown relation {}, expected one of {}".format(
+                    relation, ", ".join(RELATIONS)
+                )
+            )
+        self.index = open_index(index_path)
+        self.relation = relation
+        self.aug_p = aug_p or (0.3 if relation == "synonyms" else 0.1)
+        self.aug_min = aug_min
+        self.aug_max = aug_max
+
+    def augment_count(self, size: int):
+        if size == 0:
+            return 0
+        return min(max(int(math.ceil(self.aug_p * size)), self.aug_min), self.aug_max)
+
+    def candidates(self, word: str, tag: str):
+        return self.index.candidates(word, self.relation, TAG_POSES.get(tag))
+
+    def substitute(self, text: str, rng=random):
+        """
+        Substitute words of a text
+
+        Args:
+            text: Text to augment
+            rng: random.Random instance or the random module
+
+        Returns:
+            Augmented text, or the text itself if no word has a substitute
+
+        """
+        tokens = tokenize(text)
+        tags = [tag for _, tag in pos_tag(tokens)]
+        positions = [
+            position
+            for position, token in enumerate(tokens)
+            if token not in string.punctuation
+        ]
+        if self.relation == "synonyms":
+            # SynonymAug draws among the words but the determiners, whether they have a synonym or not
+            positions = [position for position in positions if tags[position] != "DT"]
+            count = min(self.augment_count(len(tokens)), len(positions))
+            positions = rng.sample(positions, count)
+        else:
+            # AntonymAug draws among the verbs, adjectives and adverbs having an antonym
+            positions = [
+                position
+                for position in positions
+                if tags[position] in ANTONYM_TAGS
+                and self.candidates(tokens[position], tags[position])
+            ]
+            count = min(self.augment_count(len(tokens)), len(positions))
+            positions = rng.sample(positions, count)
+        if not positions:
+            return text
+
+        for position in positions:
+            candidates = self.candidates(tokens[position], tags[position])
+            if candidates:
+                tokens[position] = align_capitalization(
+                    tokens[position], rng.choice(candidates)
+                )
+        return detokenize(tokens)
+
+    def augment(self, text: str, n: int = 1, rng=random):
+        """
+        Augment a text n times
+
+        Args:
+            text: Text to augment
+            n: Number of augmented texts
+            rng: random.Random instance or the random module
+
+        Returns:
+            List of n augmented texts, empty for an empty text
+
+        """
+        text = text.strip()
+        if not text:
+            return []
+        return [self.substitute(text, rng) for _ in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the WordNet synonym and antonym index of the WordNet augmenters"
+    )
+    parser.add_argument("output", help="Path of the index file")
+    parser.add_argument(
+        "--vocabulary",
+        nargs="+",
+        default=[],
+        help="Text files or JSONL corpora whose words are indexed as well, with their inflected forms",
+    )
+    parser.add_argument(
+        "--slice",
+        help="Build the index from a JSON WordNet slice instead of NLTK WordNet",
+    )
+    parser.add_argument("--lang", default="eng", help="WordNet language")
+    args = parser.parse_args()
+
+    if args.slice:
+        relations = slice_relations(args.slice)
+    else:
+        from nltk.corpus import wordnet
+
+        words = {lemma.lower() for lemma in wordnet.all_lemma_names(lang=args.lang)}
+        for path in args.vocabulary:
+            words |= vocabulary_words(path)
+        relations = wordnet_relations(sorted(words), args.lang)
+    words = write_index(args.output, relations)
+    print(
+        "{} words indexed in {} ({:.1f} MB)".format(
+            words, args.output, os.path.getsize(args.output) / (1024 * 1024)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import torch
+
+
+# nlpaug's padding text: XLNet is not good on short inputs, a text is prepended to every prefix
+# https://github.com/rusiaaman/XLNet-gen#methodology
+PADDING_TEXT = """
+    The quick brown fox jumps over the lazy dog. A horrible, messy split second presents
+    itself to the heart-shaped version as Scott is moved. The upcoming movie benefits at
+    the mental cost of ages 14 to 12. Nothing substantial is happened for almost 48 days.
+    When that happens, we lose our heart. <eod>
+"""
+MASK_TOKEN = "<mask>"
+SENTENCE_SEPARATORS = ".!?"
+
+
+class XLNetAugmenter:
+    """
+    Batched version of nlpaug's ContextualWordEmbsForSentenceAug for XLNet models: it completes a
+    prefix with new words until the end of a sentence.
+    nlpaug encodes the padding text, the prefix and the words generated so far again for every word of
+    every variant. Here each prefix is encoded once, its hidden states are kept as the mems of the model
+    and shared by the n variants of the prefix, which are sampled together. Each step then only runs the
+    last generated word and the predicted position, for all the variants of all the prefixes of a batch.
+    A variant stops at its first sentence separator, and the batch once all of its variants stopped.
+    Unlike nlpaug, the words of the prefix do not attend to the generated words
+
+    Args:
+        model_path: Model name or model path of an XLNet model
+        temperature: Temperature of the next word probabilities
+        top_k: Number of most probable words the next word is sampled from
+        max_new_tokens: Maximum number of tokens generated per variant, as nlpaug tries
+        batch_size: Maximum number of variants generated together
+        max_retries: Number of times the variants duplicating another one are generated again
+        padding_text: Text prepended to the prefixes, nlpaug's padding text by default
+        device: Torch device of the model
+
+    """
+
+    def __init__(
+        self,
+        model_path: str = "xlnet-base-cased",
+        temperature: float = 1.0,
+        top_k: int = 50,
+        max_new_tokens: int = 30,
+        batch_size: int = 64,
+        max_retries: int = 3,
+        padding_text: str = None,
+        device: str = "cpu",
+    ) -> None:
+        self.model_path = model_path
+        self.temperature = temperature
+        self.max_new_tokens = max_new_tokens
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.device = device
+        # Imported on first use, the stage threads only start once NLPAugmenters.import_models has run
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        # Without mem_len, the model returns the hidden states of every position as its mems
+        self.model = (
+            AutoModelForCausalLM.from_pretrained(model_path, mem_len=None)
+            .to(device)
+            .eval()
+        )
+        self.mask_id = self.tokenizer.convert_tokens_to_ids(MASK_TOKEN)
+        self.padding_ids = self.tokenizer.encode(
+            PADDING_TEXT if padding_text is None else padding_text,
+            add_special_tokens=False,
+        )
+
+        # Logit bias removing the tokens nlpaug never picks: special and unknown tokens and the bare
+        # word prefix of sentencepiece
+        vocab = self.tokenizer.get_vocab()
+        excluded_ids = set(self.tokenizer.all_special_ids)
+        excluded_ids.update(
+            index for token, index in vocab.items() if token in ("", "▁")
+        )
+        self.logit_bias = torch.zeros(self.model.config.vocab_size, device=device)
+        self.logit_bias[sorted(excluded_ids)] = float("-inf")
+        self.top_k = min(top_k, self.model.config.vocab_size - len(excluded_ids))
+        self.sentence_end = torch.zeros(
+            self.model.config.vocab_size, dtype=torch.bool, device=device
+        )
+        self.sentence_end[
+            [
+                index
+                for token, index in vocab.items()
+                if token.lstrip("▁") and token.lstrip("▁") in SENTENCE_SEPARATORS
+            ]
+        ] = True
+
+    def augment(self, texts: list, n: int = 5, seeds: list = None):
+        """
+        Complete each text n times
+
+        Args:
+            texts: Prefixes to complete
+            n: Number of unique completions per prefix
+            seeds: Optional seed per text. The variants of a prefix are then sampled from their own
+                generator, so they do not depend on the other prefixes of the call
+
+        Returns:
+            List of completed texts per text, in the order of texts. Fewer than n completions are
+            returned when the retries still give duplicates, and none for empty texts
+
+        """
+        prefixes = {}
+        generators = {}
+        for index, text in enumerate(texts):
+            text = text.strip()
+            if text and text not in prefixes:
+                prefixes[text] = self.tokenizer.encode(text, add_special_tokens=False)
+                if seeds is not None:
+                    generators[text] = torch.Generator(device=self.device)
+                    generators[text].manual_seed(seeds[index])
+        completions = {prefix: [] for prefix in prefixes}
+        for batch in self.prefix_batches(prefixes, n):
+            logits, mems = self.encode_prefixes([prefixes[prefix] for prefix in batch])
+            counts = [n] * len(batch)
+            for _ in range(self.max_retries + 1):
+                outputs = self.generate(
+                    logits,
+                    mems,
+                    counts,
+                    [generators[prefix] for prefix in batch] if generators else None,
+                )
+                for index, prefix in enumerate(batch):
+                    for token_ids in outputs[index]:
+                        completion = self.detokenize(prefix, token_ids)
+                        if completion not in completions[prefix]:
+                            completions[prefix].append(completion)
+                    counts[index] = n - len(completions[prefix])
+                if not any(counts):
+                    break
+        return [completions.get(text.strip(), []) for text in texts]
+
+    def prefix_batches(self, prefixes: dict, n: int):
+        """
+        Group the prefixes into batches of at most batch_size variants. The prefixes of a batch are
+        brought to the same length by dropping the first tokens of the padding text of the longer ones,
+        so a batch needs no padding token, which the mems could not mask. Prefixes are grouped by
+        length buckets as wide as the padding text, so the tokens a prefix is encoded with only
+        depend on its own length
+
+        Returns:
+            List of lists of prefixes
+
+        """
+        batches = []
+        per_batch = max(self.batch_size // max(n, 1), 1)
+        width = max(len(self.padding_ids), 1)
+        for prefix in sorted(prefixes, key=lambda prefix: len(prefixes[prefix])):
+            if (
+                not batches
+                or len(batches[-1]) >= per_batch
+                or len(prefixes[prefix]) // width
+                != len(prefixes[batches[-1][0]]) // width
+            ):
+                batches.append([])
+            batches[-1].append(prefix)
+        return batches
+
+    def encode_prefixes(self, prefixes: list):
+        """
+        Run the padding text and the prefixes once, predicting the first new token
+
+        Returns:
+            Logits of the first new token of each prefix, and the mems of the prefixes
+
+        """
+        # Same bucket start for every prefix of a batch, see prefix_batches
+        width = max(len(self.padding_ids), 1)
+        start = min(len(ids) for ids in prefixes) // width * width
+        sequences = [
+            self.padding_ids[len(ids) - start :] + ids + [self.mask_id]
+            for ids in prefixes
+        ]
+        return self.predict(torch.tensor(sequences, device=self.device), None)
+
+    def predict(self, input_ids, mems):
+        """
+        Predict the token of the last position of input_ids, which holds the mask token. No position
+        attends to it, and its hidden states are dropped from the returned mems
+
+        Returns:
+            Logits of the predicted tokens and the mems of the other positions
+
+        """
+        batch_size, length = input_ids.shape
+        perm_mask = torch.zeros((batch_size, length, length), device=self.device)
+        perm_mask[:, :, -1] = 1.0
+        target_mapping = torch.zeros((batch_size, 1, length), device=self.device)
+        target_mapping[:, 0, -1] = 1.0
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids,
+                perm_mask=perm_mask,
+                target_mapping=target_mapping,
+                mems=mems,
+                use_mems=True,
+            )
+        return outputs["logits"][:, 0], [mem[:-1] for mem in outputs["mems"]]
+
+    def sample(self, logits, generators: list = None):
+        """
+        Sample one token per row among the top_k allowed tokens
+
+        Args:
+            logits: Logits of the rows
+            generators: Optional torch generator of each row, the rows are then sampled one at a time
+
+        """
+        candidates = (logits / self.temperature + self.logit_bias).topk(self.top_k)
+        probabilities = torch.softmax(candidates.values, dim=-1)
+        if generators is None:
+            choices = torch.multinomial(probabilities, 1)
+        else:
+            choices = torch.stack(
+                [
+                    torch.multinomial(row, 1, generator=generator)
+                    for row, generator in zip(probabilities, generators)
+                ]
+            )
+        return candidates.indices.gather(1, choices).squeeze(1)
+
+    def generate(self, logits, mems, counts: list, generators: list = None):
+        """
+        Generate the variants of the prefixes of a batch from their shared logits and mems
+
+        Args:
+            logits: Logits of the first new token of each prefix
+            mems: Mems of the prefixes
+            counts: Number of variants of each prefix
+            generators: Optional torch generator of each prefix, shared by its variants
+
+        Returns:
+            List of the generated token ids of each variant, per prefix
+
+        """
+        repeats = torch.tensor(counts, device=self.device)
+        prefix_of_row = torch.repeat_interleave(
+            torch.arange(len(counts), device=self.device), repeats
+        )
+        generated = [[] for _ in range(len(prefix_of_row))]
+        active = torch.arange(len(prefix_of_row), device=self.device)
+        mems = [mem[:, prefix_of_row] for mem in mems]
+        row_generators = None
+        if generators is not None:
+            row_generators = [generators[index] for index in prefix_of_row.tolist()]
+        tokens = self.sample(logits[prefix_of_row], row_generators)
+        for step in range(self.max_new_tokens):
+            for row, token in zip(active.tolist(), tokens.tolist()):
+                generated[row].append(token)
+            running = ~self.sentence_end[tokens]
+            if step == self.max_new_tokens - 1 or not running.any():
+                break
+            active = active[running]
+            if row_generators is not None:
+                row_generators = [
+                    row_generators[row] for row in running.nonzero().flatten().tolist()
+                ]
+            mems = [mem[:, running] for mem in mems]
+            mask_ids = torch.full_like(tokens[running], self.mask_id)
+            logits, mems = self.predict(
+                torch.stack([tokens[running], mask_ids], dim=1), mems
+            )
+            tokens = self.sample(logits, row_generators)
+        outputs = [[] for _ in counts]
+        for row, prefix_index in enumerate(prefix_of_row.tolist()):
+            outputs[prefix_index].append(generated[row])
+        return outputs
+
+    def detokenize(self, prefix: str, token_ids: list):
+        completion = self.tokenizer.decode(
+            token_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True
+        ).strip()
+        return prefix + " " + completion